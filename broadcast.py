@@ -0,0 +1,351 @@
+# broadcast.py
+
+import asyncio
+import logging
+import time
+from collections import Counter
+from typing import AsyncIterable, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramAPIError, TelegramBadRequest, TelegramForbiddenError,
+    TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+)
+
+from database import BroadcastJob, db
+from keyboards import get_broadcast_progress_keyboard, get_main_keyboard_by_role
+from localization import get_text
+from middlewares import profile_cache
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows roughly 30 messages per second across all chats
+RATE_LIMIT = 30
+CONCURRENCY = 20
+MAX_RETRIES = 3
+MAX_RETRY_AFTER_ROUNDS = 5
+
+# --- Delivery Statuses ---
+SENT = 'sent'
+BLOCKED = 'blocked'          # the user blocked the bot
+DEACTIVATED = 'deactivated'  # the account was deleted
+NOT_FOUND = 'not_found'      # chat not found / never started the bot
+FAILED = 'failed'            # any other error, including exhausted retries
+
+def classify_error(error: TelegramAPIError) -> str:
+    """Maps a Telegram API error to a delivery status."""
+    text = str(error).lower()
+    if isinstance(error, TelegramForbiddenError):
+        return DEACTIVATED if 'deactivated' in text else BLOCKED
+    if isinstance(error, TelegramBadRequest) and ('chat not found' in text or 'user not found' in text):
+        return NOT_FOUND
+    return FAILED
+
+# User delivery status recorded when a send fails with one of these statuses
+USER_DELIVERY_STATUSES = {BLOCKED: 'blocked', DEACTIVATED: 'deactivated', NOT_FOUND: 'unreachable'}
+
+async def record_delivery_error(user_id: int, error: TelegramAPIError) -> None:
+    """Marks the user dead if the error means they can no longer be reached."""
+    delivery_status = USER_DELIVERY_STATUSES.get(classify_error(error))
+    if delivery_status:
+        await db.set_delivery_status([(user_id, delivery_status)])
+        profile_cache.invalidate(user_id)
+
+def is_transient(error: Exception) -> bool:
+    return isinstance(error, (TelegramNetworkError, TelegramServerError))
+
+# --- Rate Limiting ---
+
+class TokenBucket:
+    """
+    Token bucket shared by all senders.
+
+    On RetryAfter every sender is paused for the requested time and the rate
+    is cut, then it creeps back up to the configured limit while sends succeed.
+    """
+
+    def __init__(self, rate: float = RATE_LIMIT, capacity: Optional[float] = None):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def throttle(self, retry_after: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+        self.rate = max(1.0, self.rate * 0.7)
+        # Tokens only accrue again once the pause is over
+        self._tokens = 0
+        self._updated = self._paused_until
+
+    def recover(self) -> None:
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + 0.1)
+
+# --- Engine ---
+
+class BroadcastStats:
+    def __init__(self):
+        self.counts = Counter()
+
+    @property
+    def success_count(self) -> int:
+        return self.counts[SENT]
+
+    @property
+    def fail_count(self) -> int:
+        return sum(self.counts.values()) - self.counts[SENT]
+
+SendCallback = Callable[[int], Awaitable]
+ResultCallback = Callable[[int, str], Union[Awaitable[None], None]]
+
+class BroadcastEngine:
+    """Delivers one send() per recipient with bounded concurrency under a shared rate limit."""
+
+    def __init__(self, rate: float = RATE_LIMIT, concurrency: int = CONCURRENCY,
+                 max_retries: int = MAX_RETRIES):
+        self.bucket = TokenBucket(rate)
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+
+    async def deliver(self, chat_id: int, send: SendCallback) -> str:
+        """Sends to one recipient, retrying RetryAfter and transient errors. Returns the status."""
+        attempts = throttled = 0
+        while True:
+            await self.bucket.acquire()
+            try:
+                await send(chat_id)
+            except TelegramRetryAfter as e:
+                throttled += 1
+                logger.warning("RetryAfter %ss while sending to %s", e.retry_after, chat_id)
+                self.bucket.throttle(e.retry_after)
+                if throttled > MAX_RETRY_AFTER_ROUNDS:
+                    return FAILED
+                continue
+            except TelegramAPIError as e:
+                attempts += 1
+                if is_transient(e) and attempts <= self.max_retries:
+                    await asyncio.sleep(2 ** attempts)
+                    continue
+                status = classify_error(e)
+                logger.info("Failed to send to %s (%s): %s", chat_id, status, e)
+                return status
+            self.bucket.recover()
+            return SENT
+
+    async def run(self, recipients: Union[Iterable[int], AsyncIterable[int]], send: SendCallback,
+                  on_result: Optional[ResultCallback] = None,
+                  cancel: Optional[asyncio.Event] = None) -> BroadcastStats:
+        """
+        Sends to every recipient and returns per-status counts.
+        Recipients may be an async iterator, so they can be streamed from the DB.
+        """
+        stats = BroadcastStats()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+
+        async def worker():
+            while True:
+                chat_id = await queue.get()
+                if chat_id is None:
+                    queue.task_done()
+                    return
+                try:
+                    if cancel is not None and cancel.is_set():
+                        continue
+                    status = await self.deliver(chat_id, send)
+                    stats.counts[status] += 1
+                    if on_result is not None:
+                        result = on_result(chat_id, status)
+                        if asyncio.iscoroutine(result):
+                            await result
+                finally:
+                    queue.task_done()
+
+        async def produce():
+            if hasattr(recipients, '__aiter__'):
+                async for chat_id in recipients:
+                    if cancel is not None and cancel.is_set():
+                        break
+                    await queue.put(chat_id)
+            else:
+                for chat_id in recipients:
+                    if cancel is not None and cancel.is_set():
+                        break
+                    await queue.put(chat_id)
+            for _ in workers:
+                await queue.put(None)
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        tasks = [asyncio.create_task(produce()), *workers]
+        try:
+            # A failing on_result kills its worker; raise it rather than let the
+            # producer wait for queue space that no worker will ever free
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            errors = [task.exception() for task in done if task.exception() is not None]
+            if errors:
+                raise errors[0]
+        finally:
+            for task in tasks:
+                task.cancel()
+        return stats
+
+broadcast_engine = BroadcastEngine()
+
+# --- Persistent Jobs ---
+# A job's recipients live in broadcast_recipients. They are claimed in small
+# chunks ('pending' -> 'sending') and their results are checkpointed in batches,
+# so a restarted bot picks a running job up where it stopped.
+
+CLAIM_SIZE = CONCURRENCY * 2
+CHECKPOINT_SIZE = 200
+CHECKPOINT_INTERVAL = 2.0  # seconds
+PROGRESS_INTERVAL = 5.0    # seconds
+
+_active_jobs: Dict[int, asyncio.Event] = {}
+_job_tasks: Set[asyncio.Task] = set()
+
+def start_broadcast_job(bot: Bot, job: BroadcastJob) -> None:
+    """Runs the job in the background."""
+    cancel = _active_jobs[job.id] = asyncio.Event()
+    task = asyncio.create_task(_run_job(bot, job, cancel))
+    _job_tasks.add(task)
+    task.add_done_callback(_job_tasks.discard)
+
+def stop_broadcast_job(job_id: int) -> bool:
+    """Asks a running job to stop. Returns False if it is not running here."""
+    cancel = _active_jobs.get(job_id)
+    if cancel is None:
+        return False
+    cancel.set()
+    return True
+
+async def resume_broadcast_jobs(bot: Bot, owns: Optional[Callable[[int], bool]] = None) -> None:
+    """
+    Restarts jobs that were still running when the bot stopped. With `owns`,
+    only jobs of the admins it accepts, so each worker process resumes the
+    jobs its admins can stop.
+    """
+    for job in await db.list_running_broadcast_jobs():
+        if owns is not None and not owns(job.admin_id):
+            continue
+        await db.release_broadcast_recipients(job.id)
+        logger.info("Resuming broadcast job %s", job.id)
+        start_broadcast_job(bot, job)
+
+async def _run_job(bot: Bot, job: BroadcastJob, cancel: asyncio.Event) -> None:
+    counts = await db.get_broadcast_counts(job.id)
+    # Languages with their own version of the message; the rest get job.message_id
+    messages = await db.get_broadcast_messages(job.id)
+    languages: Dict[int, str] = {}
+    done_before = sum(count for status, count in counts.items() if status not in ('pending', 'sending'))
+    sent_before = counts.get(SENT, 0)
+
+    stats = BroadcastStats()
+    checkpoint: List[Tuple[int, str]] = []
+    last_flush = last_progress = time.monotonic()
+
+    def progress_text(key: str) -> str:
+        success_count = sent_before + stats.success_count
+        return get_text(key, job.lang).format(
+            done=done_before + sum(stats.counts.values()),
+            total=job.total,
+            success_count=success_count,
+            fail_count=done_before - sent_before + stats.fail_count
+        )
+
+    async def flush() -> None:
+        nonlocal last_flush
+        batch = checkpoint[:]
+        checkpoint.clear()
+        last_flush = time.monotonic()
+        if batch:
+            dead = [(user_id, USER_DELIVERY_STATUSES[status]) for user_id, status in batch
+                    if status in USER_DELIVERY_STATUSES]
+            await db.save_broadcast_results(job.id, batch, dead)
+            for user_id, _ in dead:
+                profile_cache.invalidate(user_id)
+
+    async def on_result(user_id: int, status: str) -> None:
+        nonlocal last_progress
+        languages.pop(user_id, None)
+        stats.counts[status] += 1
+        checkpoint.append((user_id, status))
+        now = time.monotonic()
+        if len(checkpoint) >= CHECKPOINT_SIZE or now - last_flush >= CHECKPOINT_INTERVAL:
+            await flush()
+        if now - last_progress >= PROGRESS_INTERVAL:
+            last_progress = now
+            await _edit_status(bot, job, progress_text('mass_send_progress'),
+                               get_broadcast_progress_keyboard(job.id, job.lang))
+
+    async def recipients():
+        after_user_id = 0
+        while not cancel.is_set():
+            rows = await db.claim_broadcast_recipients(
+                job.id, after_user_id, CLAIM_SIZE, with_languages=bool(messages)
+            )
+            if not rows:
+                return
+            for user_id, language_code in rows:
+                if messages:
+                    languages[user_id] = language_code or 'en'
+                yield user_id
+            after_user_id = rows[-1][0]
+
+    async def send(user_id: int) -> None:
+        message_id = messages.get(languages.get(user_id), job.message_id)
+        await bot.copy_message(chat_id=user_id, from_chat_id=job.from_chat_id, message_id=message_id)
+
+    try:
+        # The engine records each result itself through on_result
+        await broadcast_engine.run(recipients(), send, on_result=on_result, cancel=cancel)
+        await flush()
+        if cancel.is_set():
+            # Claimed but never sent: hand them back as pending
+            await db.release_broadcast_recipients(job.id, status='pending')
+            await db.finish_broadcast_job(job.id, 'cancelled')
+            result_key = 'mass_send_stopped'
+        else:
+            await db.finish_broadcast_job(job.id, 'finished')
+            result_key = 'mass_send_finished'
+    except Exception:
+        logger.exception("Broadcast job %s crashed; it will resume on restart", job.id)
+        return
+    finally:
+        _active_jobs.pop(job.id, None)
+
+    await _edit_status(bot, job, progress_text('mass_send_progress'), None)
+    try:
+        await bot.send_message(
+            chat_id=job.status_chat_id,
+            text=progress_text(result_key),
+            reply_markup=get_main_keyboard_by_role(is_admin=True, lang=job.lang)
+        )
+    except TelegramAPIError as e:
+        logger.warning("Failed to report broadcast job %s result: %s", job.id, e)
+
+async def _edit_status(bot: Bot, job: BroadcastJob, text: str, reply_markup) -> None:
+    try:
+        await bot.edit_message_text(
+            chat_id=job.status_chat_id, message_id=job.status_message_id,
+            text=text, reply_markup=reply_markup
+        )
+    except TelegramAPIError:
+        # "message is not modified" or the admin deleted the status message
+        pass
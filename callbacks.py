@@ -0,0 +1,122 @@
+# callbacks.py
+
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple, Type, Union
+
+from aiogram import Router
+from aiogram.dispatcher.event.handler import CallableObject
+from aiogram.filters.callback_data import CallbackData
+from aiogram.fsm.state import State
+from aiogram.types import CallbackQuery
+
+SEPARATOR = ":"  # aiogram's CallbackData separator
+
+# --- Payloads ---
+# Prefixes are kept to two letters so even 64-bit ids and page cursors stay
+# far below Telegram's 64-byte callback_data limit.
+
+class UsersPage(CallbackData, prefix="up"):
+    after: Optional[int] = None
+    before: Optional[int] = None
+
+class ConfigUsersPage(CallbackData, prefix="cp"):
+    after: Optional[int] = None
+    before: Optional[int] = None
+
+class SearchPage(CallbackData, prefix="sr"):
+    after: Optional[int] = None
+    before: Optional[int] = None
+
+class ManageUser(CallbackData, prefix="mu"):
+    user_id: int
+
+class DeleteUser(CallbackData, prefix="du"):
+    user_id: int
+
+class UserConfigs(CallbackData, prefix="uc"):
+    user_id: int
+
+class AddConfig(CallbackData, prefix="ac"):
+    user_id: int
+
+class DeleteConfig(CallbackData, prefix="dc"):
+    config_id: int
+    user_id: int
+
+class DeleteTutorial(CallbackData, prefix="dt"):
+    tutorial_id: int
+
+class ViewTutorial(CallbackData, prefix="vt"):
+    tutorial_id: int
+
+class StopBroadcast(CallbackData, prefix="sb"):
+    job_id: int
+
+class SetLanguage(CallbackData, prefix="sl"):
+    lang: str
+
+class BroadcastAudience(CallbackData, prefix="ba"):
+    field: str  # "language", "status", "config_type" or "config_match"
+    value: str = ""
+
+class BroadcastVersion(CallbackData, prefix="bv"):
+    lang: str
+
+# --- Routing ---
+
+class _Route(NamedTuple):
+    handler: CallableObject
+    payload: Optional[Type[CallbackData]]
+    states: Tuple[Optional[str], ...]
+
+class CallbackRoutes:
+    """
+    Dispatch table for one router's callback queries.
+
+    Static actions are looked up by the whole callback data and typed payloads
+    by their prefix, so reaching a handler is one dict lookup instead of a
+    chain of filters, and the payload is parsed once and passed to the handler
+    as `callback_data`. Handlers get the usual aiogram keyword arguments.
+    """
+
+    def __init__(self, router: Router):
+        self._routes: Dict[str, _Route] = {}
+        router.callback_query.register(self._dispatch, self._match)
+
+    def action(self, data: str, *states: Union[State, str, None]) -> Callable:
+        """Registers a handler for a fixed callback data string, optionally only in the given FSM states."""
+        return self._decorator(data, None, states)
+
+    def payload(self, payload: Type[CallbackData], *states: Union[State, str, None]) -> Callable:
+        """Registers a handler for every callback packed from `payload`."""
+        return self._decorator(payload.__prefix__, payload, states)
+
+    def _decorator(self, key: str, payload: Optional[Type[CallbackData]], states: Tuple) -> Callable:
+        def register(handler: Callable) -> Callable:
+            if payload is None and SEPARATOR in key:
+                raise ValueError(f"Static callback {key!r} must not contain {SEPARATOR!r}")
+            if key in self._routes:
+                raise ValueError(f"Callback {key!r} is already routed")
+            self._routes[key] = _Route(
+                CallableObject(handler), payload,
+                tuple(state.state if isinstance(state, State) else state for state in states)
+            )
+            return handler
+        return register
+
+    async def _match(self, callback: CallbackQuery, raw_state: Optional[str] = None) -> Union[bool, Dict[str, Any]]:
+        data = callback.data or ""
+        route = self._routes.get(data.split(SEPARATOR, 1)[0])
+        if route is None or route.payload is None and SEPARATOR in data:
+            return False
+        if route.states and raw_state not in route.states:
+            return False
+        if route.payload is None:
+            return {"_route": route}
+        try:
+            return {"_route": route, "callback_data": route.payload.unpack(data)}
+        except (TypeError, ValueError):
+            # Malformed or outdated payload
+            return False
+
+    async def _dispatch(self, callback: CallbackQuery, _route: _Route, **data: Any) -> Any:
+        return await _route.handler.call(callback, **data)
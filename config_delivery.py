@@ -0,0 +1,90 @@
+# config_delivery.py
+
+from html import escape
+from typing import List, NamedTuple, Sequence
+
+from aiogram.types import InputMediaDocument
+
+from database import Config
+from localization import get_text
+
+MESSAGE_LIMIT = 4096
+MEDIA_GROUP_LIMIT = 10
+# Room left for the tags and type line around an oversized config
+CONFIG_SLICE = 3500
+
+class DeliveryPlan(NamedTuple):
+    document_groups: List[List[InputMediaDocument]]
+    text_messages: List[str]
+
+def _is_file(config: Config) -> bool:
+    return config.config_type.startswith("file:")
+
+def _escaped_slices(data: str, limit: int) -> List[str]:
+    """Escapes data and cuts it into pieces of at most `limit` chars without splitting an entity."""
+    slices: List[str] = []
+    current: List[str] = []
+    size = 0
+    for char in data:
+        escaped = escape(char)
+        if size + len(escaped) > limit:
+            slices.append("".join(current))
+            current, size = [], 0
+        current.append(escaped)
+        size += len(escaped)
+    slices.append("".join(current))
+    return slices
+
+def _format_text_config(config: Config, lang: str) -> List[str]:
+    """Formats one text config as HTML blocks, slicing configs that exceed one message."""
+    title = f"{escape(get_text('config_type', lang))}: <code>{escape(config.config_type)}</code>"
+    slices = _escaped_slices(config.config_data or "", CONFIG_SLICE)
+    blocks = [f"{title}\n\n<code>{slices[0]}</code>"]
+    blocks.extend(f"<code>{part}</code>" for part in slices[1:])
+    return blocks
+
+def _pack(blocks: Sequence[str]) -> List[str]:
+    """Packs blocks into as few messages as the length limit allows."""
+    messages: List[str] = []
+    current = ""
+    for block in blocks:
+        candidate = f"{current}\n\n{block}" if current else block
+        if len(candidate) <= MESSAGE_LIMIT:
+            current = candidate
+        else:
+            messages.append(current)
+            current = block
+    if current:
+        messages.append(current)
+    return messages
+
+def plan_config_delivery(configs: Sequence[Config], lang: str) -> DeliveryPlan:
+    """
+    Groups file configs into media groups and packs the header, text configs
+    and footer into as few HTML messages as possible. The last text message
+    is meant to carry the menu keyboard.
+    """
+    documents = [
+        InputMediaDocument(
+            media=config.config_data,
+            caption=f"{get_text('config_type', lang)}: {config.config_type.split(':', 1)[1]}"
+        )
+        for config in configs if _is_file(config)
+    ]
+    document_groups = [documents[i:i + MEDIA_GROUP_LIMIT] for i in range(0, len(documents), MEDIA_GROUP_LIMIT)]
+
+    blocks = [escape(get_text('your_configs', lang))]
+    for config in configs:
+        if not _is_file(config):
+            blocks.extend(_format_text_config(config, lang))
+    blocks.append(escape(get_text('next_action', lang)))
+    return DeliveryPlan(document_groups, _pack(blocks))
+
+def build_configs_file(configs: Sequence[Config]) -> bytes:
+    """Returns all text configs as one plain-text file, one config per line."""
+    lines = []
+    for config in configs:
+        if not _is_file(config):
+            lines.append(f"# {config.config_type}")
+            lines.append(config.config_data)
+    return ("\n".join(lines) + "\n").encode()
@@ -0,0 +1,170 @@
+# config_import.py
+
+import asyncio
+import csv
+import io
+import json
+import logging
+import posixpath
+import zipfile
+from typing import BinaryIO, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+
+from broadcast import USER_DELIVERY_STATUSES, broadcast_engine
+from database import MAX_TELEGRAM_ID, db
+from keyboards import get_main_keyboard_by_role, get_user_configs_keyboard
+from localization import get_text
+from middlewares import profile_cache
+
+logger = logging.getLogger(__name__)
+
+# Archive members bigger than this are not configs (and guard against zip bombs)
+MAX_ARCHIVE_MEMBER_SIZE = 64 * 1024
+MAX_CONFIG_TYPE_LENGTH = 64
+
+ConfigRow = Tuple[int, str, str]  # (user_id, config_type, config_data)
+
+class ConfigRows(NamedTuple):
+    rows: List[ConfigRow]
+    invalid: int
+
+# --- Parsing ---
+
+def _validate(user_id, config_type, config_data) -> Optional[ConfigRow]:
+    try:
+        user_id = int(user_id)
+    # OverflowError: a JSON Infinity
+    except (ValueError, TypeError, OverflowError):
+        return None
+    if not 0 < user_id <= MAX_TELEGRAM_ID or not isinstance(config_type, str) or not isinstance(config_data, str):
+        return None
+    config_type, config_data = config_type.strip(), config_data.strip()
+    # "file:" types hold Telegram file_ids and are only created by uploads
+    if not config_type or not config_data or len(config_type) > MAX_CONFIG_TYPE_LENGTH \
+            or config_type.startswith("file:"):
+        return None
+    return user_id, config_type, config_data
+
+def _csv_rows(stream: BinaryIO) -> Iterator[Optional[ConfigRow]]:
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", errors="replace", newline="")
+    first_line = text.readline()
+    delimiter = max(",;\t", key=first_line.count)
+    first = next(csv.reader([first_line], delimiter=delimiter), None)
+    # A non-numeric first line is a header, not an error
+    if first and first[0].strip().isdigit():
+        yield _validate(*first) if len(first) == 3 else None
+    for cells in csv.reader(text, delimiter=delimiter):
+        if cells:
+            yield _validate(*cells) if len(cells) == 3 else None
+
+def _jsonl_rows(stream: BinaryIO) -> Iterator[Optional[ConfigRow]]:
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", errors="replace")
+    for line in text:
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+            yield _validate(item['telegram_id'], item['config_type'], item['config_data'])
+        except (ValueError, KeyError, TypeError):
+            yield None
+
+def _archive_rows(stream: BinaryIO) -> Iterator[Optional[ConfigRow]]:
+    """Members are laid out as <telegram_id>/<name>; the file name becomes the config type."""
+    with zipfile.ZipFile(stream) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            parts = posixpath.normpath(info.filename).split("/")
+            if len(parts) < 2 or parts[-1].startswith("."):
+                yield None
+                continue
+            if info.file_size > MAX_ARCHIVE_MEMBER_SIZE:
+                yield None
+                continue
+            try:
+                data = archive.read(info).decode("utf-8-sig")
+            except (UnicodeDecodeError, zipfile.BadZipFile):
+                yield None
+                continue
+            yield _validate(parts[-2], parts[-1], data)
+
+def parse_config_file(stream: BinaryIO, file_name: str) -> ConfigRows:
+    """
+    Reads configs from a CSV (telegram_id,config_type,config_data), a JSONL file
+    with the same keys, or a zip archive of per-user folders. The format is
+    chosen by the file extension.
+    """
+    extension = posixpath.splitext((file_name or "").lower())[1]
+    if extension == ".zip":
+        parser = _archive_rows
+    elif extension in (".jsonl", ".ndjson"):
+        parser = _jsonl_rows
+    else:
+        parser = _csv_rows
+
+    rows: List[ConfigRow] = []
+    invalid = 0
+    try:
+        for row in parser(stream):
+            if row is None:
+                invalid += 1
+            else:
+                rows.append(row)
+    except zipfile.BadZipFile:
+        invalid += 1
+    return ConfigRows(rows, invalid)
+
+# --- Notifications ---
+
+_notify_tasks: Set[asyncio.Task] = set()
+
+def start_config_notification(bot: Bot, recipients: List[Tuple[int, str, int]],
+                              admin_chat_id: int, lang: str, notice: str = 'new_configs_notice') -> None:
+    """
+    Tells every (user_id, language_code, count) recipient about their new (or,
+    with another notice text key, changed) configs in the background.
+    """
+    task = asyncio.create_task(_notify(bot, recipients, admin_chat_id, lang, notice))
+    _notify_tasks.add(task)
+    task.add_done_callback(_notify_tasks.discard)
+
+async def _notify(bot: Bot, recipients: List[Tuple[int, str, int]], admin_chat_id: int, lang: str,
+                  notice: str) -> None:
+    messages = {user_id: (user_lang, count) for user_id, user_lang, count in recipients}
+    dead: List[Tuple[int, str]] = []
+
+    async def send(user_id: int) -> None:
+        user_lang, count = messages[user_id]
+        await bot.send_message(
+            chat_id=user_id,
+            text=get_text(notice, user_lang).format(count=count),
+            reply_markup=get_user_configs_keyboard(user_lang)
+        )
+
+    def on_result(user_id: int, status: str) -> None:
+        if status in USER_DELIVERY_STATUSES:
+            dead.append((user_id, USER_DELIVERY_STATUSES[status]))
+
+    try:
+        # Shares the broadcast rate limit, so it cannot push a running broadcast over it
+        stats = await broadcast_engine.run(list(messages), send, on_result=on_result)
+        if dead:
+            await db.set_delivery_status(dead)
+            for user_id, _ in dead:
+                profile_cache.invalidate(user_id)
+    except Exception:
+        logger.exception("Config notification failed")
+        return
+
+    try:
+        await bot.send_message(
+            chat_id=admin_chat_id,
+            text=get_text('config_notify_finished', lang).format(
+                success_count=stats.success_count, fail_count=stats.fail_count
+            ),
+            reply_markup=get_main_keyboard_by_role(is_admin=True, lang=lang)
+        )
+    except TelegramAPIError as e:
+        logger.warning("Failed to report config notification result: %s", e)
@@ -0,0 +1,53 @@
+# config_rotation.py
+
+import re
+from typing import List, NamedTuple, Optional, Pattern
+
+MAX_ROTATION_RULES = 20
+REGEX_PREFIX = "re:"
+_ARROW = "->"
+
+class RotationRule(NamedTuple):
+    old: str
+    new: str
+    pattern: Optional[Pattern]  # None for a literal rule
+
+class InvalidRotationRule(ValueError):
+    def __init__(self, line: int):
+        super().__init__(f"Line {line} is not a rotation rule")
+        self.line = line
+
+def parse_rotation_rules(text: str) -> List[RotationRule]:
+    """
+    Reads one "old -> new" rule per line, e.g. "nl1.example.com -> nl2.example.com".
+    A line starting with "re:" holds a regular expression, and its replacement
+    may refer to groups as \\1 or \\g<name>. Raises InvalidRotationRule.
+    """
+    rules: List[RotationRule] = []
+    for number, line in enumerate(text.splitlines(), 1):
+        if not line.strip():
+            continue
+        old, arrow, new = line.partition(_ARROW)
+        old, new = old.strip(), new.strip()
+        is_regex = old.startswith(REGEX_PREFIX)
+        if is_regex:
+            old = old[len(REGEX_PREFIX):].strip()
+        if not arrow or not old or old == new or len(rules) == MAX_ROTATION_RULES:
+            raise InvalidRotationRule(number)
+        pattern = None
+        if is_regex:
+            try:
+                pattern = re.compile(old)
+            except re.error:
+                raise InvalidRotationRule(number) from None
+        rules.append(RotationRule(old, new, pattern))
+    return rules
+
+def apply_rotation_rules(rules: List[RotationRule], config_data: str) -> str:
+    """Applies the rules in order. A bad group reference raises re.error on the first match."""
+    for rule in rules:
+        if rule.pattern is None:
+            config_data = config_data.replace(rule.old, rule.new)
+        else:
+            config_data = rule.pattern.sub(rule.new, config_data)
+    return config_data
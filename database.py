@@ -0,0 +1,819 @@
+# database.py
+
+import asyncio
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+DB_PATH = 'bot.db'
+READER_POOL_SIZE = 4
+# How long a write waits for the lock, e.g. while another worker process runs a bulk import
+BUSY_TIMEOUT_MS = 30_000
+# Config templates read per step of a rotation
+ROTATION_BATCH_SIZE = 1000
+# Telegram IDs are stored as SQLite INTEGERs, which are signed 64-bit
+MAX_TELEGRAM_ID = 2 ** 63 - 1
+
+# --- Row Types ---
+
+class User(NamedTuple):
+    telegram_id: int
+    username: Optional[str]
+    is_admin: bool
+    language_code: str
+    delivery_status: str = 'active'
+
+# Delivery statuses of users who stopped receiving messages
+DEAD_DELIVERY_STATUSES = ('blocked', 'deactivated', 'unreachable')
+
+_USER_COLUMNS = "telegram_id, username, is_admin, language_code, delivery_status"
+
+class Config(NamedTuple):
+    id: int
+    user_id: int
+    config_type: str
+    config_data: str
+
+def config_hash(config_type: Optional[str], config_data: Optional[str]) -> bytes:
+    """Content address of a config template; also registered as an SQL function."""
+    return hashlib.sha256(f"{config_type or ''}\0{config_data or ''}".encode()).digest()
+
+class ConfigImportResult(NamedTuple):
+    inserted: int
+    unknown_users: int  # rows skipped because the user is not in the database
+    recipients: List[Tuple[int, str, int]]  # (telegram_id, language_code, new configs) of reachable users
+
+class ConfigRotationResult(NamedTuple):
+    templates: int    # distinct configs rewritten
+    assignments: int  # user configs whose text changed (a dry run also counts merged duplicates)
+    users: int
+    recipients: List[Tuple[int, str, int]]  # (telegram_id, language_code, changed configs) of reachable users
+
+class PanelSyncDiff(NamedTuple):
+    added: int
+    updated: int
+    removed: int
+    skipped: int  # clients without a matching bot user
+    user_ids: List[int]  # users whose configs changed
+
+class Tutorial(NamedTuple):
+    id: int
+    title: str
+    content_text: str
+    file_id: Optional[str]
+    media_type: Optional[str]
+
+class BroadcastJob(NamedTuple):
+    id: int
+    admin_id: int
+    lang: str
+    from_chat_id: int
+    message_id: int
+    status_chat_id: int
+    status_message_id: int
+    status: str
+    total: int
+
+class BroadcastSegment(NamedTuple):
+    """Which non-admin users a broadcast goes to; empty fields do not filter."""
+    languages: Tuple[str, ...] = ()
+    delivery_statuses: Tuple[str, ...] = ('active',)
+    config_type: Optional[str] = None
+    config_match: Optional[str] = None  # text in one of the user's configs, e.g. a server hostname
+
+_BROADCAST_JOB_COLUMNS = (
+    "id, admin_id, lang, from_chat_id, message_id, status_chat_id, status_message_id, status, total"
+)
+
+def _user(row) -> Optional[User]:
+    if row is None:
+        return None
+    telegram_id, username, is_admin, language_code, delivery_status = row
+    return User(telegram_id, username, bool(is_admin), language_code or 'en', delivery_status or 'active')
+
+def _template_id(conn, config_type: str, config_data: str) -> int:
+    # The no-op update makes RETURNING yield the id of an existing template as well
+    return conn.execute(
+        "INSERT INTO config_templates (hash, config_type, config_data) VALUES (?, ?, ?) "
+        "ON CONFLICT (hash) DO UPDATE SET hash = excluded.hash RETURNING id",
+        (config_hash(config_type, config_data), config_type, config_data)
+    ).fetchone()[0]
+
+def _rotated_templates(conn, rewrite: Callable[[str], str]) -> Iterator[List[Tuple[int, str, str]]]:
+    """
+    Walks the text config templates in id order, ROTATION_BATCH_SIZE at a time,
+    and yields the (id, config_type, new config_data) that rewrite() changes.
+    """
+    last_id = 0
+    while True:
+        batch = conn.execute(
+            "SELECT id, config_type, config_data FROM config_templates "
+            "WHERE id > ? AND config_type NOT LIKE 'file:%' ORDER BY id LIMIT ?",
+            (last_id, ROTATION_BATCH_SIZE)
+        ).fetchall()
+        if not batch:
+            return
+        last_id = batch[-1][0]
+        yield [(template_id, config_type, new_data) for template_id, config_type, config_data in batch
+               if (new_data := rewrite(config_data)) != config_data]
+
+def _set_delivery_status(conn, statuses: List[Tuple[int, str]]) -> None:
+    now = int(time.time())
+    conn.executemany(
+        "UPDATE users SET delivery_status = ?, last_error_at = ? WHERE telegram_id = ?",
+        [(status, None if status == 'active' else now, telegram_id) for telegram_id, status in statuses]
+    )
+
+_USERNAME_PREFIX = re.compile(r"@?(\w{1,32})", re.ASCII)
+# configs_fts uses the unicode61 tokenizer, which splits on everything but letters and digits
+_FTS_TOKEN = re.compile(r"[^\W_]+")
+MAX_SEARCH_QUERY = 256
+
+# CROSS JOIN keeps the FTS match as the outer loop
+_CONFIG_TEXT_USERS = (
+    "SELECT a.user_id FROM configs_fts CROSS JOIN config_assignments a "
+    "ON a.template_id = configs_fts.rowid WHERE configs_fts MATCH ?"
+)
+
+def _fts_phrase(text: str) -> Optional[str]:
+    """FTS5 phrase of the text's tokens, the last one as a prefix; None without tokens."""
+    tokens = _FTS_TOKEN.findall(text)
+    return '"' + " ".join(tokens) + '"*' if tokens else None
+
+def _search_branches(query: str) -> Tuple[List[str], List[Any]]:
+    """
+    Turns an admin's search text into the SELECTs of matching user IDs: an exact
+    ID for digits, a username range for a username prefix, and a full-text
+    phrase (last token as a prefix) for anything not starting with "@".
+    """
+    query = query.strip()[:MAX_SEARCH_QUERY]
+    branches: List[str] = []
+    params: List[Any] = []
+    if query.isdecimal() and int(query) <= MAX_TELEGRAM_ID:
+        branches.append("SELECT ?")
+        params.append(int(query))
+    username = _USERNAME_PREFIX.fullmatch(query)
+    if username:
+        prefix = username.group(1).lower()
+        branches.append("SELECT telegram_id FROM users WHERE username_norm >= ? AND username_norm < ?")
+        params += [prefix, prefix + chr(0x10FFFF)]
+    phrase = _fts_phrase(query)
+    if phrase and not query.startswith("@"):
+        branches.append(_CONFIG_TEXT_USERS)
+        params.append(phrase)
+    return branches, params
+
+def _segment_query(segment: BroadcastSegment) -> Tuple[str, List[Any]]:
+    """SELECT of the segment's user IDs. Every filter is served by an index."""
+    conditions = ["is_admin = 0"]
+    params: List[Any] = []
+    if segment.languages:
+        languages = f"language_code IN ({', '.join('?' * len(segment.languages))})"
+        # Users without a language get English everywhere else
+        conditions.append(f"({languages} OR language_code IS NULL)" if 'en' in segment.languages else languages)
+        params += segment.languages
+    if segment.delivery_statuses:
+        conditions.append(f"delivery_status IN ({', '.join('?' * len(segment.delivery_statuses))})")
+        params += segment.delivery_statuses
+    if segment.config_type:
+        conditions.append(
+            "telegram_id IN (SELECT a.user_id FROM config_templates t CROSS JOIN config_assignments a "
+            "ON a.template_id = t.id WHERE t.config_type = ? COLLATE NOCASE)"
+        )
+        params.append(segment.config_type)
+    if segment.config_match:
+        phrase = _fts_phrase(segment.config_match[:MAX_SEARCH_QUERY])
+        conditions.append(f"telegram_id IN ({_CONFIG_TEXT_USERS})" if phrase else "0")
+        if phrase:
+            params.append(phrase)
+    return f"SELECT telegram_id FROM users WHERE {' AND '.join(conditions)}", params
+
+# --- Connection Management ---
+
+class Database:
+    """
+    Data-access layer for bot.db.
+
+    SQLite calls are blocking, so they never run on the event loop: all writes
+    go through one long-lived writer connection owned by a dedicated thread,
+    and reads are spread over a small pool of reader threads, each holding its
+    own connection. WAL mode lets the readers run while a write is in progress.
+    """
+
+    def __init__(self, path: str = DB_PATH, readers: int = READER_POOL_SIZE):
+        self.path = path
+        self.readers = readers
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._writer: Optional[ThreadPoolExecutor] = None
+        self._reader_pool: Optional[ThreadPoolExecutor] = None
+        # Called as query_hook(kind, fn, seconds) after every read/write, e.g. for metrics
+        self.query_hook: Optional[Callable[[str, Callable[..., Any], float], None]] = None
+
+    def _open(self, read_only: bool) -> None:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.create_function("config_hash", 2, config_hash, deterministic=True)
+        if read_only:
+            conn.execute("PRAGMA query_only = ON")
+        else:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+        self._local.conn = conn
+        with self._lock:
+            self._connections.append(conn)
+
+    async def connect(self) -> None:
+        """Opens the writer connection and the reader pool."""
+        if self._writer is not None:
+            return
+        self._writer = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='db-writer',
+            initializer=self._open, initargs=(False,)
+        )
+        # Open the writer first so WAL mode is set before any reader connects
+        await self.write(lambda conn: None)
+        self._reader_pool = ThreadPoolExecutor(
+            max_workers=self.readers, thread_name_prefix='db-reader',
+            initializer=self._open, initargs=(True,)
+        )
+
+    async def close(self) -> None:
+        """Shuts down the DB threads and closes every connection."""
+        for executor in (self._reader_pool, self._writer):
+            if executor is not None:
+                await asyncio.get_running_loop().run_in_executor(None, executor.shutdown)
+        self._writer = self._reader_pool = None
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+
+    def _call(self, fn: Callable[..., Any], args: Tuple) -> Any:
+        return fn(self._local.conn, *args)
+
+    def _call_in_transaction(self, fn: Callable[..., Any], args: Tuple) -> Any:
+        conn = self._local.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn, *args)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    async def read(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Runs fn(conn, *args) on a pooled reader connection."""
+        if self._reader_pool is None:
+            raise RuntimeError("Database is not connected")
+        loop = asyncio.get_running_loop()
+        if self.query_hook is None:
+            return await loop.run_in_executor(self._reader_pool, self._call, fn, args)
+        start = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self._reader_pool, self._call, fn, args)
+        finally:
+            self.query_hook('read', fn, time.perf_counter() - start)
+
+    async def write(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Runs fn(conn, *args) inside a transaction on the writer connection."""
+        if self._writer is None:
+            raise RuntimeError("Database is not connected")
+        loop = asyncio.get_running_loop()
+        if self.query_hook is None:
+            return await loop.run_in_executor(self._writer, self._call_in_transaction, fn, args)
+        start = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self._writer, self._call_in_transaction, fn, args)
+        finally:
+            self.query_hook('write', fn, time.perf_counter() - start)
+
+    # --- Users ---
+
+    async def get_user(self, telegram_id: int) -> Optional[User]:
+        return await self.read(lambda conn: _user(conn.execute(
+            f"SELECT {_USER_COLUMNS} FROM users WHERE telegram_id = ?",
+            (telegram_id,)
+        ).fetchone()))
+
+    async def add_user(self, telegram_id: int, username: Optional[str] = None,
+                       is_admin: bool = False, language_code: str = 'en') -> bool:
+        """Adds a user. Returns False if the user already exists."""
+        def _add(conn):
+            cursor = conn.execute(
+                "INSERT INTO users (telegram_id, username, is_admin, language_code) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(telegram_id) DO NOTHING",
+                (telegram_id, username, int(is_admin), language_code)
+            )
+            return cursor.rowcount > 0
+        return await self.write(_add)
+
+    async def import_users(self, rows: List[Tuple[int, Optional[str], str]]) -> int:
+        """
+        Adds (telegram_id, username, language_code) rows in one transaction and
+        returns how many users were new. Existing users keep their settings and
+        only get a username filled in if they had none.
+        """
+        def _import(conn):
+            # Stage the rows so the upsert is a single set-based statement
+            conn.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS user_import ("
+                "telegram_id INTEGER PRIMARY KEY, username TEXT, language_code TEXT)"
+            )
+            conn.execute("DELETE FROM user_import")
+            conn.executemany("INSERT OR IGNORE INTO user_import VALUES (?, ?, ?)", rows)
+            inserted = conn.execute(
+                "SELECT COUNT(*) FROM user_import i "
+                "WHERE NOT EXISTS (SELECT 1 FROM users u WHERE u.telegram_id = i.telegram_id)"
+            ).fetchone()[0]
+            conn.execute(
+                "INSERT INTO users (telegram_id, username, language_code) "
+                "SELECT telegram_id, username, language_code FROM user_import WHERE true "
+                "ON CONFLICT(telegram_id) DO UPDATE SET username = excluded.username "
+                "WHERE users.username IS NULL AND excluded.username IS NOT NULL"
+            )
+            conn.execute("DELETE FROM user_import")
+            return inserted
+        return await self.write(_import)
+
+    async def set_user_language(self, telegram_id: int, language_code: str) -> Optional[User]:
+        """Updates the user's language and returns the updated user."""
+        return await self.write(lambda conn: _user(conn.execute(
+            "UPDATE users SET language_code = ? WHERE telegram_id = ? "
+            f"RETURNING {_USER_COLUMNS}",
+            (language_code, telegram_id)
+        ).fetchone()))
+
+    async def set_delivery_status(self, statuses: List[Tuple[int, str]]) -> None:
+        """
+        Bulk-updates (telegram_id, delivery_status) pairs. Dead statuses also
+        stamp last_error_at; 'active' clears it.
+        """
+        await self.write(_set_delivery_status, statuses)
+
+    async def count_dead_users(self) -> Dict[str, int]:
+        placeholders = ", ".join("?" * len(DEAD_DELIVERY_STATUSES))
+        return await self.read(lambda conn: dict(conn.execute(
+            f"SELECT delivery_status, COUNT(*) FROM users WHERE is_admin = 0 AND delivery_status IN ({placeholders}) "
+            "GROUP BY delivery_status",
+            DEAD_DELIVERY_STATUSES
+        ).fetchall()))
+
+    async def purge_dead_users(self) -> List[int]:
+        """Deletes non-admin users who stopped receiving messages. Returns their IDs."""
+        placeholders = ", ".join("?" * len(DEAD_DELIVERY_STATUSES))
+        return await self.write(lambda conn: [row[0] for row in conn.execute(
+            f"DELETE FROM users WHERE is_admin = 0 AND delivery_status IN ({placeholders}) RETURNING telegram_id",
+            DEAD_DELIVERY_STATUSES
+        )])
+
+    async def delete_user(self, telegram_id: int) -> None:
+        # Configs are deleted automatically due to "ON DELETE CASCADE"
+        await self.write(lambda conn: conn.execute("DELETE FROM users WHERE telegram_id = ?", (telegram_id,)))
+
+    async def list_users_page(self, limit: int, after_id: Optional[int] = None,
+                              before_id: Optional[int] = None) -> Tuple[List[User], bool]:
+        """
+        Returns a keyset-paginated page of non-admin users ordered by telegram_id,
+        and whether more rows exist beyond it in the direction of travel.
+        One extra row is fetched instead of running COUNT(*).
+        """
+        columns = f"SELECT {_USER_COLUMNS} FROM users WHERE is_admin = 0"
+        if before_id is not None:
+            query = columns + " AND telegram_id < ? ORDER BY telegram_id DESC LIMIT ?"
+            params = (before_id, limit + 1)
+        elif after_id is not None:
+            query = columns + " AND telegram_id > ? ORDER BY telegram_id LIMIT ?"
+            params = (after_id, limit + 1)
+        else:
+            query = columns + " ORDER BY telegram_id LIMIT ?"
+            params = (limit + 1,)
+
+        rows = await self.read(lambda conn: conn.execute(query, params).fetchall())
+        has_more = len(rows) > limit
+        users = [_user(row) for row in rows[:limit]]
+        if before_id is not None:
+            users.reverse()
+        return users, has_more
+
+    async def search_users(self, query: str, limit: int, after_id: Optional[int] = None,
+                           before_id: Optional[int] = None) -> Tuple[List[User], bool]:
+        """
+        Finds non-admin users by Telegram ID, @username prefix or a fragment of
+        one of their configs, paginated like list_users_page. Every branch of
+        the match is an index lookup: the primary key, idx_users_username_norm
+        or the configs_fts full-text index.
+        """
+        branches, params = _search_branches(query)
+        if not branches:
+            return [], False
+
+        columns = f"SELECT {_USER_COLUMNS} FROM users WHERE is_admin = 0 AND telegram_id IN ({' UNION '.join(branches)})"
+        if before_id is not None:
+            sql = columns + " AND telegram_id < ? ORDER BY telegram_id DESC LIMIT ?"
+            params += [before_id, limit + 1]
+        elif after_id is not None:
+            sql = columns + " AND telegram_id > ? ORDER BY telegram_id LIMIT ?"
+            params += [after_id, limit + 1]
+        else:
+            sql = columns + " ORDER BY telegram_id LIMIT ?"
+            params += [limit + 1]
+
+        rows = await self.read(lambda conn: conn.execute(sql, params).fetchall())
+        has_more = len(rows) > limit
+        users = [_user(row) for row in rows[:limit]]
+        if before_id is not None:
+            users.reverse()
+        return users, has_more
+
+    # --- Configs ---
+    # A config's content lives once in config_templates; config_assignments
+    # links it to every user who has it.
+
+    async def get_configs_for_user(self, user_id: int) -> List[Config]:
+        return await self.read(lambda conn: [Config(*row) for row in conn.execute(
+            "SELECT a.id, a.user_id, t.config_type, t.config_data FROM config_assignments a "
+            "JOIN config_templates t ON t.id = a.template_id WHERE a.user_id = ? ORDER BY a.id",
+            (user_id,)
+        )])
+
+    async def insert_config(self, user_id: int, config_type: str, config_data: str) -> int:
+        """Assigns a config to a user and returns the assignment id (the existing one if they have it)."""
+        def _insert(conn):
+            template_id = _template_id(conn, config_type, config_data)
+            return conn.execute(
+                "INSERT INTO config_assignments (user_id, template_id) VALUES (?, ?) "
+                "ON CONFLICT (user_id, template_id) DO UPDATE SET user_id = excluded.user_id RETURNING id",
+                (user_id, template_id)
+            ).fetchone()[0]
+        return await self.write(_insert)
+
+    async def assign_config(self, config_type: str, config_data: str,
+                            user_ids: Optional[List[int]] = None) -> List[int]:
+        """
+        Assigns one config to the given users, or to every non-admin user for
+        None, with a single INSERT ... SELECT. Returns the users who did not
+        have it yet; unknown IDs are skipped.
+        """
+        def _assign(conn):
+            template_id = _template_id(conn, config_type, config_data)
+            if user_ids is None:
+                audience, params = "is_admin = 0", ()
+            else:
+                audience, params = "telegram_id IN (SELECT value FROM json_each(?))", (json.dumps(user_ids),)
+            assigned = [user_id for user_id, in conn.execute(
+                f"INSERT INTO config_assignments (user_id, template_id) "
+                f"SELECT telegram_id, ? FROM users WHERE {audience} "
+                f"ON CONFLICT DO NOTHING RETURNING user_id",
+                (template_id, *params)
+            )]
+            if not assigned:
+                # Nobody got it, so a template created just now would be left unused
+                conn.execute(
+                    "DELETE FROM config_templates WHERE id = ? "
+                    "AND NOT EXISTS (SELECT 1 FROM config_assignments WHERE template_id = ?)",
+                    (template_id, template_id)
+                )
+            return assigned
+        return await self.write(_assign)
+
+    async def import_configs(self, rows: List[Tuple[int, str, str]]) -> ConfigImportResult:
+        """
+        Inserts (user_id, config_type, config_data) rows in one transaction.
+        Rows for unknown users and configs the user already has are skipped.
+        """
+        def _import(conn):
+            conn.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS config_import ("
+                "user_id INTEGER, config_type TEXT, config_data TEXT, hash BLOB)"
+            )
+            conn.execute("DELETE FROM config_import")
+            conn.executemany(
+                "INSERT INTO config_import VALUES (?, ?, ?, ?)",
+                ((user_id, config_type, config_data, config_hash(config_type, config_data))
+                 for user_id, config_type, config_data in rows)
+            )
+            unknown_users = conn.execute(
+                "SELECT COUNT(*) FROM config_import i "
+                "WHERE NOT EXISTS (SELECT 1 FROM users u WHERE u.telegram_id = i.user_id)"
+            ).fetchone()[0]
+            conn.execute(
+                "INSERT INTO config_templates (hash, config_type, config_data) "
+                "SELECT i.hash, i.config_type, i.config_data FROM config_import i "
+                "JOIN users u ON u.telegram_id = i.user_id WHERE true ON CONFLICT (hash) DO NOTHING"
+            )
+            new_counts = Counter(user_id for user_id, in conn.execute(
+                "INSERT INTO config_assignments (user_id, template_id) "
+                "SELECT i.user_id, t.id FROM config_import i "
+                "JOIN users u ON u.telegram_id = i.user_id "
+                "JOIN config_templates t ON t.hash = i.hash "
+                "WHERE true ON CONFLICT DO NOTHING RETURNING user_id"
+            ).fetchall())
+            recipients = [
+                (telegram_id, language_code or 'en', new_counts[telegram_id])
+                for telegram_id, language_code in conn.execute(
+                    "SELECT telegram_id, language_code FROM users "
+                    "WHERE delivery_status = 'active' AND telegram_id IN (SELECT user_id FROM config_import)"
+                )
+                if new_counts[telegram_id]
+            ]
+            conn.execute("DELETE FROM config_import")
+            return ConfigImportResult(sum(new_counts.values()), unknown_users, recipients)
+        return await self.write(_import)
+
+    async def delete_config(self, config_id: int) -> None:
+        def _delete(conn):
+            source = conn.execute(
+                "DELETE FROM config_assignments WHERE id = ? RETURNING source", (config_id,)
+            ).fetchone()
+            if source and source[0] is not None:
+                # Make the next sync of that panel compare row by row and restore it
+                conn.execute("UPDATE panel_sync_state SET fingerprint = NULL WHERE panel = ?", (source[0],))
+        await self.write(_delete)
+
+    async def rotate_configs(self, rewrite: Callable[[str], str], dry_run: bool = False) -> ConfigRotationResult:
+        """
+        Replaces the data of every text config with rewrite(data), e.g. after a
+        server moved, in a single transaction. Configs that become identical
+        to an existing one are merged into it. A dry run only counts, on a
+        reader connection.
+        """
+        # Assignments of the templates rewritten in place, plus the ones merged elsewhere
+        changed = ("(a.template_id IN (SELECT value FROM json_each(?)) "
+                   "OR a.id IN (SELECT value FROM json_each(?)))")
+
+        def _count(conn, template_ids: List[int], moved: List[int]) -> Tuple[int, int]:
+            return conn.execute(
+                f"SELECT COUNT(*), COUNT(DISTINCT a.user_id) FROM config_assignments a WHERE {changed}",
+                (json.dumps(template_ids), json.dumps(moved))
+            ).fetchone()
+
+        def _preview(conn):
+            template_ids = [row[0] for batch in _rotated_templates(conn, rewrite) for row in batch]
+            return ConfigRotationResult(len(template_ids), *_count(conn, template_ids, []), [])
+
+        def _rotate(conn):
+            affected: List[int] = []
+            moved: List[int] = []
+            panels: Set[str] = set()
+            # Every new text is computed from the original ones before anything is
+            # written, so configs merged into a later template are not rewritten twice
+            changes = [row for batch in _rotated_templates(conn, rewrite) for row in batch]
+            # Park the old hashes (no digest is an integer), so a config can take
+            # the text another rewritten config is moving away from
+            conn.executemany("UPDATE config_templates SET hash = -id WHERE id = ?", [(row[0],) for row in changes])
+            for template_id, config_type, config_data in changes:
+                digest = config_hash(config_type, config_data)
+                try:
+                    conn.execute(
+                        "UPDATE config_templates SET hash = ?, config_data = ? WHERE id = ?",
+                        (digest, config_data, template_id)
+                    )
+                    affected.append(template_id)
+                    continue
+                except sqlite3.IntegrityError:
+                    pass
+                # The new data is another template's: move the users over, and
+                # the GC triggers drop this template with its last assignment.
+                # Users who already have the target keep it unchanged, so only
+                # the moved assignments count as changed.
+                target = conn.execute("SELECT id FROM config_templates WHERE hash = ?", (digest,)).fetchone()[0]
+                moved += [assignment_id for assignment_id, in conn.execute(
+                    "UPDATE OR IGNORE config_assignments SET template_id = ? WHERE template_id = ? RETURNING id",
+                    (target, template_id)
+                )]
+                panels.update(source for source, in conn.execute(
+                    "DELETE FROM config_assignments WHERE template_id = ? RETURNING source", (template_id,)
+                ) if source is not None)
+
+            params = (json.dumps(affected), json.dumps(moved))
+            # Panels own their rows: have the next sync compare them row by row
+            conn.execute(
+                "UPDATE panel_sync_state SET fingerprint = NULL WHERE panel IN (SELECT value FROM json_each(?)) "
+                f"OR panel IN (SELECT a.source FROM config_assignments a WHERE a.source IS NOT NULL AND {changed})",
+                (json.dumps(sorted(panels)), *params)
+            )
+            recipients = [(telegram_id, language_code or 'en', count) for telegram_id, language_code, count in conn.execute(
+                "SELECT u.telegram_id, u.language_code, COUNT(*) FROM config_assignments a "
+                f"JOIN users u ON u.telegram_id = a.user_id WHERE {changed} AND u.delivery_status = 'active' "
+                "GROUP BY u.telegram_id", params
+            )]
+            return ConfigRotationResult(len(changes), *_count(conn, affected, moved), recipients)
+
+        if dry_run:
+            return await self.read(_preview)
+        return await self.write(_rotate)
+
+    # --- Panel Sync ---
+
+    async def sync_panel_configs(self, panel: str, rows: List[Tuple[str, int, str, str]]) -> PanelSyncDiff:
+        """
+        Makes the panel's configs match (external_key, user_id, config_type, config_data)
+        rows. Only changed rows are written; if nothing changed since the last
+        sync (same fingerprint), existing rows are not even read.
+        """
+        def _sync(conn):
+            user_ids = json.dumps(sorted({row[1] for row in rows}))
+            known = {user_id for user_id, in conn.execute(
+                "SELECT telegram_id FROM users WHERE telegram_id IN (SELECT value FROM json_each(?))", (user_ids,)
+            )}
+            desired = {key: (user_id, config_type, config_data)
+                       for key, user_id, config_type, config_data in rows if user_id in known}
+            skipped = len(rows) - len(desired)
+            fingerprint = hashlib.sha256(json.dumps(sorted(desired.items())).encode()).hexdigest()
+            now = int(time.time())
+
+            state = conn.execute("SELECT fingerprint FROM panel_sync_state WHERE panel = ?", (panel,)).fetchone()
+            if state and state[0] == fingerprint:
+                conn.execute(
+                    "UPDATE panel_sync_state SET synced_at = ?, last_error = NULL WHERE panel = ?", (now, panel)
+                )
+                return PanelSyncDiff(0, 0, 0, skipped, [])
+
+            existing = {key: (user_id, config_type, config_data) for key, user_id, config_type, config_data in conn.execute(
+                "SELECT a.external_key, a.user_id, t.config_type, t.config_data FROM config_assignments a "
+                "JOIN config_templates t ON t.id = a.template_id WHERE a.source = ?", (panel,)
+            )}
+            changed = [(key, value) for key, value in desired.items() if existing.get(key) != value]
+            removed = [(panel, key) for key in existing if key not in desired]
+            for key, (user_id, config_type, config_data) in changed:
+                template_id = _template_id(conn, config_type, config_data)
+                # OR REPLACE: a manually added copy of the same config is taken over by the panel
+                if key in existing:
+                    conn.execute(
+                        "UPDATE OR REPLACE config_assignments SET user_id = ?, template_id = ? "
+                        "WHERE source = ? AND external_key = ?",
+                        (user_id, template_id, panel, key)
+                    )
+                else:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO config_assignments (user_id, template_id, source, external_key) "
+                        "VALUES (?, ?, ?, ?)",
+                        (user_id, template_id, panel, key)
+                    )
+            conn.executemany("DELETE FROM config_assignments WHERE source = ? AND external_key = ?", removed)
+            conn.execute(
+                "INSERT INTO panel_sync_state (panel, fingerprint, client_count, synced_at, last_error) "
+                "VALUES (?, ?, ?, ?, NULL) ON CONFLICT(panel) DO UPDATE SET fingerprint = excluded.fingerprint, "
+                "client_count = excluded.client_count, synced_at = excluded.synced_at, last_error = NULL",
+                (panel, fingerprint, len(desired), now)
+            )
+            added = sum(1 for key in desired if key not in existing)
+            user_ids = {value[0] for _, value in changed}
+            user_ids.update(value[0] for key, value in existing.items() if desired.get(key) != value)
+            return PanelSyncDiff(added, len(changed) - added, len(removed), skipped, sorted(user_ids))
+        return await self.write(_sync)
+
+    async def record_panel_sync_error(self, panel: str, error: str) -> None:
+        await self.write(lambda conn: conn.execute(
+            "INSERT INTO panel_sync_state (panel, last_error) VALUES (?, ?) "
+            "ON CONFLICT(panel) DO UPDATE SET last_error = excluded.last_error",
+            (panel, error)
+        ))
+
+    # --- Tutorials ---
+
+    async def list_tutorials(self) -> List[Tutorial]:
+        return await self.read(lambda conn: [Tutorial(*row) for row in conn.execute(
+            "SELECT id, title, content_text, file_id, media_type FROM tutorials"
+        )])
+
+    async def get_tutorial(self, tutorial_id: int) -> Optional[Tutorial]:
+        row = await self.read(lambda conn: conn.execute(
+            "SELECT id, title, content_text, file_id, media_type FROM tutorials WHERE id = ?",
+            (tutorial_id,)
+        ).fetchone())
+        return Tutorial(*row) if row else None
+
+    async def insert_tutorial(self, title: str, content_text: str, file_id: Optional[str] = None,
+                              media_type: Optional[str] = None) -> int:
+        return await self.write(lambda conn: conn.execute(
+            "INSERT INTO tutorials (title, content_text, file_id, media_type) VALUES (?, ?, ?, ?)",
+            (title, content_text, file_id, media_type)
+        ).lastrowid)
+
+    async def set_tutorial_media_type(self, tutorial_id: int, media_type: str) -> None:
+        await self.write(lambda conn: conn.execute(
+            "UPDATE tutorials SET media_type = ? WHERE id = ?", (media_type, tutorial_id)
+        ))
+
+    async def delete_tutorial(self, tutorial_id: int) -> None:
+        await self.write(lambda conn: conn.execute("DELETE FROM tutorials WHERE id = ?", (tutorial_id,)))
+
+    # --- Broadcast Jobs ---
+
+    async def count_segment_users(self, segment: BroadcastSegment) -> int:
+        sql, params = _segment_query(segment)
+        return await self.read(lambda conn: conn.execute(f"SELECT COUNT(*) FROM ({sql})", params).fetchone()[0])
+
+    async def create_broadcast_job(self, admin_id: int, lang: str, from_chat_id: int, message_id: int,
+                                   status_chat_id: int, status_message_id: int,
+                                   segment: BroadcastSegment = BroadcastSegment(),
+                                   messages: Optional[Dict[str, int]] = None) -> BroadcastJob:
+        """
+        Creates a job and snapshots the segment's recipients with a single
+        INSERT ... SELECT. messages maps languages to their own version of the
+        message (message_id in from_chat_id).
+        """
+        sql, params = _segment_query(segment)
+
+        def _create(conn):
+            job_id = conn.execute(
+                "INSERT INTO broadcast_jobs (admin_id, lang, from_chat_id, message_id, "
+                "status_chat_id, status_message_id, status, created_at) VALUES (?, ?, ?, ?, ?, ?, 'running', ?)",
+                (admin_id, lang, from_chat_id, message_id, status_chat_id, status_message_id, int(time.time()))
+            ).lastrowid
+            total = conn.execute(
+                f"INSERT INTO broadcast_recipients (job_id, user_id) SELECT ?, telegram_id FROM ({sql})",
+                (job_id, *params)
+            ).rowcount
+            conn.executemany(
+                "INSERT INTO broadcast_messages (job_id, lang, message_id) VALUES (?, ?, ?)",
+                [(job_id, message_lang, message_id) for message_lang, message_id in (messages or {}).items()]
+            )
+            conn.execute("UPDATE broadcast_jobs SET total = ? WHERE id = ?", (total, job_id))
+            return BroadcastJob(*conn.execute(
+                f"SELECT {_BROADCAST_JOB_COLUMNS} FROM broadcast_jobs WHERE id = ?", (job_id,)
+            ).fetchone())
+        return await self.write(_create)
+
+    async def list_running_broadcast_jobs(self) -> List[BroadcastJob]:
+        return await self.read(lambda conn: [BroadcastJob(*row) for row in conn.execute(
+            f"SELECT {_BROADCAST_JOB_COLUMNS} FROM broadcast_jobs WHERE status = 'running'"
+        )])
+
+    async def get_broadcast_messages(self, job_id: int) -> Dict[str, int]:
+        """Returns the job's per-language message versions as {lang: message_id}."""
+        return await self.read(lambda conn: dict(conn.execute(
+            "SELECT lang, message_id FROM broadcast_messages WHERE job_id = ?", (job_id,)
+        ).fetchall()))
+
+    async def claim_broadcast_recipients(self, job_id: int, after_user_id: int, limit: int,
+                                         with_languages: bool = False) -> List[Tuple[int, Optional[str]]]:
+        """
+        Marks the next chunk of pending recipients as 'sending' and returns them
+        as (user_id, language_code), the language only if with_languages is set.
+        Walks the (job_id, user_id) primary key, so resuming never rescans finished rows.
+        """
+        language = "(SELECT language_code FROM users WHERE telegram_id = user_id)" if with_languages else "NULL"
+
+        def _claim(conn):
+            rows = conn.execute(
+                f"SELECT user_id, {language} FROM broadcast_recipients "
+                "WHERE job_id = ? AND user_id > ? AND status = 'pending' ORDER BY user_id LIMIT ?",
+                (job_id, after_user_id, limit)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE broadcast_recipients SET status = 'sending' WHERE job_id = ? AND user_id = ?",
+                [(job_id, user_id) for user_id, _ in rows]
+            )
+            return rows
+        return await self.write(_claim)
+
+    async def save_broadcast_results(self, job_id: int, results: List[Tuple[int, str]],
+                                     delivery_statuses: List[Tuple[int, str]] = ()) -> None:
+        """
+        Checkpoints a batch of (user_id, status) delivery results, together with
+        any users found dead in the same batch, in one transaction.
+        """
+        def _save(conn):
+            conn.executemany(
+                "UPDATE broadcast_recipients SET status = ? WHERE job_id = ? AND user_id = ?",
+                [(status, job_id, user_id) for user_id, status in results]
+            )
+            if delivery_statuses:
+                _set_delivery_status(conn, delivery_statuses)
+        await self.write(_save)
+
+    async def release_broadcast_recipients(self, job_id: int, status: str = 'interrupted') -> None:
+        """
+        Settles recipients still marked 'sending'. After a crash their delivery
+        is unknown, so by default they become 'interrupted' rather than being sent twice.
+        """
+        await self.write(lambda conn: conn.execute(
+            "UPDATE broadcast_recipients SET status = ? WHERE job_id = ? AND status = 'sending'",
+            (status, job_id)
+        ))
+
+    async def get_broadcast_counts(self, job_id: int) -> Dict[str, int]:
+        return await self.read(lambda conn: dict(conn.execute(
+            "SELECT status, COUNT(*) FROM broadcast_recipients WHERE job_id = ? GROUP BY status",
+            (job_id,)
+        ).fetchall()))
+
+    async def finish_broadcast_job(self, job_id: int, status: str) -> None:
+        await self.write(lambda conn: conn.execute(
+            "UPDATE broadcast_jobs SET status = ?, finished_at = ? WHERE id = ?",
+            (status, int(time.time()), job_id)
+        ))
+
+db = Database()
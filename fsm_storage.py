@@ -0,0 +1,160 @@
+# fsm_storage.py
+
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+FSM_TTL = 24 * 60 * 60  # abandoned flows expire after a day
+FLUSH_INTERVAL = 0.5     # seconds; writes made within this window are coalesced
+PURGE_INTERVAL = 60 * 60
+
+_UNSET = object()
+
+def _build_key(key: StorageKey) -> str:
+    return ":".join(str(part) if part is not None else "" for part in (
+        key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny
+    ))
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM storage kept in the fsm_state table of bot.db, so unfinished admin
+    flows survive a restart.
+
+    Writes are buffered and flushed in one transaction every FLUSH_INTERVAL,
+    which coalesces the set_state/update_data bursts of a single FSM step.
+    Only pending writes, and those being written, are held in memory; reads of
+    these keys are served from memory, so a reader connection never sees a
+    state older than the last one set. Data must be JSON-serialisable.
+    """
+
+    def __init__(self, db: Database, ttl: int = FSM_TTL, flush_interval: float = FLUSH_INTERVAL):
+        self.db = db
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        # key -> [state, data]; _UNSET marks a field that was not changed
+        self._pending: Dict[str, List[Any]] = {}
+        # Flushed entries whose transaction has not committed yet
+        self._inflight: Dict[str, List[Any]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._last_purge = time.monotonic()
+
+    # --- Buffer ---
+
+    def _buffer(self, key: StorageKey, state: Any = _UNSET, data: Any = _UNSET) -> None:
+        entry = self._pending.setdefault(_build_key(key), [_UNSET, _UNSET])
+        if state is not _UNSET:
+            entry[0] = state
+        if data is not _UNSET:
+            entry[1] = data
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self) -> None:
+        await asyncio.sleep(self.flush_interval)
+        self._flush_task = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Failed to flush FSM state")
+
+    async def flush(self) -> None:
+        """Writes every buffered change in one transaction."""
+        pending, self._pending = self._pending, {}
+        for key, (state, data) in pending.items():
+            # Fields this batch leaves alone may still be on their way from an earlier one
+            previous = self._inflight.get(key, (_UNSET, _UNSET))
+            self._inflight[key] = [previous[0] if state is _UNSET else state,
+                                   previous[1] if data is _UNSET else data]
+        inflight = {key: self._inflight[key] for key in pending}
+        purge = time.monotonic() - self._last_purge >= PURGE_INTERVAL
+        if purge:
+            self._last_purge = time.monotonic()
+        if not pending and not purge:
+            return
+
+        now = int(time.time())
+        rows = [
+            (key,
+             None if state is _UNSET else state,
+             None if data is _UNSET else json.dumps(data, separators=(",", ":")),
+             now,
+             state is not _UNSET,
+             data is not _UNSET)
+            for key, (state, data) in pending.items()
+        ]
+        try:
+            await self.db.write(_save_rows, rows, now - self.ttl if purge else None)
+        finally:
+            for key, entry in inflight.items():
+                # A later flush may have replaced the entry while this one was written
+                if self._inflight.get(key) is entry:
+                    del self._inflight[key]
+
+    def _buffered(self, key: StorageKey, field: int) -> Any:
+        """The newest unsaved value of a field: pending first, then in flight."""
+        for buffer in (self._pending, self._inflight):
+            entry = buffer.get(_build_key(key))
+            if entry is not None and entry[field] is not _UNSET:
+                return entry[field]
+        return _UNSET
+
+    # --- BaseStorage ---
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        self._buffer(key, state=state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state = self._buffered(key, 0)
+        if state is not _UNSET:
+            return state
+        row = await self._load(key)
+        return row[0] if row else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        self._buffer(key, data=dict(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        data = self._buffered(key, 1)
+        if data is not _UNSET:
+            return dict(data)
+        row = await self._load(key)
+        return json.loads(row[1]) if row and row[1] else {}
+
+    async def close(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+
+    async def _load(self, key: StorageKey) -> Optional[Tuple[Optional[str], Optional[str]]]:
+        expires_before = int(time.time()) - self.ttl
+        return await self.db.read(lambda conn: conn.execute(
+            "SELECT state, data FROM fsm_state WHERE key = ? AND updated_at >= ?",
+            (_build_key(key), expires_before)
+        ).fetchone())
+
+def _save_rows(conn, rows: List[Tuple], expires_before: Optional[int]) -> None:
+    conn.executemany(
+        "INSERT INTO fsm_state (key, state, data, updated_at) VALUES (?1, ?2, ?3, ?4) "
+        "ON CONFLICT(key) DO UPDATE SET "
+        "state = CASE WHEN ?5 THEN excluded.state ELSE fsm_state.state END, "
+        "data = CASE WHEN ?6 THEN excluded.data ELSE fsm_state.data END, "
+        "updated_at = excluded.updated_at",
+        rows
+    )
+    # Finished flows leave nothing behind
+    conn.executemany(
+        "DELETE FROM fsm_state WHERE key = ? AND state IS NULL AND (data IS NULL OR data = '{}')",
+        [(row[0],) for row in rows]
+    )
+    if expires_before is not None:
+        conn.execute("DELETE FROM fsm_state WHERE updated_at < ?", (expires_before,))
@@ -1,76 +1,111 @@
 # handlers/admin_handlers.py
 
-import sqlite3
 import asyncio
+import logging
+import re
+from functools import partial
+from html import escape
 from aiogram import Router, F, types, Bot
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.enums import ContentType
-from aiogram.exceptions import TelegramAPIError
+from aiogram.filters import Command, StateFilter
 
+from callbacks import (
+    AddConfig, BroadcastAudience, BroadcastVersion, CallbackRoutes, ConfigUsersPage, DeleteConfig,
+    DeleteTutorial, DeleteUser, ManageUser, SearchPage, StopBroadcast, UserConfigs, UsersPage
+)
 from keyboards import (
     get_main_keyboard_by_role, get_users_keyboard, user_management_keyboard,
     get_users_for_configs_keyboard, get_user_configs_management_keyboard,
-    get_tutorials_admin_keyboard, get_skip_media_keyboard, get_confirm_send_keyboard
+    get_tutorials_admin_keyboard, get_skip_media_keyboard, get_confirm_send_keyboard,
+    get_inactive_users_keyboard, get_config_import_keyboard, get_search_results_keyboard,
+    get_assign_config_keyboard, get_confirm_rotation_keyboard, get_broadcast_audience_keyboard
 )
-from localization import get_text
+from broadcast import start_broadcast_job, stop_broadcast_job
+from config_import import parse_config_file, start_config_notification
+from config_rotation import InvalidRotationRule, apply_rotation_rules, parse_rotation_rules
+from database import DEAD_DELIVERY_STATUSES, BroadcastSegment, db
+from localization import get_text, locales
+from metrics import format_stats
+from middlewares import profile_cache
+from subscription import subscription_cache
+from tutorial_media import ALBUM, encode_album, extract_media
+from user_import import MAX_IMPORT_FILE_SIZE, parse_user_rows
+
+logger = logging.getLogger(__name__)
 
 router = Router()
+callbacks = CallbackRoutes(router)
 
-# --- Helper function to get admin's language ---
-def get_admin_lang(user_id: int) -> str:
-    conn = sqlite3.connect('bot.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT language_code FROM users WHERE telegram_id = ?", (user_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result[0] if result else 'en'
+# Longest config type or config text a broadcast audience is filtered by
+MAX_CONFIG_FILTER_LENGTH = 256
+# Telegram IDs separated by spaces, commas or new lines, and nothing else
+_USER_ID_LIST = re.compile(r"\s*\d{1,19}(?:[\s,]+\d{1,19})*[\s,]*")
+# Media-group items collected per (admin_id, media_group_id) while an album arrives
+ALBUM_COLLECT_DELAY = 1.0  # seconds
+_pending_albums = {}
+_album_tasks = set()
 
 # --- FSM States ---
 class AdminStates(StatesGroup):
     add_user_id = State()
+    import_users_file = State()
+    search_users = State()
     add_config_type = State()
     add_config_data = State()
+    assign_config_type = State()
+    assign_config_data = State()
+    assign_config_targets = State()
+    import_configs_file = State()
+    import_configs_notify = State()
+    rotate_configs_rules = State()
+    rotate_configs_confirm = State()
     add_tutorial_title = State()
     add_tutorial_text = State()
     add_tutorial_media = State()
+    mass_send_audience = State()
+    mass_send_config_type = State()
+    mass_send_config_match = State()
     mass_send_message = State()
     mass_send_confirm = State()
+    mass_send_version = State()
 
 # --- Main Menu Handler ---
-@router.callback_query(F.data == "admin_menu")
-async def process_admin_menu(callback: types.CallbackQuery, state: FSMContext):
+@callbacks.action("admin_menu")
+async def process_admin_menu(callback: types.CallbackQuery, state: FSMContext, lang: str):
     await state.clear() # Clear any active state
-    lang = get_admin_lang(callback.from_user.id)
     await callback.message.edit_text(
         get_text('welcome_admin', lang),
         reply_markup=get_main_keyboard_by_role(is_admin=True, lang=lang)
     )
     await callback.answer()
 
+@router.message(Command("stats"))
+async def process_stats(message: types.Message, is_admin: bool, lang: str):
+    if not is_admin:
+        return
+    await message.answer(
+        f"{escape(get_text('stats_title', lang))}\n<pre>{escape(format_stats())}</pre>",
+        parse_mode="HTML"
+    )
+
 # --- User Management Section ---
 
-@router.callback_query(F.data.startswith("admin_users_page_"))
-async def process_users_list(callback: types.CallbackQuery):
-    page = int(callback.data.split("_")[-1])
-    lang = get_admin_lang(callback.from_user.id)
+@callbacks.payload(UsersPage)
+async def process_users_list(callback: types.CallbackQuery, callback_data: UsersPage, lang: str):
     await callback.message.edit_text(
         get_text('users_list', lang),
-        reply_markup=get_users_keyboard(page, lang)
+        reply_markup=await get_users_keyboard(lang, callback_data.after, callback_data.before)
     )
     await callback.answer()
 
-@router.callback_query(F.data.startswith("manage_user_"))
-async def process_manage_user(callback: types.CallbackQuery):
-    user_id = int(callback.data.split("_")[-1])
-    lang = get_admin_lang(callback.from_user.id)
+@callbacks.payload(ManageUser)
+async def process_manage_user(callback: types.CallbackQuery, callback_data: ManageUser, lang: str):
+    user_id = callback_data.user_id
     
-    conn = sqlite3.connect('bot.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT username FROM users WHERE telegram_id = ?", (user_id,))
-    user = cursor.fetchone()
-    conn.close()
-    username = user[0] if user and user[0] else "N/A"
+    user = await db.get_user(user_id)
+    username = user.username if user and user.username else "N/A"
     
     text = get_text('manage_user_title', lang).format(user_id=user_id, username=username)
     await callback.message.edit_text(
@@ -80,187 +115,388 @@ async def process_manage_user(callback: types.CallbackQuery):
     )
     await callback.answer()
 
-@router.callback_query(F.data.startswith("delete_user_"))
-async def process_delete_user(callback: types.CallbackQuery):
-    user_id = int(callback.data.split("_")[-1])
-    lang = get_admin_lang(callback.from_user.id)
+@callbacks.payload(DeleteUser)
+async def process_delete_user(callback: types.CallbackQuery, callback_data: DeleteUser, lang: str):
+    user_id = callback_data.user_id
     
-    conn = sqlite3.connect('bot.db')
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM users WHERE telegram_id = ?", (user_id,))
     # Configs will be deleted automatically due to "ON DELETE CASCADE" in the new DB schema
-    conn.commit()
-    conn.close()
+    await db.delete_user(user_id)
+    profile_cache.invalidate(user_id)
+    subscription_cache.invalidate(user_id)
 
     await callback.answer(get_text('user_deleted_ok', lang))
     await callback.message.edit_text(
         get_text('users_list', lang),
-        reply_markup=get_users_keyboard(0, lang)
+        reply_markup=await get_users_keyboard(lang)
     )
 
-@router.callback_query(F.data == "add_user")
-async def process_add_user_start(callback: types.CallbackQuery, state: FSMContext):
-    lang = get_admin_lang(callback.from_user.id)
+@callbacks.action("add_user")
+async def process_add_user_start(callback: types.CallbackQuery, state: FSMContext, lang: str):
     await callback.message.edit_text(get_text('ask_for_user_id', lang))
     await state.set_state(AdminStates.add_user_id)
     await callback.answer()
 
 @router.message(AdminStates.add_user_id)
-async def process_add_user_id(message: types.Message, state: FSMContext):
-    lang = get_admin_lang(message.from_user.id)
+async def process_add_user_id(message: types.Message, state: FSMContext, lang: str):
     try:
         user_id = int(message.text)
-        conn = sqlite3.connect('bot.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT telegram_id FROM users WHERE telegram_id = ?", (user_id,))
-        if cursor.fetchone():
-            await message.answer(get_text('user_already_exists', lang))
-        else:
-            # Add user with default language 'en'
-            cursor.execute("INSERT INTO users (telegram_id, language_code) VALUES (?, ?)", (user_id, 'en'))
-            conn.commit()
+        # Add user with default language 'en'
+        if await db.add_user(user_id, language_code='en'):
+            profile_cache.invalidate(user_id)
             await message.answer(get_text('user_added_ok', lang))
-        conn.close()
+        else:
+            await message.answer(get_text('user_already_exists', lang))
         
         await state.clear()
         await message.answer(
             get_text('users_list', lang),
-            reply_markup=get_users_keyboard(0, lang)
+            reply_markup=await get_users_keyboard(lang)
         )
     except (ValueError, TypeError):
         await message.answer(get_text('invalid_id_format', lang))
 
+@callbacks.action("import_users")
+async def process_import_users_start(callback: types.CallbackQuery, state: FSMContext, lang: str):
+    await callback.message.edit_text(get_text('ask_for_import_file', lang))
+    await state.set_state(AdminStates.import_users_file)
+    await callback.answer()
+
+@router.message(AdminStates.import_users_file, F.document)
+async def process_import_users_file(message: types.Message, state: FSMContext, bot: Bot, lang: str):
+    if message.document.file_size and message.document.file_size > MAX_IMPORT_FILE_SIZE:
+        await message.answer(get_text('import_file_too_large', lang))
+        return
+
+    file = await bot.download(message.document)
+    # Parsing tens of thousands of rows would stall the event loop
+    parsed = await asyncio.to_thread(parse_user_rows, file)
+    inserted = await db.import_users(parsed.rows) if parsed.rows else 0
+    for user_id, _, _ in parsed.rows:
+        profile_cache.invalidate(user_id)
+
+    await state.clear()
+    await message.answer(get_text('import_users_done', lang).format(
+        inserted=inserted,
+        duplicates=parsed.duplicates + len(parsed.rows) - inserted,
+        invalid=parsed.invalid
+    ))
+    await message.answer(
+        get_text('users_list', lang),
+        reply_markup=await get_users_keyboard(lang)
+    )
+
+@router.message(AdminStates.import_users_file)
+async def process_import_users_no_file(message: types.Message, lang: str):
+    await message.answer(get_text('import_file_required', lang))
+
+@callbacks.action("search_users")
+async def process_search_users_start(callback: types.CallbackQuery, state: FSMContext, lang: str):
+    await callback.message.edit_text(get_text('search_users_prompt', lang))
+    await state.set_state(AdminStates.search_users)
+    await callback.answer()
+
+@router.message(AdminStates.search_users, F.text)
+async def process_search_users_query(message: types.Message, state: FSMContext, lang: str):
+    # The state stays, so the next message is simply a new search
+    query = message.text.strip()
+    await state.update_data(search_query=query)
+    keyboard = await get_search_results_keyboard(query, lang)
+    if keyboard is None:
+        await message.answer(get_text('search_no_results', lang).format(query=query))
+        return
+    await message.answer(get_text('search_results', lang).format(query=query), reply_markup=keyboard)
+
+@callbacks.payload(SearchPage)
+async def process_search_users_page(callback: types.CallbackQuery, callback_data: SearchPage,
+                                    state: FSMContext, lang: str):
+    query = (await state.get_data()).get('search_query')
+    if query is None:
+        await callback.answer(get_text('search_expired', lang), show_alert=True)
+        return
+    await callback.message.edit_text(
+        get_text('search_results', lang).format(query=query),
+        reply_markup=await get_search_results_keyboard(query, lang, callback_data.after, callback_data.before)
+    )
+    await callback.answer()
+
+@callbacks.action("admin_inactive_users")
+async def process_inactive_users(callback: types.CallbackQuery, lang: str):
+    counts = await db.count_dead_users()
+    text = get_text('inactive_users_title', lang).format(
+        blocked=counts.get('blocked', 0),
+        deactivated=counts.get('deactivated', 0),
+        unreachable=counts.get('unreachable', 0)
+    )
+    await callback.message.edit_text(text, reply_markup=get_inactive_users_keyboard(lang))
+    await callback.answer()
+
+@callbacks.action("purge_inactive_users")
+async def process_purge_inactive_users(callback: types.CallbackQuery, lang: str):
+    # Configs will be deleted automatically due to "ON DELETE CASCADE"
+    user_ids = await db.purge_dead_users()
+    for user_id in user_ids:
+        profile_cache.invalidate(user_id)
+    subscription_cache.invalidate_many(user_ids)
+    await callback.answer(get_text('inactive_users_purged', lang).format(count=len(user_ids)), show_alert=True)
+    await callback.message.edit_text(
+        get_text('welcome_admin', lang),
+        reply_markup=get_main_keyboard_by_role(is_admin=True, lang=lang)
+    )
+
 # --- Config Management Section ---
 # (This section is also refactored to use the lang parameter)
 
-@router.callback_query(F.data.startswith("admin_configs_page_"))
-async def process_config_users_list(callback: types.CallbackQuery):
-    page = int(callback.data.split("_")[-1])
-    lang = get_admin_lang(callback.from_user.id)
+@callbacks.payload(ConfigUsersPage)
+async def process_config_users_list(callback: types.CallbackQuery, callback_data: ConfigUsersPage, lang: str):
     await callback.message.edit_text(
         get_text('choose_user_for_config', lang),
-        reply_markup=get_users_for_configs_keyboard(page, lang)
+        reply_markup=await get_users_for_configs_keyboard(lang, callback_data.after, callback_data.before)
     )
     await callback.answer()
 
-@router.callback_query(F.data.startswith("user_configs_manage_"))
-async def process_user_configs_manage(callback: types.CallbackQuery):
-    user_id = int(callback.data.split("_")[-1])
-    lang = get_admin_lang(callback.from_user.id)
+@callbacks.payload(UserConfigs)
+async def process_user_configs_manage(callback: types.CallbackQuery, callback_data: UserConfigs, lang: str):
+    user_id = callback_data.user_id
     await callback.message.edit_text(
         get_text('user_configs_title', lang),
-        reply_markup=get_user_configs_management_keyboard(user_id, lang)
+        reply_markup=await get_user_configs_management_keyboard(user_id, lang)
     )
     await callback.answer()
 
-@router.callback_query(F.data.startswith("delete_config:"))
-async def process_delete_config(callback: types.CallbackQuery):
-    _, config_id, user_id = callback.data.split(":")
-    config_id, user_id = int(config_id), int(user_id)
-    lang = get_admin_lang(callback.from_user.id)
+@callbacks.payload(DeleteConfig)
+async def process_delete_config(callback: types.CallbackQuery, callback_data: DeleteConfig, lang: str):
+    config_id, user_id = callback_data.config_id, callback_data.user_id
     
-    conn = sqlite3.connect('bot.db')
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM configs WHERE id = ?", (config_id,))
-    conn.commit()
-    conn.close()
+    await db.delete_config(config_id)
+    subscription_cache.invalidate(user_id)
 
     await callback.answer(get_text('config_deleted_ok', lang))
     await callback.message.edit_text(
         get_text('user_configs_title', lang),
-        reply_markup=get_user_configs_management_keyboard(user_id, lang)
+        reply_markup=await get_user_configs_management_keyboard(user_id, lang)
     )
 
+def _config_from_message(message: types.Message, config_type: str):
+    """Returns (config_type, config_data): files are stored by file_id, text as is."""
+    if message.document:
+        return f"file:{message.document.file_name}", message.document.file_id
+    return config_type, message.text
+
 # ... (Add Config FSM flow refactored for localization)
-@router.callback_query(F.data.startswith("add_config_"))
-async def process_add_config_start(callback: types.CallbackQuery, state: FSMContext):
-    user_id = int(callback.data.split("_")[-1])
-    lang = get_admin_lang(callback.from_user.id)
-    await state.update_data(current_user_id=user_id)
+@callbacks.payload(AddConfig)
+async def process_add_config_start(callback: types.CallbackQuery, callback_data: AddConfig,
+                                   state: FSMContext, lang: str):
+    await state.update_data(current_user_id=callback_data.user_id)
     await state.set_state(AdminStates.add_config_type)
     await callback.message.edit_text(get_text('add_config_step1', lang))
     await callback.answer()
 
 @router.message(AdminStates.add_config_type)
-async def process_add_config_type(message: types.Message, state: FSMContext):
-    lang = get_admin_lang(message.from_user.id)
+async def process_add_config_type(message: types.Message, state: FSMContext, lang: str):
     await state.update_data(config_type=message.text)
     await state.set_state(AdminStates.add_config_data)
     await message.answer(get_text('add_config_step2', lang))
 
 @router.message(AdminStates.add_config_data, F.content_type.in_({ContentType.TEXT, ContentType.DOCUMENT}))
-async def process_add_config_data(message: types.Message, state: FSMContext):
-    lang = get_admin_lang(message.from_user.id)
+async def process_add_config_data(message: types.Message, state: FSMContext, lang: str):
     data = await state.get_data()
     user_id = data['current_user_id']
-    
-    # ... (logic for handling file/text remains the same)
-    if message.document:
-        file_id = message.document.file_id
-        file_name = message.document.file_name
-        config_type = f"file:{file_name}"
-        config_data = file_id
-    else:
-        config_type = data['config_type']
-        config_data = message.text
+    config_type, config_data = _config_from_message(message, data['config_type'])
 
-    conn = sqlite3.connect('bot.db')
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO configs (user_id, config_type, config_data) VALUES (?, ?, ?)",
-                   (user_id, config_type, config_data))
-    conn.commit()
-    conn.close()
+    await db.insert_config(user_id, config_type, config_data)
+    subscription_cache.invalidate(user_id)
 
     await state.clear()
     await message.answer(get_text('config_added_ok', lang))
     await message.answer(
         get_text('user_configs_title', lang),
-        reply_markup=get_user_configs_management_keyboard(user_id, lang)
+        reply_markup=await get_user_configs_management_keyboard(user_id, lang)
+    )
+
+# --- Assign One Config to Many Users ---
+@callbacks.action("assign_config")
+async def process_assign_config_start(callback: types.CallbackQuery, state: FSMContext, lang: str):
+    await state.set_state(AdminStates.assign_config_type)
+    await callback.message.edit_text(get_text('assign_config_step1', lang))
+    await callback.answer()
+
+@router.message(AdminStates.assign_config_type, F.text)
+async def process_assign_config_type(message: types.Message, state: FSMContext, lang: str):
+    await state.update_data(config_type=message.text)
+    await state.set_state(AdminStates.assign_config_data)
+    await message.answer(get_text('assign_config_step2', lang))
+
+@router.message(AdminStates.assign_config_data, F.content_type.in_({ContentType.TEXT, ContentType.DOCUMENT}))
+async def process_assign_config_data(message: types.Message, state: FSMContext, lang: str):
+    config_type, config_data = _config_from_message(message, (await state.get_data())['config_type'])
+    await state.update_data(config_type=config_type, config_data=config_data)
+    await state.set_state(AdminStates.assign_config_targets)
+    await message.answer(get_text('assign_config_step3', lang), reply_markup=get_assign_config_keyboard(lang))
+
+@router.message(AdminStates.assign_config_targets, F.text)
+async def process_assign_config_targets(message: types.Message, state: FSMContext, lang: str):
+    if not _USER_ID_LIST.fullmatch(message.text):
+        await message.answer(get_text('assign_config_no_ids', lang), reply_markup=get_assign_config_keyboard(lang))
+        return
+    user_ids = sorted({int(user_id) for user_id in re.findall(r"\d+", message.text)})
+    data = await state.get_data()
+    assigned = await db.assign_config(data['config_type'], data['config_data'], user_ids)
+    subscription_cache.invalidate_many(assigned)
+
+    await state.clear()
+    await message.answer(
+        get_text('assign_config_done', lang).format(assigned=len(assigned), skipped=len(user_ids) - len(assigned)),
+        reply_markup=get_main_keyboard_by_role(is_admin=True, lang=lang)
+    )
+
+@callbacks.action("assign_config_all", AdminStates.assign_config_targets)
+async def process_assign_config_all(callback: types.CallbackQuery, state: FSMContext, lang: str):
+    data = await state.get_data()
+    assigned = await db.assign_config(data['config_type'], data['config_data'])
+    # Cheaper than sending every user ID to the other processes
+    subscription_cache.clear()
+
+    await state.clear()
+    await callback.message.edit_text(
+        get_text('assign_config_done_all', lang).format(assigned=len(assigned)),
+        reply_markup=get_main_keyboard_by_role(is_admin=True, lang=lang)
     )
+    await callback.answer()
+
+@callbacks.action("import_configs")
+async def process_import_configs_start(callback: types.CallbackQuery, state: FSMContext, lang: str):
+    await callback.message.edit_text(get_text('ask_for_config_import_file', lang))
+    await state.set_state(AdminStates.import_configs_file)
+    await callback.answer()
+
+@router.message(AdminStates.import_configs_file, F.document)
+async def process_import_configs_file(message: types.Message, state: FSMContext, bot: Bot, lang: str):
+    if message.document.file_size and message.document.file_size > MAX_IMPORT_FILE_SIZE:
+        await message.answer(get_text('import_file_too_large', lang))
+        return
+
+    file = await bot.download(message.document)
+    parsed = await asyncio.to_thread(parse_config_file, file, message.document.file_name)
+    result = await db.import_configs(parsed.rows)
+    subscription_cache.invalidate_many(user_id for user_id, _, _ in parsed.rows)
+
+    text = get_text('import_configs_done', lang).format(
+        inserted=result.inserted,
+        users=len(result.recipients),
+        duplicates=len(parsed.rows) - result.inserted - result.unknown_users,
+        unknown=result.unknown_users,
+        invalid=parsed.invalid
+    )
+    if result.recipients:
+        # Offer to notify the users; only ids, languages and counts are kept in the FSM
+        await state.set_state(AdminStates.import_configs_notify)
+        await state.set_data({'recipients': result.recipients})
+        await message.answer(text, reply_markup=get_config_import_keyboard(lang))
+    else:
+        await state.clear()
+        await message.answer(text, reply_markup=get_main_keyboard_by_role(is_admin=True, lang=lang))
+
+@router.message(AdminStates.import_configs_file)
+async def process_import_configs_no_file(message: types.Message, lang: str):
+    await message.answer(get_text('import_file_required', lang))
+
+@callbacks.action("import_configs_notify", AdminStates.import_configs_notify)
+async def process_import_configs_notify(callback: types.CallbackQuery, state: FSMContext, bot: Bot, lang: str):
+    data = await state.get_data()
+    await state.clear()
+    await callback.message.edit_text(get_text('config_notify_started', lang), reply_markup=None)
+    start_config_notification(bot, data['recipients'], callback.message.chat.id, lang)
+    await callback.answer()
+
+# --- Server Rotation ---
+@callbacks.action("rotate_configs")
+async def process_rotate_configs_start(callback: types.CallbackQuery, state: FSMContext, lang: str):
+    await state.set_state(AdminStates.rotate_configs_rules)
+    await callback.message.edit_text(get_text('rotate_configs_prompt', lang))
+    await callback.answer()
+
+@router.message(AdminStates.rotate_configs_rules, F.text)
+async def process_rotate_configs_rules(message: types.Message, state: FSMContext, lang: str):
+    try:
+        rules = parse_rotation_rules(message.text)
+        preview = await db.rotate_configs(partial(apply_rotation_rules, rules), dry_run=True)
+    except InvalidRotationRule as e:
+        await message.answer(get_text('rotate_configs_invalid', lang).format(line=e.line))
+        return
+    except re.error:
+        await message.answer(get_text('rotate_configs_bad_replacement', lang))
+        return
+    if not preview.templates:
+        await message.answer(get_text('rotate_configs_nothing', lang))
+        return
+
+    # The rules are parsed again on confirmation; compiled patterns do not fit in the FSM
+    await state.update_data(rotation_rules=message.text)
+    await state.set_state(AdminStates.rotate_configs_confirm)
+    await message.answer(
+        get_text('rotate_configs_preview', lang).format(
+            templates=preview.templates, assignments=preview.assignments, users=preview.users
+        ),
+        reply_markup=get_confirm_rotation_keyboard(lang)
+    )
+
+@callbacks.action("rotate_configs_confirm", AdminStates.rotate_configs_confirm)
+async def process_rotate_configs_confirm(callback: types.CallbackQuery, state: FSMContext, bot: Bot, lang: str):
+    data = await state.get_data()
+    await state.clear()
+    await callback.message.edit_text(get_text('rotate_configs_started', lang), reply_markup=None)
+    await callback.answer()
+
+    try:
+        rules = parse_rotation_rules(data['rotation_rules'])
+        result = await db.rotate_configs(partial(apply_rotation_rules, rules))
+    except Exception:
+        # The rotation runs in one transaction, so nothing was changed
+        logger.exception("Server rotation failed")
+        await callback.message.edit_text(
+            get_text('rotate_configs_failed', lang),
+            reply_markup=get_main_keyboard_by_role(is_admin=True, lang=lang)
+        )
+        return
+    subscription_cache.clear()
+    await callback.message.edit_text(
+        get_text('rotate_configs_done', lang).format(templates=result.templates, users=result.users)
+    )
+    start_config_notification(bot, result.recipients, callback.message.chat.id, lang, notice='configs_rotated_notice')
 
 # --- Tutorial Management Section ---
-@router.callback_query(F.data == "admin_tutorials_menu")
-async def process_tutorials_menu(callback: types.CallbackQuery):
-    lang = get_admin_lang(callback.from_user.id)
+@callbacks.action("admin_tutorials_menu")
+async def process_tutorials_menu(callback: types.CallbackQuery, lang: str):
     await callback.message.edit_text(
         get_text('tutorials_menu_title', lang),
-        reply_markup=get_tutorials_admin_keyboard(lang)
+        reply_markup=await get_tutorials_admin_keyboard(lang)
     )
     await callback.answer()
 # ... (rest of the tutorial management refactored similarly)
 
-@router.callback_query(F.data.startswith("delete_tutorial_"))
-async def process_delete_tutorial(callback: types.CallbackQuery):
-    tutorial_id = int(callback.data.split("_")[-1])
-    lang = get_admin_lang(callback.from_user.id)
-    conn = sqlite3.connect('bot.db')
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM tutorials WHERE id = ?", (tutorial_id,))
-    conn.commit()
-    conn.close()
+@callbacks.payload(DeleteTutorial)
+async def process_delete_tutorial(callback: types.CallbackQuery, callback_data: DeleteTutorial, lang: str):
+    await db.delete_tutorial(callback_data.tutorial_id)
     await callback.answer(get_text('tutorial_deleted_ok', lang))
     await callback.message.edit_text(
         get_text('tutorials_menu_title', lang),
-        reply_markup=get_tutorials_admin_keyboard(lang)
+        reply_markup=await get_tutorials_admin_keyboard(lang)
     )
 
-@router.callback_query(F.data == "add_tutorial")
-async def process_add_tutorial_start(callback: types.CallbackQuery, state: FSMContext):
-    lang = get_admin_lang(callback.from_user.id)
+@callbacks.action("add_tutorial")
+async def process_add_tutorial_start(callback: types.CallbackQuery, state: FSMContext, lang: str):
     await state.set_state(AdminStates.add_tutorial_title)
     await callback.message.edit_text(get_text('add_tutorial_step1', lang))
     await callback.answer()
 
 @router.message(AdminStates.add_tutorial_title)
-async def process_add_tutorial_title(message: types.Message, state: FSMContext):
-    lang = get_admin_lang(message.from_user.id)
+async def process_add_tutorial_title(message: types.Message, state: FSMContext, lang: str):
     await state.update_data(title=message.text)
     await state.set_state(AdminStates.add_tutorial_text)
     await message.answer(get_text('add_tutorial_step2', lang))
 
 @router.message(AdminStates.add_tutorial_text)
-async def process_add_tutorial_text(message: types.Message, state: FSMContext):
-    lang = get_admin_lang(message.from_user.id)
+async def process_add_tutorial_text(message: types.Message, state: FSMContext, lang: str):
     await state.update_data(text=message.text)
     await state.set_state(AdminStates.add_tutorial_media)
     await message.answer(
@@ -268,68 +504,168 @@ async def process_add_tutorial_text(message: types.Message, state: FSMContext):
         reply_markup=get_skip_media_keyboard(lang)
     )
 
-@router.callback_query(F.data == "skip_media", AdminStates.add_tutorial_media)
-async def process_skip_media(callback: types.CallbackQuery, state: FSMContext):
-    lang = get_admin_lang(callback.from_user.id)
+@callbacks.action("skip_media", AdminStates.add_tutorial_media)
+async def process_skip_media(callback: types.CallbackQuery, state: FSMContext, lang: str):
     data = await state.get_data()
     # ... (DB logic is the same)
-    conn = sqlite3.connect('bot.db')
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO tutorials (title, content_text) VALUES (?, ?)", (data['title'], data['text']))
-    conn.commit()
-    conn.close()
+    await db.insert_tutorial(data['title'], data['text'])
     await state.clear()
     await callback.message.edit_text(get_text('tutorial_added_ok_no_media', lang))
     await callback.message.answer(
         get_text('tutorials_menu_title', lang),
-        reply_markup=get_tutorials_admin_keyboard(lang)
+        reply_markup=await get_tutorials_admin_keyboard(lang)
     )
     await callback.answer()
 
-@router.message(AdminStates.add_tutorial_media, F.content_type.in_({ContentType.PHOTO, ContentType.VIDEO}))
-async def process_add_tutorial_media(message: types.Message, state: FSMContext):
-    lang = get_admin_lang(message.from_user.id)
-    # ... (DB and file_id logic is the same)
-    file_id = ""
-    if message.photo:
-        file_id = message.photo[-1].file_id
-    elif message.video:
-        file_id = message.video.file_id
+@router.message(AdminStates.add_tutorial_media, F.content_type.in_({
+    ContentType.PHOTO, ContentType.VIDEO, ContentType.ANIMATION, ContentType.DOCUMENT
+}))
+async def process_add_tutorial_media(message: types.Message, state: FSMContext, lang: str):
+    media_type, file_id = extract_media(message)
+    if message.media_group_id:
+        # Album items arrive as separate messages; collect them before saving
+        key = (message.from_user.id, message.media_group_id)
+        if key not in _pending_albums:
+            _pending_albums[key] = []
+            task = asyncio.create_task(_save_tutorial_album(message, state, lang, key))
+            _album_tasks.add(task)
+            task.add_done_callback(_album_tasks.discard)
+        _pending_albums[key].append((message.message_id, media_type, file_id))
+        return
+
     data = await state.get_data()
-    conn = sqlite3.connect('bot.db')
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO tutorials (title, content_text, file_id) VALUES (?, ?, ?)",
-                   (data['title'], data['text'], file_id))
-    conn.commit()
-    conn.close()
+    await db.insert_tutorial(data['title'], data['text'], file_id, media_type)
     await state.clear()
     await message.answer(get_text('tutorial_added_ok_with_media', lang))
     await message.answer(
         get_text('tutorials_menu_title', lang),
-        reply_markup=get_tutorials_admin_keyboard(lang)
+        reply_markup=await get_tutorials_admin_keyboard(lang)
+    )
+
+async def _save_tutorial_album(message: types.Message, state: FSMContext, lang: str, key: tuple):
+    await asyncio.sleep(ALBUM_COLLECT_DELAY)
+    items = sorted(_pending_albums.pop(key))
+    data = await state.get_data()
+    await db.insert_tutorial(
+        data['title'], data['text'],
+        encode_album([(media_type, file_id) for _, media_type, file_id in items]), ALBUM
+    )
+    await state.clear()
+    await message.answer(get_text('tutorial_added_ok_with_media', lang))
+    await message.answer(
+        get_text('tutorials_menu_title', lang),
+        reply_markup=await get_tutorials_admin_keyboard(lang)
     )
 
 # --- Mass Messaging Section ---
-@router.callback_query(F.data == "mass_send_start")
-async def process_mass_send_start(callback: types.CallbackQuery, state: FSMContext):
-    lang = get_admin_lang(callback.from_user.id)
+# Delivery statuses behind each audience status option
+AUDIENCE_DELIVERY_STATUSES = {'active': ('active',), 'inactive': DEAD_DELIVERY_STATUSES, 'all': ()}
+DEFAULT_AUDIENCE = {'language': '', 'status': 'active', 'config_type': None, 'config_match': None}
+
+def _audience_segment(audience: dict) -> BroadcastSegment:
+    return BroadcastSegment(
+        languages=(audience['language'],) if audience['language'] else (),
+        delivery_statuses=AUDIENCE_DELIVERY_STATUSES[audience['status']],
+        config_type=audience['config_type'],
+        config_match=audience['config_match']
+    )
+
+async def _audience_view(audience: dict, lang: str):
+    count = await db.count_segment_users(_audience_segment(audience))
+    return get_text('mass_send_audience', lang).format(count=count), get_broadcast_audience_keyboard(lang, **audience)
+
+async def _confirm_view(data: dict, lang: str):
+    audience, versions = data['audience'], data['messages']
+    count = await db.count_segment_users(_audience_segment(audience))
+    # Other language versions only matter when the audience mixes languages
+    missing = () if audience['language'] else tuple(code for code in locales if code not in versions)
+    text = get_text('mass_send_confirm_segment', lang).format(
+        count=count, versions=", ".join(code.upper() for code in versions) or "—"
+    )
+    return text, get_confirm_send_keyboard(lang, missing)
+
+@callbacks.action("mass_send_start")
+async def process_mass_send_start(callback: types.CallbackQuery, state: FSMContext, lang: str):
+    await state.set_state(AdminStates.mass_send_audience)
+    await state.set_data({'audience': DEFAULT_AUDIENCE})
+    text, keyboard = await _audience_view(DEFAULT_AUDIENCE, lang)
+    await callback.message.edit_text(text, reply_markup=keyboard)
+    await callback.answer()
+
+@callbacks.payload(BroadcastAudience, AdminStates.mass_send_audience)
+async def process_mass_send_audience(callback: types.CallbackQuery, callback_data: BroadcastAudience,
+                                     state: FSMContext, lang: str):
+    field, value = callback_data.field, callback_data.value
+    if field in ('config_type', 'config_match'):
+        await state.set_state(AdminStates.mass_send_config_type if field == 'config_type'
+                              else AdminStates.mass_send_config_match)
+        await callback.message.edit_text(get_text(f'audience_ask_{field}', lang))
+        await callback.answer()
+        return
+
+    audience = dict((await state.get_data())['audience'])
+    valid = (field == 'language' and (not value or value in locales)) or \
+            (field == 'status' and value in AUDIENCE_DELIVERY_STATUSES)
+    if not valid or audience[field] == value:
+        await callback.answer()
+        return
+    audience[field] = value
+    await state.update_data(audience=audience)
+    text, keyboard = await _audience_view(audience, lang)
+    await callback.message.edit_text(text, reply_markup=keyboard)
+    await callback.answer()
+
+@router.message(StateFilter(AdminStates.mass_send_config_type, AdminStates.mass_send_config_match), F.text)
+async def process_mass_send_audience_filter(message: types.Message, state: FSMContext, raw_state: str, lang: str):
+    field = 'config_type' if raw_state == AdminStates.mass_send_config_type.state else 'config_match'
+    value = message.text.strip()
+    audience = dict((await state.get_data())['audience'])
+    audience[field] = None if value == '-' else value[:MAX_CONFIG_FILTER_LENGTH]
+    await state.update_data(audience=audience)
+    await state.set_state(AdminStates.mass_send_audience)
+    text, keyboard = await _audience_view(audience, lang)
+    await message.answer(text, reply_markup=keyboard)
+
+@callbacks.action("mass_send_audience_done", AdminStates.mass_send_audience)
+async def process_mass_send_audience_done(callback: types.CallbackQuery, state: FSMContext, lang: str):
+    audience = (await state.get_data())['audience']
+    if not await db.count_segment_users(_audience_segment(audience)):
+        await callback.answer(get_text('mass_send_no_recipients', lang), show_alert=True)
+        return
     await state.set_state(AdminStates.mass_send_message)
     await callback.message.edit_text(get_text('mass_send_ask_message', lang))
     await callback.answer()
 
 @router.message(AdminStates.mass_send_message)
-async def process_mass_send_message(message: types.Message, state: FSMContext):
-    lang = get_admin_lang(message.from_user.id)
-    await state.update_data(message_to_send=message)
+async def process_mass_send_message(message: types.Message, state: FSMContext, lang: str):
+    # Keep a reference only; the message is copied from the admin's chat when sending
+    await state.update_data(from_chat_id=message.chat.id, message_id=message.message_id, messages={})
     await state.set_state(AdminStates.mass_send_confirm)
-    await message.answer(
-        get_text('mass_send_confirm_message', lang),
-        reply_markup=get_confirm_send_keyboard(lang)
+    text, keyboard = await _confirm_view(await state.get_data(), lang)
+    await message.answer(text, reply_markup=keyboard)
+
+@callbacks.payload(BroadcastVersion, AdminStates.mass_send_confirm)
+async def process_mass_send_version(callback: types.CallbackQuery, callback_data: BroadcastVersion,
+                                    state: FSMContext, lang: str):
+    await state.update_data(version_lang=callback_data.lang)
+    await state.set_state(AdminStates.mass_send_version)
+    await callback.message.edit_text(
+        get_text('mass_send_ask_version', lang).format(language=callback_data.lang.upper())
     )
+    await callback.answer()
 
-@router.callback_query(F.data == "send_cancelled", AdminStates.mass_send_confirm)
-async def process_send_cancelled(callback: types.CallbackQuery, state: FSMContext):
-    lang = get_admin_lang(callback.from_user.id)
+@router.message(AdminStates.mass_send_version)
+async def process_mass_send_version_message(message: types.Message, state: FSMContext, lang: str):
+    data = await state.get_data()
+    # Versions are copied from the same chat as the main message
+    messages = {**data['messages'], data['version_lang']: message.message_id}
+    await state.update_data(messages=messages)
+    await state.set_state(AdminStates.mass_send_confirm)
+    text, keyboard = await _confirm_view({**data, 'messages': messages}, lang)
+    await message.answer(text, reply_markup=keyboard)
+
+@callbacks.action("send_cancelled", AdminStates.mass_send_confirm)
+async def process_send_cancelled(callback: types.CallbackQuery, state: FSMContext, lang: str):
     await state.clear()
     await callback.message.edit_text(
         get_text('mass_send_cancelled', lang),
@@ -337,37 +673,30 @@ async def process_send_cancelled(callback: types.CallbackQuery, state: FSMContex
     )
     await callback.answer()
 
-@router.callback_query(F.data == "send_confirmed", AdminStates.mass_send_confirm)
-async def process_send_confirmed(callback: types.CallbackQuery, state: FSMContext, bot: Bot):
-    lang = get_admin_lang(callback.from_user.id)
+@callbacks.action("send_confirmed", AdminStates.mass_send_confirm)
+async def process_send_confirmed(callback: types.CallbackQuery, state: FSMContext, bot: Bot, lang: str):
     data = await state.get_data()
-    message_to_send = data['message_to_send']
     await state.clear()
 
     await callback.message.edit_text(get_text('mass_send_started', lang), reply_markup=None)
-    
-    conn = sqlite3.connect('bot.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT telegram_id FROM users WHERE is_admin = 0")
-    user_ids = cursor.fetchall()
-    conn.close()
-
-    success_count = 0
-    fail_count = 0
-    for (user_id,) in user_ids:
-        try:
-            await message_to_send.copy_to(chat_id=user_id)
-            success_count += 1
-        except TelegramAPIError as e:
-            print(f"Failed to send to {user_id}: {e}")
-            fail_count += 1
-        await asyncio.sleep(0.1)
-
-    result_text = get_text('mass_send_finished', lang).format(
-        success_count=success_count,
-        fail_count=fail_count
-    )
-    await callback.message.answer(
-        result_text,
-        reply_markup=get_main_keyboard_by_role(is_admin=True, lang=lang)
+
+    # The job is persisted, so a restart resumes it instead of losing progress
+    job = await db.create_broadcast_job(
+        admin_id=callback.from_user.id,
+        lang=lang,
+        from_chat_id=data['from_chat_id'],
+        message_id=data['message_id'],
+        status_chat_id=callback.message.chat.id,
+        status_message_id=callback.message.message_id,
+        segment=_audience_segment(data['audience']),
+        messages=data['messages']
     )
+    start_broadcast_job(bot, job)
+    await callback.answer()
+
+@callbacks.payload(StopBroadcast)
+async def process_mass_send_stop(callback: types.CallbackQuery, callback_data: StopBroadcast, lang: str):
+    if stop_broadcast_job(callback_data.job_id):
+        await callback.answer(get_text('mass_send_stopping', lang))
+    else:
+        await callback.answer(get_text('mass_send_not_running', lang), show_alert=True)
@@ -1,22 +1,18 @@
 # handlers/settings_handlers.py
 
-import sqlite3
-from aiogram import Router, F, types
+from aiogram import Router, types
 
+from callbacks import CallbackRoutes, SetLanguage
 from keyboards import get_language_choice_keyboard, get_main_keyboard_by_role
+from database import db
 from localization import get_text
+from middlewares import profile_cache
 
 router = Router()
+callbacks = CallbackRoutes(router)
 
-@router.callback_query(F.data == "settings")
-async def process_settings(callback: types.CallbackQuery):
-    # Получаем язык пользователя для корректного отображения меню
-    conn = sqlite3.connect('bot.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT language_code FROM users WHERE telegram_id = ?", (callback.from_user.id,))
-    lang = cursor.fetchone()[0]
-    conn.close()
-
+@callbacks.action("settings")
+async def process_settings(callback: types.CallbackQuery, lang: str):
     await callback.message.edit_text(
         get_text('choose_language', lang),
         reply_markup=get_language_choice_keyboard()
@@ -24,18 +20,15 @@ async def process_settings(callback: types.CallbackQuery):
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("set_lang_"))
-async def process_set_language(callback: types.CallbackQuery):
-    lang_code = callback.data.split("_")[-1]
+@callbacks.payload(SetLanguage)
+async def process_set_language(callback: types.CallbackQuery, callback_data: SetLanguage):
+    lang_code = callback_data.lang
     user_id = callback.from_user.id
 
-    conn = sqlite3.connect('bot.db')
-    cursor = conn.cursor()
-    cursor.execute("UPDATE users SET language_code = ? WHERE telegram_id = ?", (lang_code, user_id))
-    cursor.execute("SELECT is_admin FROM users WHERE telegram_id = ?", (user_id,))
-    is_admin = cursor.fetchone()[0]
-    conn.commit()
-    conn.close()
+    user = await db.set_user_language(user_id, lang_code)
+    if user:
+        profile_cache.put(user)
+    is_admin = user.is_admin if user else False
 
     await callback.message.edit_text(get_text('language_changed', lang_code))
     
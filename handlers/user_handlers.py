@@ -1,92 +1,111 @@
 # handlers/user_handlers.py
 
-import sqlite3
-from aiogram import Router, F, types, Bot
-from keyboards import get_main_keyboard_by_role, get_tutorials_user_keyboard
+from aiogram import Router, types, Bot
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import BufferedInputFile
+
+from broadcast import record_delivery_error
+from callbacks import CallbackRoutes, ViewTutorial
+from config_delivery import build_configs_file, plan_config_delivery
+from keyboards import get_main_keyboard_by_role, get_tutorials_user_keyboard, get_user_configs_keyboard
+from database import db
 from localization import get_text
+from subscription import is_enabled as subscription_enabled, subscription_url
+from tutorial_media import send_tutorial_media
 
 router = Router()
-
-# Вспомогательная функция для получения языка пользователя
-def get_user_lang(user_id: int) -> str:
-    conn = sqlite3.connect('bot.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT language_code FROM users WHERE telegram_id = ?", (user_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result[0] if result else 'en'
+callbacks = CallbackRoutes(router)
 
 # Новый обработчик для кнопки "Назад в меню" из раздела помощи
-@router.callback_query(F.data == "user_main_menu")
-async def process_back_to_main_menu(callback: types.CallbackQuery):
-    lang = get_user_lang(callback.from_user.id)
+@callbacks.action("user_main_menu")
+async def process_back_to_main_menu(callback: types.CallbackQuery, lang: str):
     await callback.message.edit_text(
         get_text('welcome', lang),
         reply_markup=get_main_keyboard_by_role(is_admin=False, lang=lang)
     )
     await callback.answer()
 
-@router.callback_query(F.data == "user_configs")
-async def process_user_configs(callback: types.CallbackQuery, bot: Bot):
+@callbacks.action("user_configs")
+async def process_user_configs(callback: types.CallbackQuery, bot: Bot, lang: str):
     user_id = callback.from_user.id
-    lang = get_user_lang(user_id)
     
-    conn = sqlite3.connect('bot.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT config_type, config_data FROM configs WHERE user_id = ?", (user_id,))
-    user_configs = cursor.fetchall()
-    conn.close()
+    user_configs = await db.get_configs_for_user(user_id)
 
+    try:
+        if not user_configs:
+            await callback.message.answer(
+                f"{get_text('no_configs_yet', lang)}\n\n{get_text('next_action', lang)}",
+                reply_markup=get_main_keyboard_by_role(is_admin=False, lang=lang)
+            )
+        else:
+            # Files go out as media groups, text configs are packed into as few messages as possible
+            plan = plan_config_delivery(user_configs, lang)
+            for group in plan.document_groups:
+                if len(group) == 1:
+                    await bot.send_document(chat_id=user_id, document=group[0].media, caption=group[0].caption)
+                else:
+                    await bot.send_media_group(chat_id=user_id, media=group)
+            for text in plan.text_messages[:-1]:
+                await callback.message.answer(text, parse_mode="HTML")
+            await callback.message.answer(
+                plan.text_messages[-1],
+                parse_mode="HTML",
+                reply_markup=get_user_configs_keyboard(lang)
+            )
+    except TelegramAPIError as e:
+        await record_delivery_error(user_id, e)
+        raise
+    await callback.answer()
+
+@callbacks.action("user_configs_file")
+async def process_user_configs_file(callback: types.CallbackQuery, lang: str):
+    user_configs = [config for config in await db.get_configs_for_user(callback.from_user.id)
+                    if not config.config_type.startswith("file:")]
     if not user_configs:
-        await callback.message.answer(get_text('no_configs_yet', lang))
-    else:
-        await callback.message.answer(get_text('your_configs', lang))
-        for config_type, config_data in user_configs:
-            if config_type.startswith("file:"):
-                file_id = config_data
-                caption = f"{get_text('config_type', lang)}: {config_type.split(':', 1)[1]}"
-                await bot.send_document(chat_id=user_id, document=file_id, caption=caption)
-            else:
-                await callback.message.answer(f"{get_text('config_type', lang)}: `{config_type}`\n\n`{config_data}`", parse_mode="Markdown")
-    
+        await callback.answer(get_text('no_configs_yet', lang), show_alert=True)
+        return
+    await callback.message.answer_document(
+        BufferedInputFile(build_configs_file(user_configs), filename="configs.txt")
+    )
+    await callback.answer()
+
+@callbacks.action("user_subscription")
+async def process_user_subscription(callback: types.CallbackQuery, lang: str):
+    if not subscription_enabled():
+        await callback.answer(get_text('error_not_found', lang), show_alert=True)
+        return
     await callback.message.answer(
-        get_text('next_action', lang),
-        reply_markup=get_main_keyboard_by_role(is_admin=False, lang=lang)
+        get_text('subscription_link', lang).format(url=subscription_url(callback.from_user.id)),
+        parse_mode="HTML"
     )
     await callback.answer()
 
-@router.callback_query(F.data == "user_help")
-async def process_user_help(callback: types.CallbackQuery):
-    lang = get_user_lang(callback.from_user.id)
+@callbacks.action("user_help")
+async def process_user_help(callback: types.CallbackQuery, lang: str):
     await callback.message.edit_text(
         get_text('choose_tutorial', lang),
-        reply_markup=get_tutorials_user_keyboard(lang)
+        reply_markup=await get_tutorials_user_keyboard(lang)
     )
     await callback.answer()
 
-@router.callback_query(F.data.startswith("view_tutorial_"))
-async def process_view_tutorial(callback: types.CallbackQuery, bot: Bot):
+@callbacks.payload(ViewTutorial)
+async def process_view_tutorial(callback: types.CallbackQuery, callback_data: ViewTutorial, bot: Bot, lang: str):
     user_id = callback.from_user.id
-    lang = get_user_lang(user_id)
-    tutorial_id = int(callback.data.split("_")[-1])
-    
-    conn = sqlite3.connect('bot.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT content_text, file_id FROM tutorials WHERE id = ?", (tutorial_id,))
-    tutorial = cursor.fetchone()
-    conn.close()
+
+    tutorial = await db.get_tutorial(callback_data.tutorial_id)
 
     if tutorial:
-        content_text, file_id = tutorial
         # Сначала удаляем предыдущее сообщение с кнопками
         await callback.message.delete()
-        if file_id:
-            try:
-                await bot.send_photo(chat_id=user_id, photo=file_id, caption=content_text)
-            except:
-                await bot.send_video(chat_id=user_id, video=file_id, caption=content_text)
+        if tutorial.file_id:
+            media_type = await send_tutorial_media(
+                bot, user_id, tutorial.media_type, tutorial.file_id, tutorial.content_text
+            )
+            if media_type != tutorial.media_type:
+                # Старая запись без типа: запоминаем его, чтобы не повторять проверку
+                await db.set_tutorial_media_type(tutorial.id, media_type)
         else:
-            await callback.message.answer(content_text)
+            await callback.message.answer(tutorial.content_text)
         
         await callback.message.answer(
             get_text('next_action', lang),
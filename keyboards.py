@@ -1,22 +1,67 @@
 # keyboards.py
 
-import sqlite3
+from functools import lru_cache, partial
+from typing import Callable, Dict, Optional, Tuple, Type
+
+from aiogram.filters.callback_data import CallbackData
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from localization import get_text
+from callbacks import (
+    AddConfig, BroadcastAudience, BroadcastVersion, ConfigUsersPage, DeleteConfig, DeleteTutorial,
+    DeleteUser, ManageUser, SearchPage, SetLanguage, StopBroadcast, UserConfigs, UsersPage, ViewTutorial
+)
+from database import db
+from localization import get_text, locales
+import subscription
 
 USERS_PER_PAGE = 5
+# Варианты статуса доставки в выборе получателей рассылки
+AUDIENCE_STATUSES = ('active', 'inactive', 'all')
+
+# --- КЭШ РАЗМЕТКИ ---
+# Статичные меню зависят только от (роль, язык), поэтому строятся один раз на язык
+# и переиспользуются. Один объект разметки отдаётся всем пользователям, поэтому
+# после build_markup_cache() закэшированную разметку нельзя изменять.
+
+_markup_cache: Dict[Tuple, InlineKeyboardMarkup] = {}
+
+def _cached_markup(key: Tuple, build: Callable[[], InlineKeyboardMarkup]) -> InlineKeyboardMarkup:
+    markup = _markup_cache.get(key)
+    if markup is None:
+        markup = _markup_cache[key] = build()
+    return markup
+
+def _normalize_lang(lang: str) -> str:
+    # get_text всё равно откатывается на английский, а кэш не должен расти от мусорных кодов
+    return lang if lang in locales else 'en'
+
+def build_markup_cache() -> None:
+    """Заранее строит статичные меню для всех языков из locales."""
+    get_language_choice_keyboard()
+    for lang in locales:
+        get_main_keyboard_by_role(True, lang)
+        get_main_keyboard_by_role(False, lang)
+        get_user_configs_keyboard(lang)
+        get_back_to_menu_keyboard(lang)
+        get_inactive_users_keyboard(lang)
+        get_confirm_send_keyboard(lang)
+        get_skip_media_keyboard(lang)
 
 # --- ОСНОВНЫЕ КЛАВИАТУРЫ ---
 
 def get_main_keyboard_by_role(is_admin: bool, lang: str) -> InlineKeyboardMarkup:
     """Возвращает админскую или пользовательскую клавиатуру на нужном языке."""
+    lang = _normalize_lang(lang)
+    return _cached_markup(('main', bool(is_admin), lang), lambda: _build_main_keyboard(bool(is_admin), lang))
+
+def _build_main_keyboard(is_admin: bool, lang: str) -> InlineKeyboardMarkup:
     buttons = []
     if is_admin:
         buttons = [
-            [InlineKeyboardButton(text=get_text('manage_users_btn', lang), callback_data="admin_users_page_0")],
-            [InlineKeyboardButton(text=get_text('manage_configs_btn', lang), callback_data="admin_configs_page_0")],
+            [InlineKeyboardButton(text=get_text('manage_users_btn', lang), callback_data=UsersPage().pack())],
+            [InlineKeyboardButton(text=get_text('manage_configs_btn', lang), callback_data=ConfigUsersPage().pack())],
             [InlineKeyboardButton(text=get_text('manage_tutorials_btn', lang), callback_data="admin_tutorials_menu")],
-            [InlineKeyboardButton(text=get_text('mass_send_btn', lang), callback_data="mass_send_start")]
+            [InlineKeyboardButton(text=get_text('mass_send_btn', lang), callback_data="mass_send_start")],
+            [InlineKeyboardButton(text=get_text('inactive_users_btn', lang), callback_data="admin_inactive_users")]
         ]
     else:
         buttons = [
@@ -27,92 +72,143 @@ def get_main_keyboard_by_role(is_admin: bool, lang: str) -> InlineKeyboardMarkup
     buttons.append([InlineKeyboardButton(text=get_text('settings', lang), callback_data="settings")])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
+def get_user_configs_keyboard(lang: str) -> InlineKeyboardMarkup:
+    """Пользовательское меню с кнопками выгрузки конфигураций файлом и ссылкой-подпиской."""
+    lang = _normalize_lang(lang)
+    def build():
+        rows = [[InlineKeyboardButton(text=get_text('download_configs_btn', lang), callback_data="user_configs_file")]]
+        if subscription.is_enabled():
+            rows.append([InlineKeyboardButton(text=get_text('subscription_btn', lang), callback_data="user_subscription")])
+        return InlineKeyboardMarkup(inline_keyboard=[*rows, *get_main_keyboard_by_role(False, lang).inline_keyboard])
+    return _cached_markup(('user_configs', lang), build)
+
 def get_back_to_menu_keyboard(lang: str) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
+    lang = _normalize_lang(lang)
+    return _cached_markup(('back_to_menu', lang), lambda: InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text=get_text('back_to_menu', lang), callback_data="admin_menu")]
-    ])
+    ]))
 
 # --- НАСТРОЙКИ ЯЗЫКА ---
 
 def get_language_choice_keyboard() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="English 🇬🇧", callback_data="set_lang_en")],
-        [InlineKeyboardButton(text="Русский 🇷🇺", callback_data="set_lang_ru")]
-    ])
+    return _cached_markup(('language_choice',), lambda: InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="English 🇬🇧", callback_data=SetLanguage(lang="en").pack())],
+        [InlineKeyboardButton(text="Русский 🇷🇺", callback_data=SetLanguage(lang="ru").pack())]
+    ]))
 
 # --- УПРАВЛЕНИЕ ПОЛЬЗОВАТЕЛЯМИ ---
 
-def get_users_keyboard(page: int, lang: str) -> InlineKeyboardMarkup:
-    conn = sqlite3.connect('bot.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) FROM users WHERE is_admin = 0")
-    total_users = cursor.fetchone()[0]
-    offset = page * USERS_PER_PAGE
-    cursor.execute("SELECT telegram_id, username FROM users WHERE is_admin = 0 LIMIT ? OFFSET ?", (USERS_PER_PAGE, offset))
-    users = cursor.fetchall()
-    conn.close()
-    
+async def _build_users_page_keyboard(page: Type[CallbackData], item: Type[CallbackData], lang: str,
+                                     after_id: Optional[int], before_id: Optional[int],
+                                     extra_rows: list, fetch_page: Callable = db.list_users_page) -> list:
+    """
+    Общий построитель списка пользователей с keyset-пагинацией.
+
+    page/item - типы callback_data страницы и пункта списка. Курсор (after/before id)
+    кодируется прямо в callback_data, поэтому любая страница стоит один индексный запрос.
+    fetch_page(limit, after_id=, before_id=) возвращает (users, has_more).
+    """
+    users, has_more = await fetch_page(USERS_PER_PAGE, after_id=after_id, before_id=before_id)
+
     keyboard = []
-    for user_id, username in users:
+    for user_id, username, _, _, delivery_status in users:
         button_text = f"@{username}" if username else f"ID: {user_id}"
-        keyboard.append([InlineKeyboardButton(text=button_text, callback_data=f"manage_user_{user_id}")])
-    
+        if delivery_status != 'active':
+            button_text = f"🚫 {button_text}"
+        keyboard.append([InlineKeyboardButton(text=button_text, callback_data=item(user_id=user_id).pack())])
+
+    # Листая назад, лишняя строка означает наличие предыдущей страницы, вперёд - следующей
+    has_prev = has_more if before_id is not None else after_id is not None
+    has_next = has_more if before_id is None else True
     nav_buttons = []
-    if page > 0:
-        nav_buttons.append(InlineKeyboardButton(text=get_text('prev_btn', lang), callback_data=f"admin_users_page_{page-1}"))
-    if (page + 1) * USERS_PER_PAGE < total_users:
-        nav_buttons.append(InlineKeyboardButton(text=get_text('next_btn', lang), callback_data=f"admin_users_page_{page+1}"))
+    if users and has_prev:
+        nav_buttons.append(InlineKeyboardButton(text=get_text('prev_btn', lang), callback_data=page(before=users[0].telegram_id).pack()))
+    if users and has_next:
+        nav_buttons.append(InlineKeyboardButton(text=get_text('next_btn', lang), callback_data=page(after=users[-1].telegram_id).pack()))
+    if not users and (after_id is not None or before_id is not None):
+        nav_buttons.append(InlineKeyboardButton(text=get_text('prev_btn', lang), callback_data=page().pack()))
     if nav_buttons:
         keyboard.append(nav_buttons)
-        
-    keyboard.append([InlineKeyboardButton(text=get_text('add_user_btn', lang), callback_data="add_user")])
-    keyboard.append([InlineKeyboardButton(text=get_text('back_to_menu', lang), callback_data="admin_menu")])
+
+    keyboard.extend(extra_rows)
+    return keyboard
+
+async def get_users_keyboard(lang: str, after_id: Optional[int] = None,
+                             before_id: Optional[int] = None) -> InlineKeyboardMarkup:
+    keyboard = await _build_users_page_keyboard(UsersPage, ManageUser, lang, after_id, before_id, [
+        [InlineKeyboardButton(text=get_text('search_users_btn', lang), callback_data="search_users")],
+        [InlineKeyboardButton(text=get_text('add_user_btn', lang), callback_data="add_user"),
+         InlineKeyboardButton(text=get_text('import_users_btn', lang), callback_data="import_users")],
+        [InlineKeyboardButton(text=get_text('back_to_menu', lang), callback_data="admin_menu")]
+    ])
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
+async def get_search_results_keyboard(query: str, lang: str, after_id: Optional[int] = None,
+                                      before_id: Optional[int] = None) -> Optional[InlineKeyboardMarkup]:
+    """Страница результатов поиска или None, если искать нечего. Сам запрос хранится в FSM."""
+    keyboard = await _build_users_page_keyboard(
+        SearchPage, ManageUser, lang, after_id, before_id, [], fetch_page=partial(db.search_users, query)
+    )
+    if not keyboard and after_id is None and before_id is None:
+        return None
+    keyboard.extend([
+        [InlineKeyboardButton(text=get_text('back_to_list_btn', lang), callback_data=UsersPage().pack())],
+        [InlineKeyboardButton(text=get_text('back_to_menu', lang), callback_data="admin_menu")]
+    ])
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+@lru_cache(maxsize=1024)
 def user_management_keyboard(user_id: int, lang: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=get_text('delete_user_btn', lang), callback_data=f"delete_user_{user_id}")],
-        [InlineKeyboardButton(text=get_text('back_to_list_btn', lang), callback_data="admin_users_page_0")]
+        [InlineKeyboardButton(text=get_text('delete_user_btn', lang), callback_data=DeleteUser(user_id=user_id).pack())],
+        [InlineKeyboardButton(text=get_text('back_to_list_btn', lang), callback_data=UsersPage().pack())]
     ])
 
+def get_inactive_users_keyboard(lang: str) -> InlineKeyboardMarkup:
+    lang = _normalize_lang(lang)
+    return _cached_markup(('inactive_users', lang), lambda: InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=get_text('purge_inactive_btn', lang), callback_data="purge_inactive_users")],
+        [InlineKeyboardButton(text=get_text('back_to_menu', lang), callback_data="admin_menu")]
+    ]))
+
 # --- УПРАВЛЕНИЕ КОНФИГУРАЦИЯМИ ---
 
-def get_users_for_configs_keyboard(page: int, lang: str) -> InlineKeyboardMarkup:
-    # Эта функция дублирует get_users_keyboard, но с другими callback_data
-    conn = sqlite3.connect('bot.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) FROM users WHERE is_admin = 0")
-    total_users = cursor.fetchone()[0]
-    offset = page * USERS_PER_PAGE
-    cursor.execute("SELECT telegram_id, username FROM users WHERE is_admin = 0 LIMIT ? OFFSET ?", (USERS_PER_PAGE, offset))
-    users = cursor.fetchall()
-    conn.close()
-    
-    keyboard = []
-    for user_id, username in users:
-        button_text = f"@{username}" if username else f"ID: {user_id}"
-        keyboard.append([InlineKeyboardButton(text=button_text, callback_data=f"user_configs_manage_{user_id}")])
-        
-    nav_buttons = []
-    if page > 0:
-        nav_buttons.append(InlineKeyboardButton(text=get_text('prev_btn', lang), callback_data=f"admin_configs_page_{page-1}"))
-    if (page + 1) * USERS_PER_PAGE < total_users:
-        nav_buttons.append(InlineKeyboardButton(text=get_text('next_btn', lang), callback_data=f"admin_configs_page_{page+1}"))
-    if nav_buttons:
-        keyboard.append(nav_buttons)
-        
-    keyboard.append([InlineKeyboardButton(text=get_text('back_to_menu', lang), callback_data="admin_menu")])
+async def get_users_for_configs_keyboard(lang: str, after_id: Optional[int] = None,
+                                         before_id: Optional[int] = None) -> InlineKeyboardMarkup:
+    keyboard = await _build_users_page_keyboard(ConfigUsersPage, UserConfigs, lang, after_id, before_id, [
+        [InlineKeyboardButton(text=get_text('assign_config_btn', lang), callback_data="assign_config")],
+        [InlineKeyboardButton(text=get_text('import_configs_btn', lang), callback_data="import_configs"),
+         InlineKeyboardButton(text=get_text('rotate_configs_btn', lang), callback_data="rotate_configs")],
+        [InlineKeyboardButton(text=get_text('back_to_menu', lang), callback_data="admin_menu")]
+    ])
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
-def get_user_configs_management_keyboard(user_id: int, lang: str) -> InlineKeyboardMarkup:
-    conn = sqlite3.connect('bot.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, config_type, config_data FROM configs WHERE user_id = ?", (user_id,))
-    configs = cursor.fetchall()
-    conn.close()
+def get_config_import_keyboard(lang: str) -> InlineKeyboardMarkup:
+    lang = _normalize_lang(lang)
+    return _cached_markup(('config_import', lang), lambda: InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=get_text('notify_users_btn', lang), callback_data="import_configs_notify")],
+        [InlineKeyboardButton(text=get_text('back_to_menu', lang), callback_data="admin_menu")]
+    ]))
+
+def get_assign_config_keyboard(lang: str) -> InlineKeyboardMarkup:
+    lang = _normalize_lang(lang)
+    return _cached_markup(('assign_config', lang), lambda: InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=get_text('assign_all_users_btn', lang), callback_data="assign_config_all")],
+        [InlineKeyboardButton(text=get_text('back_to_menu', lang), callback_data="admin_menu")]
+    ]))
+
+def get_confirm_rotation_keyboard(lang: str) -> InlineKeyboardMarkup:
+    lang = _normalize_lang(lang)
+    return _cached_markup(('confirm_rotation', lang), lambda: InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=get_text('rotate_configs_confirm_btn', lang), callback_data="rotate_configs_confirm")],
+        [InlineKeyboardButton(text=get_text('back_to_menu', lang), callback_data="admin_menu")]
+    ]))
+
+async def get_user_configs_management_keyboard(user_id: int, lang: str) -> InlineKeyboardMarkup:
+    configs = await db.get_configs_for_user(user_id)
 
     keyboard = []
-    for config_id, config_type, config_data in configs:
+    for config_id, _, config_type, config_data in configs:
         if config_type.startswith("file:"):
             display_text = f"{get_text('file_prefix', lang)}: {config_type.split(':', 1)[1]}"
         else:
@@ -120,43 +216,35 @@ def get_user_configs_management_keyboard(user_id: int, lang: str) -> InlineKeybo
             display_text = f"{config_type}: {short_data}"
         
         button_text = f"{get_text('delete_config_prefix', lang)} {display_text}"
-        keyboard.append([InlineKeyboardButton(text=button_text, callback_data=f"delete_config:{config_id}:{user_id}")])
+        keyboard.append([InlineKeyboardButton(text=button_text, callback_data=DeleteConfig(config_id=config_id, user_id=user_id).pack())])
     
-    keyboard.append([InlineKeyboardButton(text=get_text('add_config_btn', lang), callback_data=f"add_config_{user_id}")])
-    keyboard.append([InlineKeyboardButton(text=get_text('back_to_users_list_btn', lang), callback_data="admin_configs_page_0")])
+    keyboard.append([InlineKeyboardButton(text=get_text('add_config_btn', lang), callback_data=AddConfig(user_id=user_id).pack())])
+    keyboard.append([InlineKeyboardButton(text=get_text('back_to_users_list_btn', lang), callback_data=ConfigUsersPage().pack())])
     keyboard.append([InlineKeyboardButton(text=get_text('main_menu', lang), callback_data="admin_menu")])
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
 # --- УПРАВЛЕНИЕ ТУТОРИАЛАМИ ---
 
-def get_tutorials_admin_keyboard(lang: str) -> InlineKeyboardMarkup:
-    conn = sqlite3.connect('bot.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, title FROM tutorials")
-    tutorials = cursor.fetchall()
-    conn.close()
+async def get_tutorials_admin_keyboard(lang: str) -> InlineKeyboardMarkup:
+    tutorials = await db.list_tutorials()
 
     keyboard = []
-    for tutorial_id, title in tutorials:
-        keyboard.append([InlineKeyboardButton(text=f"{get_text('delete_tutorial_prefix', lang)} {title}", callback_data=f"delete_tutorial_{tutorial_id}")])
+    for tutorial_id, title, *_ in tutorials:
+        keyboard.append([InlineKeyboardButton(text=f"{get_text('delete_tutorial_prefix', lang)} {title}", callback_data=DeleteTutorial(tutorial_id=tutorial_id).pack())])
     
     keyboard.append([InlineKeyboardButton(text=get_text('add_tutorial_btn', lang), callback_data="add_tutorial")])
     keyboard.append([InlineKeyboardButton(text=get_text('back_to_menu', lang), callback_data="admin_menu")])
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
-def get_tutorials_user_keyboard(lang: str) -> InlineKeyboardMarkup:
-    conn = sqlite3.connect('bot.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, title FROM tutorials")
-    tutorials = cursor.fetchall()
-    conn.close()
+async def get_tutorials_user_keyboard(lang: str) -> InlineKeyboardMarkup:
+    tutorials = await db.list_tutorials()
 
     keyboard = []
     if not tutorials:
         keyboard.append([InlineKeyboardButton(text=get_text('no_tutorials_yet', lang), callback_data="no_op")])
     else:
-        for tutorial_id, title in tutorials:
-            keyboard.append([InlineKeyboardButton(text=f"📖 {title}", callback_data=f"view_tutorial_{tutorial_id}")])
+        for tutorial_id, title, *_ in tutorials:
+            keyboard.append([InlineKeyboardButton(text=f"📖 {title}", callback_data=ViewTutorial(tutorial_id=tutorial_id).pack())])
             
     # Добавляем кнопку "Назад", которая вернет пользователя в главное меню
     # Для этого нам нужна информация о его роли
@@ -169,13 +257,56 @@ def get_tutorials_user_keyboard(lang: str) -> InlineKeyboardMarkup:
 
 # --- РАССЫЛКА И ПРОЧЕЕ ---
 
-def get_confirm_send_keyboard(lang: str) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
+def get_confirm_send_keyboard(lang: str, versions: Tuple[str, ...] = ()) -> InlineKeyboardMarkup:
+    """versions - языки, для которых ещё можно добавить свой вариант сообщения."""
+    lang = _normalize_lang(lang)
+    return _cached_markup(('confirm_send', lang, versions), lambda: InlineKeyboardMarkup(inline_keyboard=[
+        *([InlineKeyboardButton(
+            text=get_text('mass_send_version_btn', lang).format(language=code.upper()),
+            callback_data=BroadcastVersion(lang=code).pack()
+        )] for code in versions),
         [InlineKeyboardButton(text=get_text('send_btn', lang), callback_data="send_confirmed")],
         [InlineKeyboardButton(text=get_text('cancel_btn', lang), callback_data="send_cancelled")]
+    ]))
+
+def get_broadcast_audience_keyboard(lang: str, language: str, status: str,
+                                    config_type: Optional[str], config_match: Optional[str]) -> InlineKeyboardMarkup:
+    """Выбор получателей рассылки: язык, статус доставки, тип и текст конфигов. Выбранное отмечено ✅."""
+    def option(text: str, selected: bool, field: str, value: str) -> InlineKeyboardButton:
+        return InlineKeyboardButton(text=f"✅ {text}" if selected else text,
+                                    callback_data=BroadcastAudience(field=field, value=value).pack())
+
+    def shorten(value: Optional[str]) -> str:
+        if not value:
+            return get_text('audience_any', lang)
+        return value[:20] + '...' if len(value) > 20 else value
+
+    languages = [option(get_text('audience_all_languages', lang), not language, 'language', '')]
+    languages += [option(code.upper(), code == language, 'language', code) for code in locales]
+    return InlineKeyboardMarkup(inline_keyboard=[
+        languages,
+        [option(get_text(f'audience_status_{value}', lang), value == status, 'status', value)
+         for value in AUDIENCE_STATUSES],
+        [InlineKeyboardButton(
+            text=get_text('audience_config_type_btn', lang).format(value=shorten(config_type)),
+            callback_data=BroadcastAudience(field='config_type').pack()
+        )],
+        [InlineKeyboardButton(
+            text=get_text('audience_config_match_btn', lang).format(value=shorten(config_match)),
+            callback_data=BroadcastAudience(field='config_match').pack()
+        )],
+        [InlineKeyboardButton(text=get_text('audience_continue_btn', lang), callback_data="mass_send_audience_done")],
+        [InlineKeyboardButton(text=get_text('back_to_menu', lang), callback_data="admin_menu")]
     ])
 
-def get_skip_media_keyboard(lang: str) -> InlineKeyboardMarkup:
+@lru_cache(maxsize=256)
+def get_broadcast_progress_keyboard(job_id: int, lang: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=get_text('skip_btn', lang), callback_data="skip_media")]
+        [InlineKeyboardButton(text=get_text('mass_send_stop_btn', lang), callback_data=StopBroadcast(job_id=job_id).pack())]
     ])
+
+def get_skip_media_keyboard(lang: str) -> InlineKeyboardMarkup:
+    lang = _normalize_lang(lang)
+    return _cached_markup(('skip_media', lang), lambda: InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=get_text('skip_btn', lang), callback_data="skip_media")]
+    ]))
@@ -20,6 +20,9 @@ locales = {
         'your_configs': "Your configurations:",
         'next_action': "Choose the next action:",
         'config_type': "Type",
+        'download_configs_btn': "📥 Download All as File",
+        'subscription_btn': "🔗 Subscription Link",
+        'subscription_link': "Add this link to your VPN client (v2rayN, Hiddify, v2rayNG...) as a subscription, and it will pick up new configurations by itself:\n\n<code>{url}</code>\n\nDo not share it: anyone with the link gets your configurations.",
         # Help/Tutorials
         'choose_tutorial': "Choose a tutorial you are interested in:",
         'no_tutorials_yet': "No tutorials yet",
@@ -28,6 +31,8 @@ locales = {
         'manage_configs_btn': "🔑 Configuration Management",
         'manage_tutorials_btn': "📚 Tutorial Management",
         'mass_send_btn': "📢 Mass Messaging",
+        'inactive_users_btn': "🚫 Inactive Users",
+        'stats_title': "📊 Bot performance since start:",
         # User Management
         'users_list': "👥 User List:",
         'prev_btn': "⬅️ Prev.",
@@ -41,6 +46,19 @@ locales = {
         'user_already_exists': "This user already exists in the database.",
         'user_added_ok': "✅ User successfully added!",
         'invalid_id_format': "❗️Invalid format. Please enter a numerical Telegram ID.",
+        'import_users_btn': "📥 Import Users",
+        'ask_for_import_file': "Send a TXT or CSV file with one user per line: Telegram ID, optionally followed by username and language (en/ru).\n\nTo cancel, press /start.",
+        'import_file_required': "❗️Please send the list as a document.",
+        'import_file_too_large': "❗️The file is too large. Bots can only download files up to 20 MB.",
+        'import_users_done': "✅ Import finished.\n\nAdded: {inserted}\nAlready existed or repeated: {duplicates}\nInvalid rows: {invalid}",
+        'search_users_btn': "🔍 Find User",
+        'search_users_prompt': "Send a Telegram ID, an @username (or its beginning) or a piece of a config, e.g. a hostname or UUID.\n\nTo cancel, press /start.",
+        'search_results': "🔍 Users matching \"{query}\":\n\nSend another query to search again.",
+        'search_no_results': "Nobody matches \"{query}\". Try another query.",
+        'search_expired': "This search has expired. Please search again.",
+        'inactive_users_title': "🚫 Users who no longer receive messages:\n\nBlocked the bot: {blocked}\nDeleted their account: {deactivated}\nNever started the bot: {unreachable}\n\nThey are skipped by mass messaging until they write to the bot again.",
+        'purge_inactive_btn': "🧹 Delete Inactive Users",
+        'inactive_users_purged': "Deleted inactive users: {count}",
         # Config Management
         'choose_user_for_config': "Choose a user to manage their configurations:",
         'user_configs_title': "User configurations:",
@@ -52,6 +70,32 @@ locales = {
         'add_config_step1': "Step 1/2: Enter the configuration type (e.g., VLESS, WireGuard, SS).\nIf this is a file, the type will be used as its description.",
         'add_config_step2': "Step 2/2: Now, send the configuration data (link, text, or **file**).",
         'config_added_ok': "✅ Configuration successfully added!",
+        'assign_config_btn': "📤 Assign Config to Users",
+        'assign_config_step1': "Step 1/3: Enter the configuration type (e.g., VLESS, WireGuard, SS).\nIf this is a file, the type will be used as its description.\n\nTo cancel, press /start.",
+        'assign_config_step2': "Step 2/3: Now, send the configuration data (link, text, or **file**).",
+        'assign_config_step3': "Step 3/3: Send the Telegram IDs of the users who should get this configuration, separated by spaces, commas or new lines, or press \"All Users\".",
+        'assign_all_users_btn': "👥 All Users",
+        'assign_config_no_ids': "Send only Telegram IDs, separated by spaces, commas or new lines.",
+        'assign_config_done': "✅ Configuration assigned.\n\nUsers who got it: {assigned}\nAlready had it or not found: {skipped}",
+        'assign_config_done_all': "✅ Configuration assigned to all users.\n\nUsers who got it: {assigned}",
+        'import_configs_btn': "📥 Import Configs",
+        'rotate_configs_btn': "🔁 Rotate Server",
+        'rotate_configs_prompt': "Send what to replace in everyone's configurations, one rule per line:\nold.example.com -> new.example.com\n\nStart a line with re: for a regular expression; \\1 in the replacement is its first group:\nre:@10\\.0\\.0\\.5:(\\d+) -> @10.0.1.7:\\1\n\nConfigurations sent as files are not changed. To cancel, press /start.",
+        'rotate_configs_invalid': "Line {line} is not a valid rule. Send the rules again.",
+        'rotate_configs_bad_replacement': "A replacement refers to a group its expression does not have. Send the rules again.",
+        'rotate_configs_nothing': "No configuration matches these rules. Send other rules or press /start to cancel.",
+        'rotate_configs_preview': "🔁 Dry run\n\nConfigurations to rewrite: {templates}\nUser configurations affected: {assignments}\nUsers affected: {users}\n\nRewrite them and notify the users?",
+        'rotate_configs_confirm_btn': "✅ Rewrite",
+        'rotate_configs_started': "⏳ Rewriting configurations...",
+        'rotate_configs_failed': "❌ Could not rewrite the configurations; nothing was changed. Try again later.",
+        'rotate_configs_done': "✅ Rewrote {templates} configurations of {users} users.\n\n⏳ Notifying users about the change...",
+        'configs_rotated_notice': "🔔 Your configurations were updated: {count}. Open \"My Configurations\" and import them into your app again.",
+        'ask_for_config_import_file': "Send a file with configurations:\n• CSV: telegram_id,config_type,config_data\n• JSONL: {\"telegram_id\": ..., \"config_type\": ..., \"config_data\": ...}\n• ZIP: one folder per Telegram ID with config files inside\n\nTo cancel, press /start.",
+        'import_configs_done': "✅ Import finished.\n\nAdded: {inserted}\nUsers who got new configs: {users}\nAlready present: {duplicates}\nUnknown users: {unknown}\nInvalid rows: {invalid}",
+        'notify_users_btn': "📣 Notify Users",
+        'config_notify_started': "⏳ Notifying users about their new configurations...",
+        'config_notify_finished': "✅ Users notified.\n\nSuccessfully sent: {success_count}\nFailed to deliver: {fail_count}",
+        'new_configs_notice': "🔔 You have new configurations: {count}. Open \"My Configurations\" to get them.",
         # Tutorial Management
         'tutorials_menu_title': "Tutorial management menu:",
         'delete_tutorial_prefix': "🗑️",
@@ -59,18 +103,37 @@ locales = {
         'tutorial_deleted_ok': "Tutorial deleted.",
         'add_tutorial_step1': "Step 1/3: Enter the tutorial title:",
         'add_tutorial_step2': "Step 2/3: Enter the main text of the tutorial:",
-        'add_tutorial_step3': "Step 3/3: Now attach a photo or video. If no media is required, press 'Skip'.",
+        'add_tutorial_step3': "Step 3/3: Now attach a photo, video, GIF or file, or send several of them as an album. If no media is required, press 'Skip'.",
         'skip_btn': "Skip Step ➡️",
         'tutorial_added_ok_no_media': "✅ Tutorial without media added successfully.",
         'tutorial_added_ok_with_media': "✅ Tutorial with media added successfully.",
         # Mass Messaging
-        'mass_send_ask_message': "Enter the message for mass sending to all users. It will be copied and sent.",
-        'mass_send_confirm_message': "This message will be sent to all users. Confirm sending:",
+        'mass_send_audience': "📢 Who should get the message?\n\nRecipients: {count}\n\nChoose a language and delivery status, or only users with a config type or a server in their configs.",
+        'audience_all_languages': "All languages",
+        'audience_status_active': "Active",
+        'audience_status_inactive': "Inactive",
+        'audience_status_all': "Everyone",
+        'audience_any': "any",
+        'audience_config_type_btn': "🧩 Config type: {value}",
+        'audience_config_match_btn': "🖥 Config text: {value}",
+        'audience_continue_btn': "➡️ Continue",
+        'audience_ask_config_type': "Send a config type, e.g. VLESS, or - to not filter by type.",
+        'audience_ask_config_match': "Send a piece of config text, e.g. a server hostname, or - to not filter by it.",
+        'mass_send_no_recipients': "Nobody matches this audience.",
+        'mass_send_ask_message': "Enter the message for mass sending. It will be copied and sent.",
+        'mass_send_confirm_segment': "Recipients: {count}\nLanguage versions: {versions}\n\nUsers get the version in their language if there is one, otherwise this message. Confirm sending:",
+        'mass_send_version_btn': "➕ {language} version",
+        'mass_send_ask_version': "Send the {language} version of the message.",
         'send_btn': "✅ Send",
         'cancel_btn': "❌ Cancel",
         'mass_send_cancelled': "Mass messaging cancelled.",
         'mass_send_started': "⏳ Starting mass messaging...",
         'mass_send_finished': "✅ Mass messaging finished!\n\nSuccessfully sent: {success_count}\nFailed to deliver: {fail_count}",
+        'mass_send_progress': "⏳ Mass messaging in progress: {done}/{total}\n\nSuccessfully sent: {success_count}\nFailed to deliver: {fail_count}",
+        'mass_send_stop_btn': "⏹ Stop",
+        'mass_send_stopping': "Stopping mass messaging...",
+        'mass_send_stopped': "⏹ Mass messaging stopped.\n\nSuccessfully sent: {success_count}\nFailed to deliver: {fail_count}",
+        'mass_send_not_running': "This mass messaging is no longer running.",
     },
     'ru': {
         # General
@@ -91,6 +154,9 @@ locales = {
         'your_configs': "Ваши конфигурации:",
         'next_action': "Выберите следующее действие:",
         'config_type': "Тип",
+        'download_configs_btn': "📥 Скачать все одним файлом",
+        'subscription_btn': "🔗 Ссылка-подписка",
+        'subscription_link': "Добавьте эту ссылку в VPN-клиент (v2rayN, Hiddify, v2rayNG...) как подписку, и он сам будет получать новые конфигурации:\n\n<code>{url}</code>\n\nНикому её не передавайте: по ссылке доступны ваши конфигурации.",
         # Help/Tutorials
         'choose_tutorial': "Выберите интересующий вас туториал:",
         'no_tutorials_yet': "Туториалов пока нет",
@@ -99,6 +165,8 @@ locales = {
         'manage_configs_btn': "🔑 Управление конфигурациями",
         'manage_tutorials_btn': "📚 Управление туториалами",
         'mass_send_btn': "📢 Сделать рассылку",
+        'inactive_users_btn': "🚫 Неактивные пользователи",
+        'stats_title': "📊 Производительность бота с момента запуска:",
         # User Management
         'users_list': "👥 Список пользователей:",
         'prev_btn': "⬅️ Пред.",
@@ -112,6 +180,19 @@ locales = {
         'user_already_exists': "Этот пользователь уже существует в базе.",
         'user_added_ok': "✅ Пользователь успешно добавлен!",
         'invalid_id_format': "❗️Неверный формат. Пожалуйста, введите числовой Telegram ID.",
+        'import_users_btn': "📥 Импорт пользователей",
+        'ask_for_import_file': "Отправьте TXT или CSV файл, по одному пользователю в строке: Telegram ID, а за ним при желании username и язык (en/ru).\n\nЧтобы отменить, нажмите /start.",
+        'import_file_required': "❗️Пожалуйста, отправьте список документом.",
+        'import_file_too_large': "❗️Файл слишком большой. Бот может скачивать файлы размером до 20 МБ.",
+        'import_users_done': "✅ Импорт завершён.\n\nДобавлено: {inserted}\nУже были или повторялись: {duplicates}\nНекорректных строк: {invalid}",
+        'search_users_btn': "🔍 Найти пользователя",
+        'search_users_prompt': "Отправьте Telegram ID, @username (или его начало) или часть конфига, например адрес сервера или UUID.\n\nЧтобы отменить, нажмите /start.",
+        'search_results': "🔍 Пользователи по запросу \"{query}\":\n\nОтправьте новый запрос, чтобы искать снова.",
+        'search_no_results': "По запросу \"{query}\" никого не найдено. Попробуйте другой запрос.",
+        'search_expired': "Этот поиск устарел. Выполните поиск заново.",
+        'inactive_users_title': "🚫 Пользователи, которым больше не доходят сообщения:\n\nЗаблокировали бота: {blocked}\nУдалили аккаунт: {deactivated}\nНе запускали бота: {unreachable}\n\nРассылка пропускает их, пока они снова не напишут боту.",
+        'purge_inactive_btn': "🧹 Удалить неактивных",
+        'inactive_users_purged': "Удалено неактивных пользователей: {count}",
         # Config Management
         'choose_user_for_config': "Выберите пользователя для управления его конфигурациями:",
         'user_configs_title': "Конфигурации пользователя:",
@@ -123,6 +204,32 @@ locales = {
         'add_config_step1': "Шаг 1/2: Введите тип конфигурации (например, VLESS, WireGuard, SS).\nЕсли это файл, тип будет использован как его описание.",
         'add_config_step2': "Шаг 2/2: Теперь отправьте данные конфигурации (ссылку, текст или **файл**).",
         'config_added_ok': "✅ Конфигурация успешно добавлена!",
+        'assign_config_btn': "📤 Выдать конфигурацию пользователям",
+        'assign_config_step1': "Шаг 1/3: Введите тип конфигурации (например, VLESS, WireGuard, SS).\nЕсли это файл, тип будет использован как его описание.\n\nЧтобы отменить, нажмите /start.",
+        'assign_config_step2': "Шаг 2/3: Теперь отправьте данные конфигурации (ссылку, текст или **файл**).",
+        'assign_config_step3': "Шаг 3/3: Отправьте Telegram ID пользователей, которым нужно выдать эту конфигурацию, через пробел, запятую или с новой строки, или нажмите \"Всем пользователям\".",
+        'assign_all_users_btn': "👥 Всем пользователям",
+        'assign_config_no_ids': "Отправьте только Telegram ID через пробел, запятую или с новой строки.",
+        'assign_config_done': "✅ Конфигурация выдана.\n\nПолучили её: {assigned}\nУже была или не найдены: {skipped}",
+        'assign_config_done_all': "✅ Конфигурация выдана всем пользователям.\n\nПолучили её: {assigned}",
+        'import_configs_btn': "📥 Импорт конфигураций",
+        'rotate_configs_btn': "🔁 Смена сервера",
+        'rotate_configs_prompt': "Отправьте, что заменить в конфигурациях всех пользователей, по одному правилу в строке:\nold.example.com -> new.example.com\n\nНачните строку с re:, чтобы задать регулярное выражение; \\1 в замене - его первая группа:\nre:@10\\.0\\.0\\.5:(\\d+) -> @10.0.1.7:\\1\n\nКонфигурации, отправленные файлами, не изменяются. Чтобы отменить, нажмите /start.",
+        'rotate_configs_invalid': "Строка {line} не является правилом. Отправьте правила ещё раз.",
+        'rotate_configs_bad_replacement': "Замена ссылается на группу, которой нет в выражении. Отправьте правила ещё раз.",
+        'rotate_configs_nothing': "Ни одна конфигурация не подходит под эти правила. Отправьте другие правила или нажмите /start для отмены.",
+        'rotate_configs_preview': "🔁 Пробный запуск\n\nКонфигураций будет изменено: {templates}\nЗатронуто конфигураций пользователей: {assignments}\nЗатронуто пользователей: {users}\n\nИзменить их и уведомить пользователей?",
+        'rotate_configs_confirm_btn': "✅ Изменить",
+        'rotate_configs_started': "⏳ Изменяю конфигурации...",
+        'rotate_configs_failed': "❌ Не удалось изменить конфигурации, ничего не изменено. Попробуйте позже.",
+        'rotate_configs_done': "✅ Изменено конфигураций: {templates}, пользователей: {users}.\n\n⏳ Уведомляю пользователей об изменении...",
+        'configs_rotated_notice': "🔔 Ваши конфигурации обновлены: {count}. Откройте \"Мои конфигурации\" и заново импортируйте их в приложение.",
+        'ask_for_config_import_file': "Отправьте файл с конфигурациями:\n• CSV: telegram_id,config_type,config_data\n• JSONL: {\"telegram_id\": ..., \"config_type\": ..., \"config_data\": ...}\n• ZIP: по папке на каждый Telegram ID с файлами конфигураций внутри\n\nЧтобы отменить, нажмите /start.",
+        'import_configs_done': "✅ Импорт завершён.\n\nДобавлено: {inserted}\nПользователей с новыми конфигурациями: {users}\nУже были: {duplicates}\nНеизвестные пользователи: {unknown}\nНекорректных строк: {invalid}",
+        'notify_users_btn': "📣 Уведомить пользователей",
+        'config_notify_started': "⏳ Уведомляем пользователей о новых конфигурациях...",
+        'config_notify_finished': "✅ Пользователи уведомлены.\n\nУспешно отправлено: {success_count}\nНе удалось доставить: {fail_count}",
+        'new_configs_notice': "🔔 У вас новые конфигурации: {count}. Откройте «Мои конфигурации», чтобы получить их.",
         # Tutorial Management
         'tutorials_menu_title': "Меню управления туториалами:",
         'delete_tutorial_prefix': "🗑️",
@@ -130,18 +237,37 @@ locales = {
         'tutorial_deleted_ok': "Туториал удален.",
         'add_tutorial_step1': "Шаг 1/3: Введите заголовок туториала:",
         'add_tutorial_step2': "Шаг 2/3: Введите основной текст туториала:",
-        'add_tutorial_step3': "Шаг 3/3: Теперь прикрепите фото или видео. Если медиа не требуется, нажмите 'Пропустить'.",
+        'add_tutorial_step3': "Шаг 3/3: Теперь прикрепите фото, видео, GIF или файл либо отправьте несколько из них альбомом. Если медиа не требуется, нажмите 'Пропустить'.",
         'skip_btn': "Пропустить шаг ➡️",
         'tutorial_added_ok_no_media': "✅ Туториал без медиа успешно добавлен.",
         'tutorial_added_ok_with_media': "✅ Туториал с медиа успешно добавлен.",
         # Mass Messaging
-        'mass_send_ask_message': "Введите сообщение для рассылки всем пользователям. Оно будет скопировано и отправлено.",
-        'mass_send_confirm_message': "Это сообщение будет отправлено всем пользователям. Подтвердите рассылку:",
+        'mass_send_audience': "📢 Кому отправить сообщение?\n\nПолучателей: {count}\n\nВыберите язык и статус доставки или только пользователей с определённым типом конфигурации или сервером в конфигурациях.",
+        'audience_all_languages': "Все языки",
+        'audience_status_active': "Активные",
+        'audience_status_inactive': "Неактивные",
+        'audience_status_all': "Все",
+        'audience_any': "любой",
+        'audience_config_type_btn': "🧩 Тип конфигурации: {value}",
+        'audience_config_match_btn': "🖥 Текст конфигурации: {value}",
+        'audience_continue_btn': "➡️ Продолжить",
+        'audience_ask_config_type': "Отправьте тип конфигурации, например VLESS, или -, чтобы не фильтровать по типу.",
+        'audience_ask_config_match': "Отправьте часть текста конфигурации, например адрес сервера, или -, чтобы не фильтровать по нему.",
+        'mass_send_no_recipients': "Под эти условия не подходит ни один пользователь.",
+        'mass_send_ask_message': "Введите сообщение для рассылки. Оно будет скопировано и отправлено.",
+        'mass_send_confirm_segment': "Получателей: {count}\nВерсии на других языках: {versions}\n\nПользователи получат версию на своём языке, если она есть, иначе это сообщение. Подтвердите рассылку:",
+        'mass_send_version_btn': "➕ Версия на {language}",
+        'mass_send_ask_version': "Отправьте версию сообщения на языке {language}.",
         'send_btn': "✅ Отправить",
         'cancel_btn': "❌ Отмена",
         'mass_send_cancelled': "Рассылка отменена.",
         'mass_send_started': "⏳ Начинаю рассылку...",
         'mass_send_finished': "✅ Рассылка завершена!\n\nУспешно отправлено: {success_count}\nНе удалось доставить: {fail_count}",
+        'mass_send_progress': "⏳ Идёт рассылка: {done}/{total}\n\nУспешно отправлено: {success_count}\nНе удалось доставить: {fail_count}",
+        'mass_send_stop_btn': "⏹ Остановить",
+        'mass_send_stopping': "Останавливаю рассылку...",
+        'mass_send_stopped': "⏹ Рассылка остановлена.\n\nУспешно отправлено: {success_count}\nНе удалось доставить: {fail_count}",
+        'mass_send_not_running': "Эта рассылка уже не выполняется.",
     }
 }
 
@@ -1,73 +1,97 @@
 # main.py
 
 import asyncio
+import hashlib
 import logging
-import sqlite3
+import os
+import socket
+from typing import List, Optional
 
 from aiogram import Bot, Dispatcher, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters.command import Command
+from aiogram.fsm.context import FSMContext
 
 # --- Import local modules ---
-from keyboards import get_main_keyboard_by_role
+from broadcast import RATE_LIMIT, TokenBucket, broadcast_engine, resume_broadcast_jobs
+from database import User, db
+from fsm_storage import SQLiteStorage
+from keyboards import build_markup_cache, get_main_keyboard_by_role
 from handlers import admin_handlers, user_handlers, settings_handlers # Import new settings handler
 from localization import get_text
+from middlewares import UserProfileMiddleware, profile_cache
+from metrics import HandlerMetricsMiddleware, TelegramMetricsMiddleware, observe_db_query, setup_metrics
+from migrations import migrate
+from panel_sync import PanelSyncer, load_panels
+from scheduler import UpdateScheduler
+from sharding import Ingress, serve_worker, shard_of, start_workers, stop_workers
+import subscription
+from web import create_web_app, setup_webhook, setup_webhook_forwarding, start_web_app
 
 # --- Settings ---
-BOT_TOKEN = "YOUR_BOT_TOKEN" 
-ADMIN_IDS = [YOUR_TELEGRAM_ID] 
+# Every setting can be passed through the environment instead of editing this file
+BOT_TOKEN = os.getenv("BOT_TOKEN", "YOUR_BOT_TOKEN")
+ADMIN_IDS = [int(admin_id) for admin_id in os.getenv("ADMIN_IDS", "").split(",") if admin_id.strip()] # e.g. "12345,67890"
+
+# Runtime mode: "polling" (default) or "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "") # Public HTTPS URL of the reverse proxy, e.g. https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Derived from the token by default so every worker behind the proxy agrees on it
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hashlib.sha256(BOT_TOKEN.encode()).hexdigest()[:32]
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.getenv("WEB_PORT", "8080"))
+# Custom Bot API server, e.g. a local fake one for testing
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+# Worker processes handling updates, sharded by user ID; 1 keeps everything in one process
+WORKERS = int(os.getenv("WORKERS", "1"))
+# Updates handled at once per process, and taken in before polling pauses (webhook updates beyond it are dropped)
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "32"))
+MAX_PENDING_UPDATES = int(os.getenv("MAX_PENDING_UPDATES", "1000"))
+
+# 3x-ui panels to pull configs from; sync is off when the file does not exist
+PANELS_FILE = os.getenv("PANELS_FILE", "panels.json")
+PANEL_SYNC_INTERVAL = int(os.getenv("PANEL_SYNC_INTERVAL", "300"))  # seconds
+
+# Public base URL of the subscription endpoint, e.g. https://sub.example.com; empty keeps it off.
+# It is served by the same HTTP server as the webhook, on WEB_HOST:WEB_PORT.
+SUBSCRIPTION_BASE_URL = os.getenv("SUBSCRIPTION_BASE_URL", "")
+SUBSCRIPTION_SECRET = os.getenv("SUBSCRIPTION_SECRET") or hashlib.sha256(f"subscription:{BOT_TOKEN}".encode()).hexdigest()
+
+# Prometheus text endpoint on the web app; METRICS_TOKEN, if set, is required as a bearer token
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0") == "1"
+METRICS_PATH = os.getenv("METRICS_PATH", "/metrics")
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
 
 # --- Initialization ---
-bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher()
+session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+bot = Bot(token=BOT_TOKEN, session=session)
+bot.session.middleware(TelegramMetricsMiddleware())
+db.query_hook = observe_db_query
+# FSM state lives in bot.db, so admin flows survive restarts
+dp = Dispatcher(storage=SQLiteStorage(db), disable_fsm=True)
+# The scheduler orders each user's updates, so it goes before the FSM middleware reads the state
+update_scheduler = UpdateScheduler(MAX_CONCURRENT_UPDATES, MAX_PENDING_UPDATES)
+dp.update.outer_middleware(update_scheduler)
+dp.update.outer_middleware(dp.fsm)
+# Metrics next, so the timing covers the profile lookup too
+dp.update.outer_middleware(HandlerMetricsMiddleware())
+dp.update.outer_middleware(UserProfileMiddleware())
+subscription.configure(SUBSCRIPTION_BASE_URL, SUBSCRIPTION_SECRET)
 
 # --- Database Initialization ---
-def init_db():
-    """Initializes the database and tables."""
-    conn = sqlite3.connect('bot.db')
-    cursor = conn.cursor()
-    
-    # Enable foreign key support
-    cursor.execute("PRAGMA foreign_keys = ON")
-    
-    # Create users table with a new language_code column
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        telegram_id INTEGER PRIMARY KEY,
-        username TEXT,
-        is_admin INTEGER DEFAULT 0,
-        language_code TEXT DEFAULT 'en'
-    )''')
-    
-    # Create configs table with ON DELETE CASCADE
-    # This automatically deletes a user's configs when the user is deleted
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS configs (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER,
-        config_type TEXT,
-        config_data TEXT,
-        FOREIGN KEY (user_id) REFERENCES users (telegram_id) ON DELETE CASCADE
-    )''')
-
-    # Create tutorials table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS tutorials (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        title TEXT,
-        content_text TEXT,
-        file_id TEXT
-    )''')
+async def init_db():
+    """Applies pending schema migrations and registers the admins."""
+    await migrate(db)
 
     # Add/update admins from the ADMIN_IDS list
-    for admin_id in ADMIN_IDS:
-        cursor.execute(
-            "INSERT INTO users (telegram_id, is_admin, language_code) VALUES (?, 1, 'en') "
-            "ON CONFLICT(telegram_id) DO UPDATE SET is_admin = 1",
-            (admin_id,)
-        )
-
-    conn.commit()
-    conn.close()
+    await db.write(lambda conn: conn.executemany(
+        "INSERT INTO users (telegram_id, is_admin, language_code) VALUES (?, 1, 'en') "
+        "ON CONFLICT(telegram_id) DO UPDATE SET is_admin = 1",
+        [(admin_id,) for admin_id in ADMIN_IDS]
+    ))
+    profile_cache.clear()
 
 # --- Register Routers ---
 dp.include_router(admin_handlers.router)
@@ -75,37 +99,29 @@ dp.include_router(user_handlers.router)
 dp.include_router(settings_handlers.router) # Register the new settings router
 
 # --- /start Command Handler ---
+# The dispatcher's own handlers run before the included routers, so /start
+# wins over the state handlers and cancels any unfinished flow
 @dp.message(Command("start"))
-async def send_welcome(message: types.Message):
+async def send_welcome(message: types.Message, state: FSMContext, profile: Optional[User]):
     """
     Handles the /start command.
-    Greets the user, adds them to the DB if they are new,
-    and shows the appropriate menu in their selected language.
+    Cancels any unfinished flow, greets the user, adds them to the DB if they
+    are new, and shows the appropriate menu in their selected language.
     """
+    await state.clear()
     user_id = message.from_user.id
     username = message.from_user.username
     
-    conn = sqlite3.connect('bot.db')
-    cursor = conn.cursor()
-    
-    # Check if user exists
-    cursor.execute("SELECT is_admin, language_code FROM users WHERE telegram_id = ?", (user_id,))
-    result = cursor.fetchone()
-    
-    if result:
+    # The profile is resolved by UserProfileMiddleware; None means a new user
+    if profile:
         # User exists, get their role and language
-        is_admin, lang = result
+        is_admin, lang = profile.is_admin, profile.language_code
     else:
         # New user, add to DB with default language 'en'
-        is_admin = 1 if user_id in ADMIN_IDS else 0
+        is_admin = user_id in ADMIN_IDS
         lang = 'en'
-        cursor.execute(
-            "INSERT INTO users (telegram_id, username, is_admin, language_code) VALUES (?, ?, ?, ?)",
-            (user_id, username, is_admin, lang)
-        )
-        conn.commit()
-        
-    conn.close()
+        await db.add_user(user_id, username, is_admin, lang)
+        profile_cache.invalidate(user_id)
 
     # Determine the welcome text based on role and language
     welcome_text_key = 'welcome_admin' if is_admin else 'welcome'
@@ -118,11 +134,91 @@ async def send_welcome(message: types.Message):
     )
 
 # --- Entry Point ---
-async def main():
-    """Main function to start the bot."""
+async def main(worker_socks: Optional[List[socket.socket]] = None):
+    """
+    Main function to start the bot. With worker_socks this process is only the
+    ingress: it receives updates, serves HTTP and syncs panels, while the
+    updates themselves are handled by the worker processes.
+    """
+    await db.connect()
+    if worker_socks is None:
+        await init_db() # Initialize the database on startup
+        build_markup_cache()
+        await resume_broadcast_jobs(bot)
+    ingress = Ingress(worker_socks) if worker_socks else None
+    panels = load_panels(PANELS_FILE)
+    syncer = PanelSyncer(panels)
+    sync_task = None
+    runner = None
+    try:
+        if ingress is not None:
+            await ingress.start()
+        sync_task = asyncio.create_task(syncer.run(PANEL_SYNC_INTERVAL)) if panels else None
+        if BOT_MODE == "webhook" or subscription.is_enabled() or METRICS_ENABLED:
+            app = create_web_app()
+            if BOT_MODE == "webhook" and ingress is not None:
+                setup_webhook_forwarding(app, bot, WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET,
+                                         dp.resolve_used_update_types(), ingress.forward)
+            elif BOT_MODE == "webhook":
+                setup_webhook(app, dp, bot, WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET)
+            if subscription.is_enabled():
+                subscription.setup_subscription(app)
+            if METRICS_ENABLED:
+                setup_metrics(app, METRICS_PATH, METRICS_TOKEN)
+            runner = await start_web_app(app, WEB_HOST, WEB_PORT)
+        if ingress is not None:
+            await ingress.run(bot, None if BOT_MODE == "webhook" else dp.resolve_used_update_types())
+        elif BOT_MODE == "webhook":
+            await asyncio.Event().wait()
+        else:
+            await dp.start_polling(bot, tasks_concurrency_limit=MAX_PENDING_UPDATES)
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+        if sync_task is not None:
+            sync_task.cancel()
+        if ingress is not None:
+            await ingress.close()
+        await syncer.close()
+        await db.close()
+
+async def prepare():
+    """Migrates bot.db once, before any worker process opens it."""
+    await db.connect()
+    try:
+        await init_db()
+    finally:
+        await db.close()
+
+async def worker_main(index: int, sock: socket.socket):
+    """Runs the handlers for shard `index` until the ingress goes away."""
+    await db.connect()
+    # Every worker sends its own broadcasts, so they split the bot's rate limit
+    broadcast_engine.bucket = TokenBucket(RATE_LIMIT / WORKERS)
+    try:
+        build_markup_cache()
+        await resume_broadcast_jobs(bot, owns=lambda admin_id: shard_of(admin_id, WORKERS) == index)
+        await serve_worker(dp, bot, sock, MAX_PENDING_UPDATES)
+    finally:
+        await dp.storage.close()
+        await bot.session.close()
+        await db.close()
+
+def run_worker(index: int, sock: socket.socket):
+    asyncio.run(worker_main(index, sock))
+
+def run():
     logging.basicConfig(level=logging.INFO)
-    init_db() # Initialize the database on startup
-    await dp.start_polling(bot)
+    if WORKERS <= 1:
+        asyncio.run(main())
+        return
+    asyncio.run(prepare())
+    # Forked before any event loop or DB thread exists in this process
+    workers = start_workers(WORKERS, run_worker)
+    try:
+        asyncio.run(main([sock for _, sock in workers]))
+    finally:
+        stop_workers(workers)
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    run()
@@ -0,0 +1,262 @@
+# metrics.py
+
+import bisect
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.types import TelegramObject, Update
+from aiohttp import web
+
+# Upper bounds in seconds, Prometheus style
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Routes come from user-controlled callback data, so their number is capped
+MAX_ROUTES = 256
+OTHER_ROUTE = "other"
+
+# --- Metric Types ---
+
+class Histogram:
+    """Cumulative-bucket latency histogram per label tuple."""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...], buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [bucket counts..., +Inf count, sum]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, label_values: Tuple[str, ...], value: float) -> None:
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def summary(self, label_values: Tuple[str, ...]) -> Tuple[int, float, float]:
+        """Returns (count, average, approximate p95) of one series."""
+        series = self._series[label_values]
+        count = sum(series[:-1])
+        if not count:
+            return 0, 0.0, 0.0
+        target, seen = count * 0.95, 0
+        p95 = float("inf")
+        for bound, bucket_count in zip(self.buckets, series):
+            seen += bucket_count
+            if seen >= target:
+                p95 = bound
+                break
+        return count, series[-1] / count, p95
+
+    def series(self) -> List[Tuple[str, ...]]:
+        return list(self._series)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, series in self._series.items():
+            labels = _format_labels(self.labels, label_values)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, series):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="{bound}"}} {cumulative}')
+            cumulative += series[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="+Inf"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {series[-1]}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values: Dict[Tuple[str, ...], int] = {}
+
+    def inc(self, label_values: Tuple[str, ...], amount: int = 1) -> None:
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def items(self) -> List[Tuple[Tuple[str, ...], int]]:
+        return list(self._values.items())
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_values, value in self._values.items():
+            lines.append(f"{self.name}_total{{{_format_labels(self.labels, label_values)}}} {value}")
+        return lines
+
+class Gauge:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self.value = 0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge", f"{self.name} {self.value}"]
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    return ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values))
+
+# --- Registry ---
+
+handler_latency = Histogram("connex_handler_seconds", "Update handling time by route.", ("route",))
+handler_errors = Counter("connex_handler_errors", "Updates whose handling raised.", ("route",))
+db_latency = Histogram("connex_db_query_seconds", "Database call time, queueing included.", ("kind", "query"))
+api_latency = Histogram("connex_telegram_api_seconds", "Telegram Bot API request time.", ("method",))
+api_errors = Counter("connex_telegram_api_errors", "Telegram Bot API errors by type.", ("method", "error"))
+api_retry_after = Counter("connex_telegram_retry_after", "RetryAfter (flood control) responses.", ("method",))
+scheduler_wait = Histogram("connex_scheduler_wait_seconds", "Time updates waited for their turn.", ())
+scheduler_shed = Counter("connex_scheduler_shed", "Updates dropped because the queue was full.", ())
+scheduler_pending = Gauge("connex_scheduler_pending", "Updates admitted and not finished.")
+scheduler_running = Gauge("connex_scheduler_running", "Updates being handled.")
+scheduler_users = Gauge("connex_scheduler_users", "Users with updates queued or running.")
+
+REGISTRY = (
+    handler_latency, handler_errors, db_latency, api_latency, api_errors, api_retry_after,
+    scheduler_wait, scheduler_shed, scheduler_pending, scheduler_running, scheduler_users
+)
+
+def render_prometheus() -> str:
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# --- Handler Latency ---
+
+_ID_SUFFIX = re.compile(r"_[ab]?-?\d+$")
+_routes: Dict[str, str] = {}
+
+def _bounded(route: str) -> str:
+    known = _routes.get(route)
+    if known is None:
+        known = _routes[route] = route if len(_routes) < MAX_ROUTES else OTHER_ROUTE
+    return known
+
+def route_of(event: Update, raw_state: Optional[str]) -> str:
+    """Names an update by callback prefix, command, FSM state or content type."""
+    if event.callback_query is not None:
+        data = (event.callback_query.data or "").split(":", 1)[0]
+        return _bounded("callback:" + _ID_SUFFIX.sub("", data))
+    if event.message is not None:
+        text = event.message.text or ""
+        if text.startswith("/"):
+            return _bounded("command:" + text.split(maxsplit=1)[0].split("@", 1)[0])
+        if raw_state:
+            return _bounded("state:" + raw_state)
+        return _bounded("message:" + event.message.content_type)
+    return _bounded(event.event_type)
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Times every update end to end, keyed by route. Register it as an update outer middleware."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        route = route_of(event, data.get("raw_state"))
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc((route,))
+            raise
+        finally:
+            handler_latency.observe((route,), time.perf_counter() - start)
+
+# --- Database ---
+
+_query_names: Dict[Any, str] = {}
+
+def observe_db_query(kind: str, fn: Callable, seconds: float) -> None:
+    """Database.query_hook: names the query after the Database method that issued it."""
+    code = getattr(fn, "__code__", fn)
+    name = _query_names.get(code)
+    if name is None:
+        qualname = getattr(fn, "__qualname__", type(fn).__name__)
+        name = _query_names[code] = qualname.split(".<locals>", 1)[0].rsplit(".", 1)[-1]
+    db_latency.observe((kind, name), seconds)
+
+# --- Telegram API ---
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    """Bot session middleware recording API latency, errors and RetryAfter responses."""
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot,
+                       method: TelegramMethod) -> Response:
+        name = type(method).__name__
+        start = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter:
+            api_retry_after.inc((name,))
+            raise
+        except TelegramAPIError as e:
+            api_errors.inc((name, type(e).__name__))
+            raise
+        finally:
+            api_latency.observe((name,), time.perf_counter() - start)
+
+# --- Reports ---
+
+def format_stats(limit: int = 10) -> str:
+    """Plain-text summary for the /stats command: routes, queries and API methods taking the most time."""
+    sections = [
+        ("Handlers", handler_latency),
+        ("DB queries", db_latency),
+        ("Telegram API", api_latency),
+    ]
+    lines = []
+    for title, histogram in sections:
+        rows = sorted(
+            ((":".join(labels), *histogram.summary(labels)) for labels in histogram.series()),
+            key=lambda row: row[2] * row[1], reverse=True
+        )[:limit]
+        lines.append(f"{title} (count, avg ms, p95 ms):")
+        for name, count, average, p95 in rows:
+            p95_text = ">10000" if p95 == float("inf") else f"{p95 * 1000:g}"
+            lines.append(f"  {name[:40]:<40} {count:>7} {average * 1000:>8.1f} {p95_text:>7}")
+        if not rows:
+            lines.append("  -")
+        lines.append("")
+
+    errors = sorted(api_errors.items(), key=lambda item: item[1], reverse=True)[:limit]
+    lines.append("Telegram API errors:")
+    lines.extend(f"  {method} {error}: {count}" for (method, error), count in errors)
+    retry_after = sum(count for _, count in api_retry_after.items())
+    lines.append(f"  RetryAfter: {retry_after}")
+    handler_failures = sum(count for _, count in handler_errors.items())
+    lines.append(f"Handler errors: {handler_failures}")
+
+    lines.append("")
+    lines.append("Update queue:")
+    lines.append(f"  pending {scheduler_pending.value}, running {scheduler_running.value}, users {scheduler_users.value}")
+    if scheduler_wait.series():
+        count, average, p95 = scheduler_wait.summary(())
+        p95_text = ">10000" if p95 == float("inf") else f"{p95 * 1000:g}"
+        lines.append(f"  waited: avg {average * 1000:.1f} ms, p95 {p95_text} ms")
+    lines.append(f"  shed: {sum(count for _, count in scheduler_shed.items())}")
+    return "\n".join(lines)
+
+# --- Endpoint ---
+
+def setup_metrics(app: web.Application, path: str, token: str = "") -> None:
+    """Serves the Prometheus text format on `path`, behind a bearer token if one is set."""
+    async def handle_metrics(request: web.Request) -> web.Response:
+        if token and request.headers.get("Authorization") != f"Bearer {token}":
+            raise web.HTTPUnauthorized()
+        return web.Response(text=render_prometheus(), content_type="text/plain", charset="utf-8")
+
+    app.router.add_get(path, handle_metrics)
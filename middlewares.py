@@ -0,0 +1,112 @@
+# middlewares.py
+
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from database import User, db
+
+PROFILE_CACHE_SIZE = 10_000
+PROFILE_CACHE_TTL = 300  # seconds
+
+# --- Profile Cache ---
+
+class ProfileCache:
+    """
+    Bounded LRU cache of user profiles with a TTL.
+
+    A cached None means "not in the database", so unknown users do not hit
+    the DB on every update either. Handlers that change a profile must call
+    put() or invalidate() so the next update sees the new value.
+    """
+
+    def __init__(self, maxsize: int = PROFILE_CACHE_SIZE, ttl: float = PROFILE_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, Tuple[float, Optional[User]]]" = OrderedDict()
+        # Called with the changed user IDs (None for all) by put/invalidate/clear,
+        # e.g. to tell the other worker processes to drop their copies
+        self.invalidate_hook: Optional[Callable[[Optional[Iterable[int]]], None]] = None
+
+    def get(self, user_id: int) -> Tuple[bool, Optional[User]]:
+        """Returns (hit, profile)."""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return False, None
+        expires_at, profile = entry
+        if expires_at < time.monotonic():
+            del self._entries[user_id]
+            return False, None
+        self._entries.move_to_end(user_id)
+        return True, profile
+
+    def set(self, user_id: int, profile: Optional[User]) -> None:
+        self._entries[user_id] = (time.monotonic() + self.ttl, profile)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def put(self, profile: User) -> None:
+        self.set(profile.telegram_id, profile)
+        if self.invalidate_hook is not None:
+            self.invalidate_hook((profile.telegram_id,))
+
+    def invalidate(self, user_id: int) -> None:
+        self._entries.pop(user_id, None)
+        if self.invalidate_hook is not None:
+            self.invalidate_hook((user_id,))
+
+    def clear(self) -> None:
+        self._entries.clear()
+        if self.invalidate_hook is not None:
+            self.invalidate_hook(None)
+
+    def discard(self, user_ids: Optional[Iterable[int]]) -> None:
+        """Drops entries (all for None) without calling the hook."""
+        if user_ids is None:
+            self._entries.clear()
+            return
+        for user_id in user_ids:
+            self._entries.pop(user_id, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+profile_cache = ProfileCache()
+
+async def get_profile(user_id: int) -> Optional[User]:
+    """Returns the user's profile, from the cache when possible."""
+    hit, profile = profile_cache.get(user_id)
+    if not hit:
+        profile = await db.get_user(user_id)
+        profile_cache.set(user_id, profile)
+    return profile
+
+# --- Middleware ---
+
+class UserProfileMiddleware(BaseMiddleware):
+    """
+    Resolves the sender's profile once per update and injects
+    `profile`, `lang` and `is_admin` into handler kwargs.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get('event_from_user')
+        profile = await get_profile(user.id) if user else None
+        if profile and profile.delivery_status != 'active':
+            # The user is talking to the bot again, so they can be reached
+            await db.set_delivery_status([(user.id, 'active')])
+            profile = profile._replace(delivery_status='active')
+            profile_cache.put(profile)
+        data['profile'] = profile
+        data['lang'] = profile.language_code if profile else 'en'
+        data['is_admin'] = profile.is_admin if profile else False
+        return await handler(event, data)
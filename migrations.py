@@ -0,0 +1,320 @@
+# migrations.py
+
+import logging
+import time
+from typing import Callable, List, NamedTuple
+
+from database import Database
+from tutorial_media import media_type_from_file_id
+
+logger = logging.getLogger(__name__)
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: Callable
+
+# --- Migration Steps ---
+# Each step runs in its own transaction on the writer connection and must be
+# idempotent, so a database created by an older release can be upgraded in place.
+
+def _initial_schema(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        telegram_id INTEGER PRIMARY KEY,
+        username TEXT,
+        is_admin INTEGER DEFAULT 0,
+        language_code TEXT DEFAULT 'en'
+    )''')
+
+    # ON DELETE CASCADE removes a user's configs when the user is deleted
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS configs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        config_type TEXT,
+        config_data TEXT,
+        FOREIGN KEY (user_id) REFERENCES users (telegram_id) ON DELETE CASCADE
+    )''')
+
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS tutorials (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT,
+        content_text TEXT,
+        file_id TEXT
+    )''')
+
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_configs_user_id ON configs (user_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_is_admin ON users (is_admin)")
+    # Paging and broadcasts only ever walk non-admin users in telegram_id order
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_non_admin ON users (telegram_id) WHERE is_admin = 0")
+
+def _broadcast_jobs(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS broadcast_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        admin_id INTEGER,
+        lang TEXT,
+        from_chat_id INTEGER,
+        message_id INTEGER,
+        status_chat_id INTEGER,
+        status_message_id INTEGER,
+        status TEXT DEFAULT 'running',
+        total INTEGER DEFAULT 0,
+        created_at INTEGER,
+        finished_at INTEGER
+    )''')
+
+    # One row per recipient; the primary key doubles as the resume cursor
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS broadcast_recipients (
+        job_id INTEGER,
+        user_id INTEGER,
+        status TEXT DEFAULT 'pending',
+        PRIMARY KEY (job_id, user_id),
+        FOREIGN KEY (job_id) REFERENCES broadcast_jobs (id) ON DELETE CASCADE
+    ) WITHOUT ROWID''')
+
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_status ON broadcast_jobs (status)")
+    # Lets a resumed job jump straight to the recipients still waiting
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_broadcast_recipients_pending "
+        "ON broadcast_recipients (job_id, user_id) WHERE status = 'pending'"
+    )
+
+def _add_column(conn, table: str, column: str, declaration: str) -> None:
+    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+def _delivery_status(conn):
+    # active / blocked / deactivated / unreachable
+    _add_column(conn, "users", "delivery_status", "TEXT DEFAULT 'active'")
+    _add_column(conn, "users", "last_error_at", "INTEGER")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_active_recipients "
+        "ON users (telegram_id) WHERE is_admin = 0 AND delivery_status = 'active'"
+    )
+
+def _tutorial_media_type(conn):
+    _add_column(conn, "tutorials", "media_type", "TEXT")
+    # The media type is encoded in the file_id itself, so existing rows can be
+    # backfilled offline. Rows that fail to decode keep NULL and are detected on first view.
+    rows = conn.execute(
+        "SELECT id, file_id FROM tutorials WHERE media_type IS NULL AND file_id IS NOT NULL AND file_id != ''"
+    ).fetchall()
+    conn.executemany(
+        "UPDATE tutorials SET media_type = ? WHERE id = ?",
+        [(media_type, tutorial_id) for tutorial_id, file_id in rows
+         if (media_type := media_type_from_file_id(file_id))]
+    )
+
+def _fsm_state(conn):
+    # key is the serialized aiogram StorageKey; data is a JSON object
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS fsm_state (
+        key TEXT PRIMARY KEY,
+        state TEXT,
+        data TEXT,
+        updated_at INTEGER NOT NULL
+    ) WITHOUT ROWID''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_fsm_state_updated_at ON fsm_state (updated_at)")
+
+def _panel_sync(conn):
+    # Configs pulled from a 3x-ui panel: source is the panel name, external_key
+    # identifies the client there. Manually added configs keep both NULL.
+    _add_column(conn, "configs", "source", "TEXT")
+    _add_column(conn, "configs", "external_key", "TEXT")
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_configs_source_key "
+        "ON configs (source, external_key) WHERE source IS NOT NULL"
+    )
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS panel_sync_state (
+        panel TEXT PRIMARY KEY,
+        fingerprint TEXT,
+        client_count INTEGER DEFAULT 0,
+        synced_at INTEGER,
+        last_error TEXT
+    )''')
+
+def _user_search(conn):
+    # Usernames are compared lower-cased and without "@", however they were stored
+    columns = {row[1] for row in conn.execute("PRAGMA table_xinfo(users)")}
+    if "username_norm" not in columns:
+        conn.execute(
+            "ALTER TABLE users ADD COLUMN username_norm TEXT "
+            "GENERATED ALWAYS AS (lower(ltrim(username, '@'))) VIRTUAL"
+        )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_username_norm ON users (username_norm)")
+
+    # External-content FTS5 index over the config text: only the tokens are
+    # stored, the triggers keep it in step with every write to configs
+    conn.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS configs_fts USING fts5("
+        "config_data, content='configs', content_rowid='id')"
+    )
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS configs_fts_insert AFTER INSERT ON configs BEGIN
+        INSERT INTO configs_fts (rowid, config_data) VALUES (new.id, new.config_data);
+    END''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS configs_fts_delete AFTER DELETE ON configs BEGIN
+        INSERT INTO configs_fts (configs_fts, rowid, config_data) VALUES ('delete', old.id, old.config_data);
+    END''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS configs_fts_update AFTER UPDATE OF config_data ON configs BEGIN
+        INSERT INTO configs_fts (configs_fts, rowid, config_data) VALUES ('delete', old.id, old.config_data);
+        INSERT INTO configs_fts (rowid, config_data) VALUES (new.id, new.config_data);
+    END''')
+    conn.execute("INSERT INTO configs_fts (configs_fts) VALUES ('rebuild')")
+
+def _config_templates(conn):
+    # One row per distinct config, addressed by config_hash(config_type, config_data)
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS config_templates (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        hash BLOB NOT NULL UNIQUE,
+        config_type TEXT,
+        config_data TEXT
+    )''')
+
+    # Which user has which config. The id is what DeleteConfig buttons carry;
+    # source/external_key keep their meaning from migration 6.
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS config_assignments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        template_id INTEGER NOT NULL,
+        source TEXT,
+        external_key TEXT,
+        UNIQUE (user_id, template_id),
+        FOREIGN KEY (user_id) REFERENCES users (telegram_id) ON DELETE CASCADE,
+        FOREIGN KEY (template_id) REFERENCES config_templates (id)
+    )''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_config_assignments_template ON config_assignments (template_id)")
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_config_assignments_source_key "
+        "ON config_assignments (source, external_key) WHERE source IS NOT NULL"
+    )
+
+    # A template nobody is assigned any more is deleted with its last assignment
+    for event in ("DELETE", "UPDATE OF template_id"):
+        conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS config_templates_gc_{event.split()[0].lower()}
+        AFTER {event} ON config_assignments
+        WHEN NOT EXISTS (SELECT 1 FROM config_assignments WHERE template_id = old.template_id)
+        BEGIN
+            DELETE FROM config_templates WHERE id = old.template_id;
+        END''')
+
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'configs'").fetchone():
+        # Fold the per-user copies: the first copy of each config becomes its
+        # template, and assignments keep the old row ids, so open keyboards still work
+        conn.execute(
+            "INSERT INTO config_templates (hash, config_type, config_data) "
+            "SELECT config_hash(config_type, config_data), config_type, config_data FROM configs "
+            "WHERE true ORDER BY id ON CONFLICT (hash) DO NOTHING"
+        )
+        conn.execute(
+            "INSERT INTO config_assignments (id, user_id, template_id, source, external_key) "
+            "SELECT c.id, c.user_id, t.id, c.source, c.external_key FROM configs c "
+            "JOIN users u ON u.telegram_id = c.user_id "
+            "JOIN config_templates t ON t.hash = config_hash(c.config_type, c.config_data) "
+            "WHERE true ORDER BY c.id ON CONFLICT DO NOTHING"
+        )
+        # Templates whose only copies belonged to users that no longer exist
+        conn.execute(
+            "DELETE FROM config_templates WHERE id NOT IN (SELECT template_id FROM config_assignments)"
+        )
+        for trigger in ("configs_fts_insert", "configs_fts_delete", "configs_fts_update"):
+            conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        conn.execute("DROP TABLE IF EXISTS configs_fts")
+        conn.execute("DROP TABLE configs")
+
+    # The full-text index now covers each distinct config once
+    conn.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS configs_fts USING fts5("
+        "config_data, content='config_templates', content_rowid='id')"
+    )
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS config_templates_fts_insert AFTER INSERT ON config_templates BEGIN
+        INSERT INTO configs_fts (rowid, config_data) VALUES (new.id, new.config_data);
+    END''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS config_templates_fts_delete AFTER DELETE ON config_templates BEGIN
+        INSERT INTO configs_fts (configs_fts, rowid, config_data) VALUES ('delete', old.id, old.config_data);
+    END''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS config_templates_fts_update AFTER UPDATE OF config_data ON config_templates BEGIN
+        INSERT INTO configs_fts (configs_fts, rowid, config_data) VALUES ('delete', old.id, old.config_data);
+        INSERT INTO configs_fts (rowid, config_data) VALUES (new.id, new.config_data);
+    END''')
+    conn.execute("INSERT INTO configs_fts (configs_fts) VALUES ('rebuild')")
+
+def _broadcast_segments(conn):
+    # Per-language versions of a job's message; languages without one get the job's own message
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS broadcast_messages (
+        job_id INTEGER,
+        lang TEXT,
+        message_id INTEGER,
+        PRIMARY KEY (job_id, lang),
+        FOREIGN KEY (job_id) REFERENCES broadcast_jobs (id) ON DELETE CASCADE
+    ) WITHOUT ROWID''')
+    # Audience segments filter non-admin users by language and delivery status,
+    # and by the type or text of their configs
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_segment "
+        "ON users (delivery_status, language_code) WHERE is_admin = 0"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_config_templates_type ON config_templates (config_type COLLATE NOCASE)"
+    )
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "initial schema and lookup indexes", _initial_schema),
+    Migration(2, "persistent broadcast jobs", _broadcast_jobs),
+    Migration(3, "user delivery status", _delivery_status),
+    Migration(4, "tutorial media type", _tutorial_media_type),
+    Migration(5, "persistent FSM storage", _fsm_state),
+    Migration(6, "3x-ui panel sync", _panel_sync),
+    Migration(7, "user search indexes", _user_search),
+    Migration(8, "shared config templates", _config_templates),
+    Migration(9, "segmented broadcasts", _broadcast_segments),
+]
+
+# --- Runner ---
+
+def _current_version(conn) -> int:
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_at INTEGER
+    )''')
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+def _apply(conn, migration: Migration) -> None:
+    migration.apply(conn)
+    conn.execute(
+        "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+        (migration.version, migration.description, int(time.time()))
+    )
+
+async def migrate(db: Database) -> int:
+    """Brings the schema up to date and returns the resulting version."""
+    version = await db.write(_current_version)
+    pending = [m for m in MIGRATIONS if m.version > version]
+    if not pending:
+        return version
+
+    for migration in pending:
+        logger.info("Applying migration %s: %s", migration.version, migration.description)
+        await db.write(_apply, migration)
+        version = migration.version
+
+    # Refresh planner statistics for the new indexes
+    await db.write(lambda conn: conn.execute("PRAGMA optimize"))
+    return version
@@ -0,0 +1,235 @@
+# panel_sync.py
+
+import asyncio
+import base64
+import json
+import logging
+import os
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import quote, urlencode, urlsplit
+
+import aiohttp
+
+from database import PanelSyncDiff, db
+from subscription import subscription_cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 10.0  # seconds per panel, login included
+CONNECTIONS_PER_PANEL = 2
+
+# --- Panels ---
+
+class Panel(NamedTuple):
+    name: str
+    url: str             # panel address including its web base path
+    username: str
+    password: str
+    host: str            # public address put into the client links
+    timeout: float = DEFAULT_TIMEOUT
+
+def load_panels(path: str) -> List[Panel]:
+    """
+    Reads a JSON list of {"name", "url", "username", "password"[, "host", "timeout"]}.
+    A missing file means panel sync is off.
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        items = json.load(f)
+    return [
+        Panel(
+            name=item["name"],
+            url=item["url"].rstrip("/"),
+            username=item["username"],
+            password=item["password"],
+            host=item.get("host") or urlsplit(item["url"]).hostname,
+            timeout=float(item.get("timeout", DEFAULT_TIMEOUT))
+        )
+        for item in items
+    ]
+
+# --- Client Links ---
+
+def _stream_params(stream: Dict[str, Any]) -> Dict[str, str]:
+    network = stream.get("network", "tcp")
+    security = stream.get("security", "none")
+    params = {"type": network, "security": security}
+
+    if security == "tls":
+        tls = stream.get("tlsSettings", {})
+        params["sni"] = tls.get("serverName", "")
+        params["fp"] = tls.get("settings", {}).get("fingerprint", "")
+    elif security == "reality":
+        reality = stream.get("realitySettings", {})
+        settings = reality.get("settings", {})
+        params["pbk"] = settings.get("publicKey", "")
+        params["fp"] = settings.get("fingerprint", "")
+        params["sni"] = (reality.get("serverNames") or [""])[0]
+        params["sid"] = (reality.get("shortIds") or [""])[0]
+        params["spx"] = settings.get("spiderX", "")
+
+    if network == "ws":
+        ws = stream.get("wsSettings", {})
+        params["path"] = ws.get("path", "/")
+        params["host"] = ws.get("headers", {}).get("Host", "") or ws.get("host", "")
+    elif network == "grpc":
+        params["serviceName"] = stream.get("grpcSettings", {}).get("serviceName", "")
+    elif network in ("httpupgrade", "xhttp"):
+        settings = stream.get(f"{network}Settings", {})
+        params["path"] = settings.get("path", "/")
+        params["host"] = settings.get("host", "")
+    return {key: value for key, value in params.items() if value}
+
+def client_link(inbound: Dict[str, Any], client: Dict[str, Any], host: str) -> Optional[str]:
+    """Builds the share link 3x-ui would show for the client, or None for unsupported protocols."""
+    protocol = inbound.get("protocol")
+    stream = json.loads(inbound.get("streamSettings") or "{}")
+    port = inbound["port"]
+    remark = quote(f"{inbound.get('remark') or protocol}-{client.get('email', '')}")
+
+    if protocol == "vless":
+        params = _stream_params(stream)
+        params["encryption"] = "none"
+        if client.get("flow"):
+            params["flow"] = client["flow"]
+        return f"vless://{client['id']}@{host}:{port}?{urlencode(params)}#{remark}"
+    if protocol == "trojan":
+        params = _stream_params(stream)
+        return f"trojan://{quote(client['password'], safe='')}@{host}:{port}?{urlencode(params)}#{remark}"
+    if protocol == "vmess":
+        params = _stream_params(stream)
+        vmess = {
+            "v": "2", "ps": f"{inbound.get('remark') or protocol}-{client.get('email', '')}",
+            "add": host, "port": port, "id": client["id"], "scy": client.get("security", "auto"),
+            "net": params.get("type", "tcp"), "type": "none", "tls": params.get("security", "none"),
+            "path": params.get("path", params.get("serviceName", "")), "host": params.get("host", ""),
+            "sni": params.get("sni", ""), "fp": params.get("fp", ""),
+        }
+        return "vmess://" + base64.b64encode(json.dumps(vmess, separators=(",", ":")).encode()).decode()
+    if protocol == "shadowsocks":
+        settings = json.loads(inbound.get("settings") or "{}")
+        method = client.get("method") or settings.get("method", "")
+        password = client["password"]
+        if method.startswith("2022") and settings.get("password"):
+            # Multi-user 2022 ciphers need the server key in front of the user key
+            password = f"{settings['password']}:{password}"
+        userinfo = base64.urlsafe_b64encode(f"{method}:{password}".encode()).decode().rstrip("=")
+        return f"ss://{userinfo}@{host}:{port}#{remark}"
+    return None
+
+def panel_rows(panel: Panel, inbounds: List[Dict[str, Any]]) -> List[Tuple[str, int, str, str]]:
+    """Turns enabled clients that carry a Telegram ID into (external_key, user_id, config_type, config_data) rows."""
+    rows = []
+    for inbound in inbounds:
+        if not inbound.get("enable", True):
+            continue
+        settings = json.loads(inbound.get("settings") or "{}")
+        for client in settings.get("clients", []):
+            try:
+                user_id = int(client.get("tgId") or 0)
+            except (ValueError, TypeError):
+                continue
+            if user_id <= 0 or not client.get("enable", True) or not client.get("email"):
+                continue
+            link = client_link(inbound, client, panel.host)
+            if link is None:
+                continue
+            config_type = f"{inbound['protocol'].upper()} {inbound.get('remark') or panel.name}"[:64]
+            rows.append((f"{inbound['id']}:{client['email']}", user_id, config_type, link))
+    return rows
+
+# --- Sync ---
+
+class PanelSyncResult(NamedTuple):
+    panel: str
+    diff: Optional[PanelSyncDiff]
+    error: Optional[str] = None
+
+class PanelSyncError(Exception):
+    pass
+
+class PanelSyncer:
+    """
+    Polls every panel concurrently over one pooled aiohttp session and applies
+    only the differences to the configs table. Login cookies are kept per
+    panel and reused until the panel rejects them.
+    """
+
+    def __init__(self, panels: List[Panel]):
+        self.panels = panels
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._cookies: Dict[str, Dict[str, str]] = {}
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit_per_host=CONNECTIONS_PER_PANEL),
+                # Cookies are tracked per panel, several panels may share a host
+                cookie_jar=aiohttp.DummyCookieJar()
+            )
+        return self._session
+
+    async def _login(self, panel: Panel) -> None:
+        async with self._get_session().post(
+            f"{panel.url}/login", data={"username": panel.username, "password": panel.password}
+        ) as response:
+            payload = await response.json(content_type=None)
+            if response.status != 200 or not payload.get("success"):
+                raise PanelSyncError("login failed")
+            self._cookies[panel.name] = {name: morsel.value for name, morsel in response.cookies.items()}
+
+    async def _list_inbounds(self, panel: Panel) -> Optional[List[Dict[str, Any]]]:
+        """Returns None when the panel wants a new login."""
+        async with self._get_session().get(
+            f"{panel.url}/panel/api/inbounds/list", cookies=self._cookies.get(panel.name)
+        ) as response:
+            if response.status in (401, 403, 404) or "json" not in response.content_type:
+                return None
+            response.raise_for_status()
+            payload = await response.json()
+            if not payload.get("success"):
+                return None
+            return payload.get("obj") or []
+
+    async def fetch(self, panel: Panel) -> List[Dict[str, Any]]:
+        inbounds = await self._list_inbounds(panel) if panel.name in self._cookies else None
+        if inbounds is None:
+            await self._login(panel)
+            inbounds = await self._list_inbounds(panel)
+            if inbounds is None:
+                raise PanelSyncError("inbound list rejected after login")
+        return inbounds
+
+    async def sync_panel(self, panel: Panel) -> PanelSyncResult:
+        try:
+            inbounds = await asyncio.wait_for(self.fetch(panel), panel.timeout)
+            rows = panel_rows(panel, inbounds)
+        except (aiohttp.ClientError, asyncio.TimeoutError, PanelSyncError, ValueError, KeyError) as e:
+            error = str(e) or type(e).__name__
+            logger.warning("Panel %s sync failed: %s", panel.name, error)
+            await db.record_panel_sync_error(panel.name, error)
+            return PanelSyncResult(panel.name, None, error)
+        diff = await db.sync_panel_configs(panel.name, rows)
+        subscription_cache.invalidate_many(diff.user_ids)
+        return PanelSyncResult(panel.name, diff)
+
+    async def sync_all(self) -> List[PanelSyncResult]:
+        results = await asyncio.gather(*(self.sync_panel(panel) for panel in self.panels))
+        for result in results:
+            if result.diff and (result.diff.added or result.diff.updated or result.diff.removed):
+                logger.info("Panel %s: +%s ~%s -%s", result.panel, *result.diff[:3])
+        return list(results)
+
+    async def run(self, interval: float) -> None:
+        """Syncs every `interval` seconds until cancelled."""
+        while True:
+            try:
+                await self.sync_all()
+            except Exception:
+                logger.exception("Panel sync cycle failed")
+            await asyncio.sleep(interval)
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
@@ -0,0 +1,104 @@
+# scheduler.py
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, NamedTuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from metrics import scheduler_pending, scheduler_running, scheduler_shed, scheduler_users, scheduler_wait
+
+logger = logging.getLogger(__name__)
+
+MAX_CONCURRENT_UPDATES = 32
+MAX_PENDING_UPDATES = 1000
+
+class SchedulerStats(NamedTuple):
+    pending: int   # admitted and not finished, running ones included
+    running: int
+    users: int     # users with updates pending
+    shed: int
+
+class _UserQueue:
+    __slots__ = ("lock", "depth")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()  # FIFO, so a user's updates run in arrival order
+        self.depth = 0
+
+class UpdateScheduler(BaseMiddleware):
+    """
+    Update outer middleware that runs updates of different users concurrently,
+    at most `concurrency` at a time, and those of one user strictly one after
+    another. A user with a backlog holds at most one slot, so one busy admin
+    cannot slow everybody else down.
+
+    Updates beyond `max_pending` are dropped. Producers that can wait should
+    bound their in-flight updates to `max_pending` instead, e.g. with
+    start_polling(tasks_concurrency_limit=...), so nothing has to be dropped.
+
+    Must run before the FSM middleware, so the state an update reads is the
+    one the previous update of the same user left behind.
+    """
+
+    def __init__(self, concurrency: int = MAX_CONCURRENT_UPDATES, max_pending: int = MAX_PENDING_UPDATES):
+        self.max_pending = max_pending
+        self._slots = asyncio.Semaphore(concurrency)
+        self._users: Dict[int, _UserQueue] = {}
+        self.pending = 0
+        self.running = 0
+        self.shed = 0
+
+    def stats(self) -> SchedulerStats:
+        return SchedulerStats(self.pending, self.running, len(self._users), self.shed)
+
+    def _update_gauges(self) -> None:
+        scheduler_pending.set(self.pending)
+        scheduler_running.set(self.running)
+        scheduler_users.set(len(self._users))
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if self.pending >= self.max_pending:
+            self.shed += 1
+            scheduler_shed.inc(())
+            logger.warning("Update queue is full (%s), dropping an update", self.pending)
+            return None
+
+        user = data.get('event_from_user')
+        queue = None
+        if user is not None:
+            queue = self._users.get(user.id)
+            if queue is None:
+                queue = self._users[user.id] = _UserQueue()
+            queue.depth += 1
+        self.pending += 1
+        self._update_gauges()
+        queued_at = time.perf_counter()
+        try:
+            if queue is not None:
+                await queue.lock.acquire()
+            try:
+                async with self._slots:
+                    scheduler_wait.observe((), time.perf_counter() - queued_at)
+                    self.running += 1
+                    try:
+                        return await handler(event, data)
+                    finally:
+                        self.running -= 1
+            finally:
+                if queue is not None:
+                    queue.lock.release()
+        finally:
+            self.pending -= 1
+            if queue is not None:
+                queue.depth -= 1
+                if not queue.depth:
+                    del self._users[user.id]
+            self._update_gauges()
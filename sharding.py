@@ -0,0 +1,252 @@
+# sharding.py
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import signal
+import socket
+from functools import partial
+from multiprocessing.process import BaseProcess
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import aiohttp
+from aiogram import Bot, Dispatcher
+
+from middlewares import profile_cache
+from subscription import subscription_cache
+
+logger = logging.getLogger(__name__)
+
+POLL_TIMEOUT = 30          # seconds of Telegram long polling
+MAX_POLL_BACKOFF = 30.0    # seconds between getUpdates retries at most
+LINE_LIMIT = 16 * 1024 * 1024  # largest message accepted on a worker channel
+STOP_TIMEOUT = 30.0        # seconds a worker gets to finish its updates on shutdown
+
+# Process-local caches kept coherent across processes by their invalidate hooks
+CACHES = {"profile": profile_cache, "subscription": subscription_cache}
+
+# --- Shards ---
+# Every process talks to the ingress over a socketpair, one JSON document per
+# line: raw updates going to the workers and cache invalidations both ways.
+
+def update_user_id(update: Dict[str, Any]) -> int:
+    """Returns the ID of the user (or chat) an update comes from, 0 if none."""
+    for value in update.values():
+        if isinstance(value, dict):
+            sender = value.get("from") or value.get("user") or value.get("chat") or {}
+            return sender.get("id", 0)
+    return 0
+
+def shard_of(user_id: int, workers: int) -> int:
+    return user_id % workers
+
+def _encode(message: Dict[str, Any]) -> bytes:
+    return json.dumps(message, ensure_ascii=False, separators=(",", ":")).encode() + b"\n"
+
+class CacheBus:
+    """
+    Sends local cache invalidations to the ingress, which relays them to the
+    other workers. Invalidations are batched per loop iteration, so a bulk
+    import sends one message instead of one per user.
+    """
+
+    def __init__(self, send: Callable[[Dict[str, Any]], None]):
+        self._send = send
+        self._pending: Dict[str, Optional[Set[int]]] = {}
+        self._scheduled = False
+
+    def attach(self) -> None:
+        for name, cache in CACHES.items():
+            cache.invalidate_hook = partial(self.publish, name)
+
+    def publish(self, name: str, user_ids) -> None:
+        if user_ids is None:
+            self._pending[name] = None
+        elif name not in self._pending:
+            self._pending[name] = set(user_ids)
+        elif self._pending[name] is not None:
+            self._pending[name].update(user_ids)
+        if not self._scheduled:
+            self._scheduled = True
+            asyncio.get_running_loop().call_soon(self._flush)
+
+    def _flush(self) -> None:
+        pending, self._pending, self._scheduled = self._pending, {}, False
+        for name, user_ids in pending.items():
+            self._send({"invalidate": name, "ids": None if user_ids is None else list(user_ids)})
+
+def apply_invalidation(message: Dict[str, Any]) -> None:
+    CACHES[message["invalidate"]].discard(message["ids"])
+
+# --- Worker Processes ---
+
+def _worker_entry(target: Callable[[int, socket.socket], None], index: int,
+                  sock: socket.socket, inherited: List[socket.socket]) -> None:
+    # Ingress ends of the other channels must not be held open here,
+    # or a worker would never see its channel close
+    for other in inherited:
+        other.close()
+    # Ctrl+C reaches the whole process group; workers stop when the ingress closes their channel
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    target(index, sock)
+
+def start_workers(count: int, target: Callable[[int, socket.socket], None]) -> List[Tuple[BaseProcess, socket.socket]]:
+    """
+    Forks `count` processes running target(index, sock) and returns them with
+    the ingress end of each channel. Call it before starting an event loop or
+    opening the database, so the children inherit no threads or connections.
+    """
+    context = multiprocessing.get_context("fork")
+    workers: List[Tuple[BaseProcess, socket.socket]] = []
+    for index in range(count):
+        ingress_sock, worker_sock = socket.socketpair()
+        inherited = [sock for _, sock in workers] + [ingress_sock]
+        process = context.Process(
+            target=_worker_entry, args=(target, index, worker_sock, inherited), name=f"connex-worker-{index}"
+        )
+        process.start()
+        worker_sock.close()
+        workers.append((process, ingress_sock))
+    return workers
+
+def stop_workers(workers: List[Tuple[BaseProcess, socket.socket]]) -> None:
+    for process, _ in workers:
+        process.join(STOP_TIMEOUT)
+        if process.is_alive():
+            logger.warning("Worker %s did not stop in time, terminating it", process.name)
+            process.terminate()
+            process.join()
+
+async def _process_update(dp: Dispatcher, bot: Bot, update: Dict[str, Any]) -> None:
+    try:
+        await dp.feed_raw_update(bot, update)
+    except Exception:
+        logger.exception("Update %s failed", update.get("update_id"))
+
+async def serve_worker(dp: Dispatcher, bot: Bot, sock: socket.socket, tasks_concurrency_limit: int) -> None:
+    """
+    Handles the updates the ingress sends until it closes the channel. With
+    tasks_concurrency_limit updates in flight it stops reading, which in turn
+    pauses the ingress.
+    """
+    reader, writer = await asyncio.open_connection(sock=sock, limit=LINE_LIMIT)
+    CacheBus(lambda message: writer.write(_encode(message))).attach()
+    tasks: Set[asyncio.Task] = set()
+    slots = asyncio.Semaphore(tasks_concurrency_limit)
+    while line := await reader.readline():
+        message = json.loads(line)
+        if "update_id" in message:
+            await slots.acquire()
+            task = asyncio.create_task(_process_update(dp, bot, message))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            task.add_done_callback(lambda _: slots.release())
+        else:
+            apply_invalidation(message)
+    if tasks:
+        await asyncio.gather(*tasks)
+    writer.close()
+
+# --- Ingress ---
+
+class Ingress:
+    """
+    Receives updates (long polling or webhook) and forwards each one to the
+    worker owning its user, so a user's updates always reach the same process
+    in the order Telegram sent them, and that user's FSM state stays there.
+    """
+
+    def __init__(self, socks: List[socket.socket]):
+        self._socks = socks
+        self._writers: List[asyncio.StreamWriter] = []
+        self._readers: List[asyncio.Task] = []
+        self._worker_exited = asyncio.Event()
+
+    async def start(self) -> None:
+        for index, sock in enumerate(self._socks):
+            reader, writer = await asyncio.open_connection(sock=sock, limit=LINE_LIMIT)
+            self._writers.append(writer)
+            self._readers.append(asyncio.create_task(self._read(index, reader)))
+        # The ingress serves subscriptions, so it needs the workers' invalidations too
+        CacheBus(self._relay).attach()
+
+    async def _read(self, index: int, reader: asyncio.StreamReader) -> None:
+        while line := await reader.readline():
+            message = json.loads(line)
+            apply_invalidation(message)
+            self._relay(message, exclude=index)
+        logger.error("Worker %s exited", index)
+        self._worker_exited.set()
+
+    def _relay(self, message: Dict[str, Any], exclude: Optional[int] = None) -> None:
+        data = _encode(message)
+        for index, writer in enumerate(self._writers):
+            if index != exclude:
+                writer.write(data)
+
+    def dispatch(self, update: Dict[str, Any]) -> asyncio.StreamWriter:
+        writer = self._writers[shard_of(update_user_id(update), len(self._writers))]
+        writer.write(_encode(update))
+        return writer
+
+    async def forward(self, update: Dict[str, Any]) -> None:
+        """Webhook entry point: waits while the owning worker is behind."""
+        await self.dispatch(update).drain()
+
+    async def poll(self, bot: Bot, allowed_updates: List[str]) -> None:
+        """Long polling that hands raw updates to the workers without parsing them into objects."""
+        url = bot.session.api.api_url(token=bot.token, method="getUpdates")
+        offset, backoff = 0, 1.0
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=POLL_TIMEOUT + 10)) as session:
+            while True:
+                params = {"offset": offset, "timeout": POLL_TIMEOUT, "allowed_updates": json.dumps(allowed_updates)}
+                try:
+                    async with session.get(url, params=params) as response:
+                        payload = await response.json(content_type=None)
+                except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                    logger.warning("getUpdates failed: %s", str(e) or type(e).__name__)
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, MAX_POLL_BACKOFF)
+                    continue
+                if not payload.get("ok"):
+                    logger.error("getUpdates failed: %s", payload.get("description"))
+                    await asyncio.sleep(payload.get("parameters", {}).get("retry_after", backoff))
+                    backoff = min(backoff * 2, MAX_POLL_BACKOFF)
+                    continue
+                backoff = 1.0
+                writers = {self.dispatch(update) for update in payload["result"]}
+                if payload["result"]:
+                    offset = payload["result"][-1]["update_id"] + 1
+                # Stop polling while a worker is behind instead of buffering without limit
+                await asyncio.gather(*(writer.drain() for writer in writers))
+
+    async def run(self, bot: Bot, allowed_updates: Optional[List[str]] = None) -> None:
+        """
+        Polls when given allowed_updates, else just serves the webhook. Returns
+        on SIGINT/SIGTERM, as aiogram's polling does, or when a worker dies.
+        """
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+        waiters = [asyncio.create_task(stop.wait()), asyncio.create_task(self._worker_exited.wait())]
+        if allowed_updates is not None:
+            waiters.append(asyncio.create_task(self.poll(bot, allowed_updates)))
+        try:
+            done, _ = await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+        finally:
+            for task in waiters:
+                task.cancel()
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                loop.remove_signal_handler(signum)
+
+    async def close(self) -> None:
+        """Closes the channels; the workers finish their updates and exit."""
+        for writer in self._writers:
+            writer.close()
+        for task in self._readers:
+            task.cancel()
+        await asyncio.gather(*self._readers, return_exceptions=True)
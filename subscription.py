@@ -0,0 +1,144 @@
+# subscription.py
+
+import base64
+import hashlib
+import hmac
+from collections import OrderedDict
+from typing import Callable, Iterable, Optional, Tuple
+
+from aiohttp import web
+
+from database import db
+from middlewares import get_profile
+
+SUBSCRIPTION_CACHE_SIZE = 10_000
+SUBSCRIPTION_PATH = "/sub/{token}"
+# Hours between client refreshes, as understood by v2rayN, Hiddify and others
+UPDATE_INTERVAL_HOURS = 12
+
+_base_url = ""
+_secret = b""
+
+def configure(base_url: str, secret: str) -> None:
+    """Enables subscription links. An empty base_url keeps them off."""
+    global _base_url, _secret
+    _base_url = base_url.rstrip("/")
+    _secret = secret.encode()
+
+def is_enabled() -> bool:
+    return bool(_base_url)
+
+# --- Tokens ---
+
+def _signature(user_id: int) -> str:
+    digest = hmac.new(_secret, str(user_id).encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:18]).decode()
+
+def make_token(user_id: int) -> str:
+    return f"{user_id}.{_signature(user_id)}"
+
+def parse_token(token: str) -> Optional[int]:
+    """Returns the user id of a valid token."""
+    user_id, _, signature = token.partition(".")
+    if not user_id.isdigit() or not hmac.compare_digest(signature, _signature(int(user_id))):
+        return None
+    return int(user_id)
+
+def subscription_url(user_id: int) -> str:
+    return _base_url + SUBSCRIPTION_PATH.format(token=make_token(user_id))
+
+# --- Response Cache ---
+
+class SubscriptionCache:
+    """
+    LRU cache of rendered subscriptions as (etag, body). Whoever changes a
+    user's configs must call invalidate() with that user's id.
+
+    The version lets a render that raced with an invalidation be dropped
+    instead of caching configs that are already stale.
+    """
+
+    def __init__(self, maxsize: int = SUBSCRIPTION_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.version = 0
+        self._entries: "OrderedDict[int, Tuple[str, bytes]]" = OrderedDict()
+        # Called with the invalidated user IDs (None for all), like ProfileCache.invalidate_hook
+        self.invalidate_hook: Optional[Callable[[Optional[Iterable[int]]], None]] = None
+
+    def get(self, user_id: int) -> Optional[Tuple[str, bytes]]:
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            self._entries.move_to_end(user_id)
+        return entry
+
+    def set(self, user_id: int, entry: Tuple[str, bytes], version: int) -> None:
+        if version != self.version:
+            return
+        self._entries[user_id] = entry
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        self.invalidate_many((user_id,))
+
+    def invalidate_many(self, user_ids: Iterable[int]) -> None:
+        user_ids = list(user_ids)
+        self.discard(user_ids)
+        if self.invalidate_hook is not None:
+            self.invalidate_hook(user_ids)
+
+    def clear(self) -> None:
+        self.discard(None)
+        if self.invalidate_hook is not None:
+            self.invalidate_hook(None)
+
+    def discard(self, user_ids: Optional[Iterable[int]]) -> None:
+        """Drops entries (all for None) without calling the hook."""
+        self.version += 1
+        if user_ids is None:
+            self._entries.clear()
+            return
+        for user_id in user_ids:
+            self._entries.pop(user_id, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+subscription_cache = SubscriptionCache()
+
+async def _render(user_id: int) -> Tuple[str, bytes]:
+    configs = await db.get_configs_for_user(user_id)
+    # Files are Telegram file_ids and mean nothing to a VPN client
+    links = "\n".join(config.config_data for config in configs if not config.config_type.startswith("file:"))
+    body = base64.b64encode(links.encode())
+    etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+    return etag, body
+
+# --- Endpoint ---
+
+async def handle_subscription(request: web.Request) -> web.Response:
+    user_id = parse_token(request.match_info["token"])
+    if user_id is None:
+        raise web.HTTPNotFound()
+
+    entry = subscription_cache.get(user_id)
+    if entry is None:
+        version = subscription_cache.version
+        if await get_profile(user_id) is None:
+            raise web.HTTPNotFound()
+        entry = await _render(user_id)
+        subscription_cache.set(user_id, entry, version)
+
+    etag, body = entry
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "no-cache",
+        "Profile-Update-Interval": str(UPDATE_INTERVAL_HOURS),
+    }
+    if etag in request.headers.get("If-None-Match", ""):
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=body, content_type="text/plain", charset="utf-8", headers=headers)
+
+def setup_subscription(app: web.Application) -> None:
+    app.router.add_get(SUBSCRIPTION_PATH, handle_subscription)
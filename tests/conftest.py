@@ -0,0 +1,25 @@
+# tests/conftest.py
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database  # noqa: E402
+from migrations import migrate  # noqa: E402
+
+@pytest.fixture
+def db(tmp_path):
+    """A migrated bot.db in a temporary directory."""
+    database = Database(str(tmp_path / "bot.db"))
+
+    async def _open():
+        await database.connect()
+        await migrate(database)
+
+    asyncio.run(_open())
+    yield database
+    asyncio.run(database.close())
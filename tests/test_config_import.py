@@ -0,0 +1,34 @@
+# tests/test_config_import.py
+
+import asyncio
+import io
+
+from config_import import parse_config_file
+
+def test_ids_outside_sqlite_range_are_invalid():
+    csv_rows = parse_config_file(io.BytesIO(
+        b"telegram_id,config_type,config_data\n"
+        b"9223372036854775807,VLESS,vless://a\n"
+        b"9223372036854775808,VLESS,vless://b\n"
+        b"99999999999999999999,VLESS,vless://c\n"
+    ), "configs.csv")
+    jsonl_rows = parse_config_file(io.BytesIO(
+        b'{"telegram_id": 1e30, "config_type": "SS", "config_data": "ss://a"}\n'
+        b'{"telegram_id": Infinity, "config_type": "SS", "config_data": "ss://b"}\n'
+    ), "configs.jsonl")
+
+    assert [row[0] for row in csv_rows.rows] == [9223372036854775807]
+    assert csv_rows.invalid == 2
+    assert jsonl_rows.rows == [] and jsonl_rows.invalid == 2
+
+def test_oversized_id_does_not_abort_import(db):
+    async def run():
+        await db.add_user(42)
+        result = parse_config_file(io.BytesIO(b"99999999999999999999,VLESS,vless://x\n42,VLESS,vless://y\n"), "c.csv")
+        await db.import_configs(result.rows)
+        return result, await db.get_configs_for_user(42)
+
+    result, configs = asyncio.run(run())
+
+    assert result.invalid == 1
+    assert [config.config_data for config in configs] == ['vless://y']
@@ -0,0 +1,44 @@
+# tests/test_config_rotation.py
+
+import asyncio
+from functools import partial
+
+from config_rotation import apply_rotation_rules, parse_rotation_rules
+
+def _rotate(db, rules: str):
+    return asyncio.run(db.rotate_configs(partial(apply_rotation_rules, parse_rotation_rules(rules))))
+
+def _configs(db, user_id: int):
+    return sorted(config.config_data for config in asyncio.run(db.get_configs_for_user(user_id)))
+
+def test_merge_into_later_template_is_rewritten_once(db):
+    async def seed():
+        for user_id in (2, 3):
+            await db.add_user(user_id)
+        await db.insert_config(2, 'VLESS', 'vless://id@host')
+        # Created later, so its template has the higher id
+        await db.insert_config(3, 'VLESS', 'vless://id@host2')
+    asyncio.run(seed())
+
+    result = _rotate(db, "host -> host2")
+
+    assert _configs(db, 2) == ['vless://id@host2']
+    assert _configs(db, 3) == ['vless://id@host22']
+    assert (result.templates, result.assignments, result.users) == (2, 2, 2)
+
+def test_merge_into_unchanged_template_skips_its_users(db):
+    async def seed():
+        for user_id in (2, 3, 4):
+            await db.add_user(user_id)
+        await db.insert_config(2, 'VLESS', 'vless://id@old')
+        await db.insert_config(3, 'VLESS', 'vless://id@old')
+        await db.insert_config(3, 'VLESS', 'vless://id@new')
+        await db.insert_config(4, 'VLESS', 'vless://id@new')
+    asyncio.run(seed())
+
+    result = _rotate(db, "old -> new")
+
+    assert [_configs(db, user_id) for user_id in (2, 3, 4)] == [['vless://id@new']] * 3
+    # Users 3 and 4 already had the new config
+    assert (result.templates, result.assignments, result.users) == (1, 1, 1)
+    assert [telegram_id for telegram_id, _, _ in result.recipients] == [2]
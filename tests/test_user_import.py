@@ -0,0 +1,19 @@
+# tests/test_user_import.py
+
+import asyncio
+import io
+
+from user_import import parse_user_rows
+
+def test_ids_outside_sqlite_range_are_invalid():
+    result = parse_user_rows(io.BytesIO(b"id\n9223372036854775807\n9223372036854775808\n99999999999999999999\n0\n"))
+
+    assert [row[0] for row in result.rows] == [9223372036854775807]
+    assert result.invalid == 3
+
+def test_oversized_id_does_not_abort_import(db):
+    result = parse_user_rows(io.BytesIO(b"99999999999999999999\n42,someone,ru\n"))
+    asyncio.run(db.import_users(result.rows))
+
+    assert result.invalid == 1
+    assert asyncio.run(db.get_user(42)).language_code == 'ru'
@@ -0,0 +1,24 @@
+# tests/test_user_search.py
+
+import asyncio
+
+def test_id_beyond_sqlite_range_searches_text_only(db):
+    async def run():
+        await db.add_user(42, 'someone')
+        await db.insert_config(42, 'VLESS', 'vless://id@host:9999999999999999999')
+        return (await db.search_users('9999999999999999999', 10),
+                await db.search_users('99999999999999999999999', 10))
+
+    (by_text, more), (nothing, _) = asyncio.run(run())
+
+    assert [user.telegram_id for user in by_text] == [42] and not more
+    assert nothing == []
+
+def test_max_id_is_still_matched_exactly(db):
+    async def run():
+        await db.add_user(2 ** 63 - 1)
+        return await db.search_users(str(2 ** 63 - 1), 10)
+
+    users, _ = asyncio.run(run())
+
+    assert [user.telegram_id for user in users] == [2 ** 63 - 1]
@@ -0,0 +1,98 @@
+# tutorial_media.py
+
+import base64
+import json
+import struct
+from typing import List, Optional, Tuple
+
+from aiogram import Bot, types
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InputMediaAnimation, InputMediaDocument, InputMediaPhoto, InputMediaVideo
+
+# --- Media Types ---
+PHOTO = 'photo'
+VIDEO = 'video'
+DOCUMENT = 'document'
+ANIMATION = 'animation'
+ALBUM = 'album'  # file_id holds a JSON list of [media_type, file_id] pairs
+
+# File type ids encoded at the start of a Bot API file_id
+_FILE_ID_TYPES = {2: PHOTO, 4: VIDEO, 5: DOCUMENT, 10: ANIMATION, 17: DOCUMENT}
+
+_INPUT_MEDIA = {
+    PHOTO: InputMediaPhoto,
+    VIDEO: InputMediaVideo,
+    DOCUMENT: InputMediaDocument,
+    ANIMATION: InputMediaAnimation,
+}
+
+def media_type_from_file_id(file_id: str) -> Optional[str]:
+    """
+    Reads the media type stored inside a Bot API file_id (urlsafe base64 with
+    zero-byte run-length encoding). Returns None if it cannot be decoded.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(file_id + "=" * (-len(file_id) % 4))
+    except (ValueError, TypeError):
+        return None
+    decoded = bytearray()
+    i = 0
+    while i < len(raw):
+        if raw[i] == 0 and i + 1 < len(raw):
+            decoded.extend(b"\0" * raw[i + 1])
+            i += 2
+        else:
+            decoded.append(raw[i])
+            i += 1
+    if len(decoded) < 4:
+        return None
+    type_id = struct.unpack("<i", bytes(decoded[:4]))[0] & 0xFFFFFF
+    return _FILE_ID_TYPES.get(type_id)
+
+def extract_media(message: types.Message) -> Optional[Tuple[str, str]]:
+    """Returns (media_type, file_id) of the message's attachment."""
+    if message.photo:
+        return PHOTO, message.photo[-1].file_id
+    if message.video:
+        return VIDEO, message.video.file_id
+    # Animations also carry a document, so check them first
+    if message.animation:
+        return ANIMATION, message.animation.file_id
+    if message.document:
+        return DOCUMENT, message.document.file_id
+    return None
+
+def encode_album(items: List[Tuple[str, str]]) -> str:
+    return json.dumps(items)
+
+def decode_album(file_id: str) -> List[Tuple[str, str]]:
+    return [tuple(item) for item in json.loads(file_id)]
+
+async def send_tutorial_media(bot: Bot, chat_id: int, media_type: Optional[str],
+                              file_id: str, caption: str) -> str:
+    """
+    Sends tutorial media with one correctly typed call and returns the media type.
+    Rows whose type could not be backfilled fall back to photo, then video.
+    """
+    if media_type == ALBUM:
+        items = decode_album(file_id)
+        await bot.send_media_group(chat_id=chat_id, media=[
+            _INPUT_MEDIA[item_type](media=item_file_id, caption=caption if i == 0 else None)
+            for i, (item_type, item_file_id) in enumerate(items)
+        ])
+    elif media_type == PHOTO:
+        await bot.send_photo(chat_id=chat_id, photo=file_id, caption=caption)
+    elif media_type == VIDEO:
+        await bot.send_video(chat_id=chat_id, video=file_id, caption=caption)
+    elif media_type == ANIMATION:
+        await bot.send_animation(chat_id=chat_id, animation=file_id, caption=caption)
+    elif media_type == DOCUMENT:
+        await bot.send_document(chat_id=chat_id, document=file_id, caption=caption)
+    else:
+        try:
+            await bot.send_photo(chat_id=chat_id, photo=file_id, caption=caption)
+            media_type = PHOTO
+        except TelegramBadRequest:
+            await bot.send_video(chat_id=chat_id, video=file_id, caption=caption)
+            media_type = VIDEO
+    return media_type
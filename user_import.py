@@ -0,0 +1,68 @@
+# user_import.py
+
+import csv
+import io
+import re
+from typing import BinaryIO, List, NamedTuple, Optional, Tuple
+
+from database import MAX_TELEGRAM_ID
+from localization import locales
+
+# Bot API refuses to serve files larger than this to bots
+MAX_IMPORT_FILE_SIZE = 20 * 1024 * 1024
+
+_USERNAME_RE = re.compile(r"^[A-Za-z0-9_]{4,32}$")
+
+class ImportRows(NamedTuple):
+    rows: List[Tuple[int, Optional[str], str]]  # (telegram_id, username, language_code)
+    duplicates: int  # IDs repeated within the file
+    invalid: int
+
+def _parse_row(cells: List[str]) -> Optional[Tuple[int, Optional[str], str]]:
+    cells = [cell.strip() for cell in cells]
+    try:
+        telegram_id = int(cells[0])
+    except (ValueError, IndexError):
+        return None
+    if not 0 < telegram_id <= MAX_TELEGRAM_ID:
+        return None
+
+    username = cells[1].lstrip("@") if len(cells) > 1 and cells[1] else None
+    if username is not None and not _USERNAME_RE.match(username):
+        return None
+
+    language_code = cells[2].lower() if len(cells) > 2 and cells[2] else 'en'
+    if language_code not in locales:
+        language_code = 'en'
+    return telegram_id, username, language_code
+
+def parse_user_rows(stream: BinaryIO) -> ImportRows:
+    """
+    Reads a TXT (one ID per line) or CSV (id[,username[,language]]) file.
+    The delimiter may be a comma, semicolon or tab; a header line is skipped.
+    """
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", errors="replace", newline="")
+    rows: List[Tuple[int, Optional[str], str]] = []
+    seen = set()
+    duplicates = invalid = 0
+    delimiter = None
+
+    for line in text:
+        if not line.strip():
+            continue
+        first_line = delimiter is None
+        if first_line:
+            delimiter = max(",;\t", key=line.count)
+        cells = next(csv.reader([line], delimiter=delimiter))
+        row = _parse_row(cells)
+        if row is None:
+            # A non-numeric first line is a header, not an error
+            if not (first_line and not cells[0].strip().lstrip("-").isdigit()):
+                invalid += 1
+            continue
+        if row[0] in seen:
+            duplicates += 1
+            continue
+        seen.add(row[0])
+        rows.append(row)
+    return ImportRows(rows, duplicates, invalid)
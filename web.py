@@ -0,0 +1,68 @@
+# web.py
+
+import logging
+from typing import Any, Awaitable, Callable, Dict, List
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+logger = logging.getLogger(__name__)
+
+def create_web_app() -> web.Application:
+    """Creates the aiohttp application shared by every HTTP feature of the bot."""
+    return web.Application()
+
+def setup_webhook(app: web.Application, dp: Dispatcher, bot: Bot,
+                  base_url: str, path: str, secret: str) -> None:
+    """
+    Serves updates on `path`. Telegram's secret token header is verified and
+    each update is acknowledged at once and processed as a background task.
+    The webhook is set on startup and removed on shutdown.
+    """
+    async def on_startup(bot: Bot):
+        url = base_url.rstrip("/") + path
+        await bot.set_webhook(url, secret_token=secret, allowed_updates=dp.resolve_used_update_types())
+        logger.info("Webhook set to %s", url)
+
+    async def on_shutdown(bot: Bot):
+        await bot.delete_webhook()
+
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    # Register the dispatcher hooks first so the webhook is removed before the bot session closes
+    setup_application(app, dp, bot=bot)
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret, handle_in_background=True).register(app, path=path)
+
+def setup_webhook_forwarding(app: web.Application, bot: Bot, base_url: str, path: str, secret: str,
+                             allowed_updates: List[str],
+                             forward: Callable[[Dict[str, Any]], Awaitable[None]]) -> None:
+    """
+    Like setup_webhook, but hands every raw update to `forward` instead of a
+    dispatcher. Used by the ingress process when updates run in worker processes.
+    """
+    async def handle_update(request: web.Request) -> web.Response:
+        if request.headers.get("X-Telegram-Bot-Api-Secret-Token") != secret:
+            raise web.HTTPUnauthorized()
+        await forward(await request.json())
+        return web.Response()
+
+    async def on_startup(app: web.Application):
+        url = base_url.rstrip("/") + path
+        await bot.set_webhook(url, secret_token=secret, allowed_updates=allowed_updates)
+        logger.info("Webhook set to %s", url)
+
+    async def on_shutdown(app: web.Application):
+        await bot.delete_webhook()
+        await bot.session.close()
+
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
+    app.router.add_post(path, handle_update)
+
+async def start_web_app(app: web.Application, host: str, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Serving HTTP on %s:%s", host, port)
+    return runner